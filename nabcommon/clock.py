@@ -0,0 +1,154 @@
+import asyncio, datetime, selectors, threading, time
+
+class Clock(object):
+  """
+  Source of time for daemons.
+  The real clock reads system clocks. Event loops may provide their own clock
+  (see VirtualTimeEventLoop), retrieved with Clock.of(loop).
+  """
+  def monotonic(self):
+    return time.monotonic()
+
+  def time(self):
+    return time.time()
+
+  def now(self, tz=datetime.timezone.utc):
+    """
+    Return current date, in UTC by default, or local time without a
+    timezone if tz is None.
+    """
+    return datetime.datetime.fromtimestamp(self.time(), tz)
+
+  @staticmethod
+  def of(loop=None):
+    """
+    Return the clock of loop (current loop by default).
+    """
+    if loop == None:
+      loop = asyncio.get_event_loop()
+    return getattr(loop, 'clock', Clock.REAL)
+
+Clock.REAL = Clock()
+
+class VirtualClock(Clock):
+  """
+  Clock that only moves when advanced.
+  Wall time starts at start_time (now by default).
+  """
+  MONOTONIC_START = 1000.0
+
+  def __init__(self, start_time=None):
+    if start_time == None:
+      start_time = time.time()
+    self.start_time = start_time
+    self.elapsed = 0.0
+
+  def monotonic(self):
+    return VirtualClock.MONOTONIC_START + self.elapsed
+
+  def time(self):
+    return self.start_time + self.elapsed
+
+  def advance(self, delay):
+    self.elapsed = self.elapsed + delay
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+  """
+  Selector that never waits for timers: instead of sleeping until the next
+  timer, it lets the loop advance its virtual clock.
+  """
+  def __init__(self):
+    super().__init__()
+    self.loop = None
+
+  def select(self, timeout=None):
+    if timeout != 0:
+      events = super().select(0)
+      if len(events) > 0:
+        return events
+      timeout = self.loop._idle(timeout)
+    return super().select(timeout)
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+  """
+  Event loop running on a virtual clock.
+  Sockets, pipes and thread-safe calls are real, but timers (asyncio.sleep,
+  wait_for timeouts, call_later) fire without waiting once the loop is idle.
+  With auto_advance, time jumps to the next timer as soon as there is no
+  I/O ready. Otherwise time only moves when another thread calls advance(),
+  which is convenient to drive a daemon from a test thread.
+  Time does not move while executor jobs are running, as they take real
+  time. Other threads (e.g. leds thread) are not tracked.
+  """
+  def __init__(self, clock=None, auto_advance=True):
+    self.clock = clock if clock != None else VirtualClock()
+    self.auto_advance = auto_advance
+    self.target = None          # virtual time to reach before settling
+    self.settled = []           # threading.Event to set once target is reached
+    self.executor_jobs = 0
+    selector = _VirtualTimeSelector()
+    selector.loop = self
+    super().__init__(selector)
+
+  def time(self):
+    return self.clock.monotonic()
+
+  def _idle(self, timeout):
+    """
+    Advance virtual time when nothing is ready.
+    timeout is the delay until the next timer, or None if there is none.
+    Return the timeout for the real select call.
+    Thread: loop
+    """
+    if self.executor_jobs > 0:
+      return None
+    if self.auto_advance:
+      remaining = float('inf')
+    elif self.target != None:
+      remaining = max(0.0, self.target - self.time())
+    else:
+      remaining = 0.0
+    if timeout != None and timeout <= remaining:
+      self.clock.advance(timeout)
+      return 0
+    if not self.auto_advance:
+      self.clock.advance(remaining)
+    self.target = None
+    settled = self.settled
+    self.settled = []
+    for event in settled:
+      event.set()
+    return None
+
+  def run_in_executor(self, executor, func, *args):
+    future = super().run_in_executor(executor, func, *args)
+    self.executor_jobs = self.executor_jobs + 1
+    future.add_done_callback(self._executor_job_done)
+    return future
+
+  def _executor_job_done(self, future):
+    self.executor_jobs = self.executor_jobs - 1
+
+  def advance(self, delay, timeout=10.0):
+    """
+    Advance virtual time by delay seconds, firing timers in order, and wait
+    until the loop is idle.
+    Thread: any but loop
+    """
+    settled = threading.Event()
+    self.call_soon_threadsafe(self._advance, delay, settled)
+    if not settled.wait(timeout):
+      raise TimeoutError('Virtual time loop did not settle')
+
+  def _advance(self, delay, settled):
+    if self.target == None:
+      self.target = self.time()
+    self.target = self.target + delay
+    self.settled.append(settled)
+
+  def release(self):
+    """
+    Switch to auto advance, for example to let tasks complete at shutdown.
+    Thread: any
+    """
+    self.call_soon_threadsafe(setattr, self, 'auto_advance', True)
@@ -4,6 +4,7 @@ from lockfile.pidlockfile import PIDLockFile
 from lockfile import AlreadyLocked, LockFailed
 from django.conf import settings
 from django.apps import apps
+from .clock import Clock
 
 class NabService(ABC):
   PORT_NUMBER = 10543
@@ -32,6 +33,7 @@ class NabService(ABC):
     self.reader = None
     self.writer = None
     self.loop = None
+    self.clock = Clock.REAL
     self.running = True
     signal.signal(signal.SIGUSR1, self.signal_handler)
 
@@ -71,6 +73,7 @@ class NabService(ABC):
 
   def connect(self):
     self.loop = asyncio.get_event_loop()
+    self.clock = Clock.of(self.loop)
     self._do_connect(NabService.MAX_RETRY)
     self.loop.create_task(self.client_loop())
 
@@ -190,7 +193,7 @@ class NabRecurrentService(NabService, ABC):
       async with self.loop_cv:
         while self.running:
           try:
-            now = datetime.datetime.now(datetime.timezone.utc)
+            now = self.clock.now()
             next_date = self.next_date
             next_args = self.next_args
             if next_date != None and next_date <= now:
@@ -278,7 +281,7 @@ class NabRandomService(NabRecurrentService, ABC):
     """
     if frequency == 0:
       return None
-    now = datetime.datetime.now(datetime.timezone.utc)
+    now = self.clock.now()
     next_delta = self.compute_random_delta(frequency)
     return now + datetime.timedelta(seconds = next_delta)
 
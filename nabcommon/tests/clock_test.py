@@ -0,0 +1,81 @@
+import unittest, asyncio, threading, time, datetime
+from nabcommon.clock import Clock, VirtualClock, VirtualTimeEventLoop
+
+class TestClock(unittest.TestCase):
+  def test_real_clock(self):
+    loop = asyncio.new_event_loop()
+    try:
+      self.assertIs(Clock.of(loop), Clock.REAL)
+    finally:
+      loop.close()
+    self.assertEqual(Clock.REAL.now().tzinfo, datetime.timezone.utc)
+
+  def test_virtual_clock(self):
+    clock = VirtualClock(946684800.0)
+    self.assertEqual(clock.now(), datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc))
+    start = clock.monotonic()
+    clock.advance(90)
+    self.assertEqual(clock.monotonic() - start, 90)
+    self.assertEqual(clock.now(), datetime.datetime(2000, 1, 1, 0, 1, 30, tzinfo=datetime.timezone.utc))
+
+class TestVirtualTimeEventLoop(unittest.TestCase):
+  def test_auto_advance(self):
+    loop = VirtualTimeEventLoop()
+    asyncio.set_event_loop(loop)
+    events = []
+    async def sleeper(name, delay):
+      await asyncio.sleep(delay)
+      events.append((name, loop.time()))
+    try:
+      self.assertIs(Clock.of(loop), loop.clock)
+      start_time = time.monotonic()
+      start = loop.time()
+      loop.run_until_complete(asyncio.gather(sleeper('long', 3600), sleeper('short', 15)))
+      self.assertLess(time.monotonic() - start_time, 1.0)
+      self.assertEqual(events, [('short', start + 15), ('long', start + 3600)])
+    finally:
+      loop.close()
+      asyncio.set_event_loop(None)
+
+  def test_executor_jobs(self):
+    loop = VirtualTimeEventLoop()
+    asyncio.set_event_loop(loop)
+    async def timeout():
+      await asyncio.sleep(10)
+      return 'timeout'
+    async def job():
+      return await loop.run_in_executor(None, time.sleep, 0.1)
+    try:
+      timeout_task = loop.create_task(timeout())
+      loop.run_until_complete(job())
+      self.assertFalse(timeout_task.done())
+      timeout_task.cancel()
+      loop.run_until_complete(asyncio.sleep(0))
+    finally:
+      loop.close()
+      asyncio.set_event_loop(None)
+
+  def test_manual_advance(self):
+    loop = VirtualTimeEventLoop(auto_advance=False)
+    events = []
+    def thread_loop():
+      asyncio.set_event_loop(loop)
+      loop.run_forever()
+    async def sleeper(delay):
+      await asyncio.sleep(delay)
+      events.append(delay)
+    thread = threading.Thread(target = thread_loop)
+    thread.start()
+    try:
+      loop.call_soon_threadsafe(lambda: asyncio.ensure_future(sleeper(5)))
+      loop.call_soon_threadsafe(lambda: asyncio.ensure_future(sleeper(20)))
+      loop.advance(0)
+      self.assertEqual(events, [])
+      loop.advance(10)
+      self.assertEqual(events, [5])
+      loop.advance(10)
+      self.assertEqual(events, [5, 20])
+    finally:
+      loop.call_soon_threadsafe(loop.stop)
+      thread.join(5)
+      loop.close()
@@ -1,8 +1,7 @@
 import struct
 import numpy as np
 import traceback
-from concurrent.futures import ThreadPoolExecutor
-from kaldiasr.nnet3 import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder
+from .executors import registry
 
 class ASR:
   """
@@ -14,10 +13,11 @@ class ASR:
   DEFAULT_LOCALE = 'fr_FR'
   
   def __init__(self, locale):
-    self.executor = ThreadPoolExecutor(max_workers=1)
+    self.executor = registry.lane('asr')
     self._load_model(locale)
 
   def _load_model(self, locale):
+    from kaldiasr.nnet3 import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder
     if locale in ASR.MODELS:
       path = ASR.MODELS[locale]
     else:
@@ -0,0 +1,253 @@
+import socket
+import threading
+import traceback
+import urllib.request
+import wave
+
+class RingBuffer(object):
+  """
+  Bounded byte ring buffer between a producer (decoder) thread and a consumer
+  (playback) thread, with underrun and overrun accounting.
+  """
+  def __init__(self, capacity):
+    self.buffer = bytearray(capacity)
+    self.capacity = capacity
+    self.read_pos = 0
+    self.size = 0
+    self.eof = False
+    self.closed = False
+    self.underruns = 0
+    self.overruns = 0
+    self.condition = threading.Condition()
+
+  def write(self, data, timeout=None):
+    """
+    Write data, waiting up to timeout for enough space.
+    If there still is not enough space, the oldest data is dropped and this
+    is counted as an overrun.
+    Return False if the buffer was closed by the consumer.
+    Thread: producer
+    """
+    with self.condition:
+      if len(data) > self.capacity:
+        data = data[-self.capacity:]
+      self.condition.wait_for(lambda: self.closed or self.capacity - self.size >= len(data), timeout)
+      if self.closed:
+        return False
+      free = self.capacity - self.size
+      if free < len(data):
+        self.overruns = self.overruns + 1
+        dropped = len(data) - free
+        self.read_pos = (self.read_pos + dropped) % self.capacity
+        self.size = self.size - dropped
+      write_pos = (self.read_pos + self.size) % self.capacity
+      first = min(len(data), self.capacity - write_pos)
+      self.buffer[write_pos:write_pos + first] = data[:first]
+      self.buffer[0:len(data) - first] = data[first:]
+      self.size = self.size + len(data)
+      self.condition.notify_all()
+      return True
+
+  def end_of_stream(self):
+    """
+    Signal that no more data will be written.
+    Thread: producer
+    """
+    with self.condition:
+      self.eof = True
+      self.condition.notify_all()
+
+  def close(self):
+    """
+    Signal that no more data will be read, unblocking the producer.
+    Thread: consumer
+    """
+    with self.condition:
+      self.closed = True
+      self.condition.notify_all()
+
+  def wait_for_level(self, level, timeout=None):
+    """
+    Wait until the buffer holds at least level bytes or the stream ended.
+    Return True if level was reached or stream ended.
+    """
+    with self.condition:
+      return self.condition.wait_for(lambda: self.eof or self.size >= level, timeout)
+
+  def read(self, count, timeout=None):
+    """
+    Read count bytes, waiting up to timeout for them.
+    If not enough data arrived in time, this is counted as an underrun and
+    available data is padded with silence.
+    At the end of the stream, return remaining data, possibly shorter, and
+    finally an empty bytes object.
+    Thread: consumer
+    """
+    with self.condition:
+      self.condition.wait_for(lambda: self.eof or self.size >= count, timeout)
+      available = min(count, self.size)
+      first = min(available, self.capacity - self.read_pos)
+      data = bytes(self.buffer[self.read_pos:self.read_pos + first]) + bytes(self.buffer[0:available - first])
+      self.read_pos = (self.read_pos + available) % self.capacity
+      self.size = self.size - available
+      self.condition.notify_all()
+      if available < count and not self.eof:
+        self.underruns = self.underruns + 1
+        data = data + bytes(count - available)
+      return data
+
+class AudioStream(object):
+  """
+  Audio stream decoded incrementally into a bounded ring buffer.
+  Supported sources are http(s):// URLs, unix:<path> sockets and file://
+  paths (typically FIFOs).
+  MP3 streams are decoded with mpg123, WAV streams are detected from their
+  RIFF header.
+  """
+  SCHEMES = ['http://', 'https://', 'unix:', 'file://']
+  READ_SIZE = 4096
+  WRITE_TIMEOUT = 1.0
+
+  def __init__(self, url, buffer_duration=4.0, prebuffer_duration=1.0):
+    self.url = url
+    self.buffer_duration = buffer_duration
+    self.prebuffer_duration = prebuffer_duration
+    self.format = None
+    self.ring = None
+    self.error = None
+    self.ready = threading.Event()
+    self.thread = None
+    self.source = None
+
+  @staticmethod
+  def is_stream(resource):
+    for scheme in AudioStream.SCHEMES:
+      if resource.startswith(scheme):
+        return True
+    return False
+
+  def start(self):
+    self.thread = threading.Thread(target = self._run, name = 'audio-stream', daemon = True)
+    self.thread.start()
+
+  def wait_until_prebuffered(self, timeout=None):
+    """
+    Wait until the stream format is known and the pre-buffer is filled.
+    Return the format (rate, channels, width) or None if stream failed.
+    Thread: consumer
+    """
+    if not self.ready.wait(timeout):
+      return None
+    if self.ring == None:
+      return None
+    (rate, channels, width) = self.format
+    prebuffer = int(rate * self.prebuffer_duration) * channels * width
+    self.ring.wait_for_level(prebuffer, timeout)
+    return self.format
+
+  def read(self, count, timeout):
+    return self.ring.read(count, timeout)
+
+  def close(self):
+    if self.ring:
+      self.ring.close()
+    self.ready.set()
+    source = self.source
+    if source:
+      try:
+        source.close()
+      except Exception:
+        pass
+
+  def stats(self):
+    if self.ring == None:
+      return {'underruns': 0, 'overruns': 0}
+    return {'underruns': self.ring.underruns, 'overruns': self.ring.overruns}
+
+  def _open_source(self):
+    if self.url.startswith('unix:'):
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      sock.connect(self.url[len('unix:'):])
+      return sock.makefile('rb')
+    return urllib.request.urlopen(self.url)
+
+  def _set_format(self, rate, channels, width):
+    """
+    Allocate the ring buffer once the format is known.
+    Thread: producer
+    """
+    if self.format == None:
+      self.format = (rate, channels, width)
+      capacity = int(rate * self.buffer_duration) * channels * width
+      self.ring = RingBuffer(capacity)
+      self.ready.set()
+
+  def _write(self, data):
+    return self.ring.write(data, AudioStream.WRITE_TIMEOUT)
+
+  def _run(self):
+    """
+    Read and decode the stream.
+    Thread: stream producer
+    """
+    try:
+      self.source = self._open_source()
+      head = self.source.read(4)
+      if head == b'RIFF':
+        self._decode_wav(head)
+      elif head:
+        self._decode_mp3(head)
+    except Exception as err:
+      if self.ring == None or not self.ring.closed:
+        print('Warning : error while streaming {url}'.format(url=self.url))
+        print(traceback.format_exc())
+      self.error = err
+    finally:
+      if self.ring:
+        self.ring.end_of_stream()
+      self.ready.set()
+      if self.source:
+        self.source.close()
+
+  def _decode_wav(self, head):
+    with wave.open(_PrefixedReader(head, self.source), 'rb') as f:
+      self._set_format(f.getframerate(), f.getnchannels(), f.getsampwidth())
+      frames = int(AudioStream.READ_SIZE / (f.getnchannels() * f.getsampwidth()))
+      while True:
+        data = f.readframes(frames)
+        if not data or not self._write(data):
+          break
+
+  def _decode_mp3(self, head):
+    from mpg123 import Mpg123
+    mp3 = Mpg123()
+    data = head
+    while data:
+      mp3.feed(data)
+      for frame in mp3.iter_frames():
+        if self.format == None:
+          rate, channels, encoding = mp3.get_format()
+          self._set_format(rate, channels, mp3.get_width_by_encoding(encoding))
+        if not self._write(frame):
+          return
+      data = self.source.read(AudioStream.READ_SIZE)
+
+class _PrefixedReader(object):
+  """
+  File-like object to read from a stream after some bytes were consumed.
+  """
+  def __init__(self, prefix, source):
+    self.prefix = prefix
+    self.source = source
+
+  def read(self, size=-1):
+    if self.prefix:
+      if size < 0:
+        data = self.prefix + self.source.read()
+      else:
+        data = self.prefix[:size]
+        if len(data) < size:
+          data = data + self.source.read(size - len(data))
+      self.prefix = self.prefix[len(data):]
+      return data
+    return self.source.read(size)
@@ -0,0 +1,45 @@
+"""
+ASR preprocessing benchmark.
+
+Usage: python -m nabd.benchmarks.asr_bench [--chunks N]
+
+Feeds 100ms chunks of 16kHz samples, as recorded by SoundAlsa, to
+ASR._decode_chunk with a null decoder, and reports the preprocessing cost
+of each chunk. The Kaldi model is not needed.
+"""
+import argparse, random, struct, sys, time
+from nabd.asr import ASR
+
+CHUNK_FRAMES = 1600     # 100ms at 16kHz, see SoundAlsa._record
+LOWER_IS_BETTER = ['_us']
+
+class NullDecoder(object):
+  def decode(self, rate, samples, finalize):
+    pass
+
+class NullASR(ASR):
+  def _load_model(self, locale):
+    self.decoder = NullDecoder()
+
+def measure(chunks=2000):
+  """
+  Return the preprocessing cost of a chunk in microseconds.
+  """
+  rnd = random.Random(0)
+  chunk = struct.pack('<%dh' % CHUNK_FRAMES, *[rnd.randint(-32768, 32767) for i in range(CHUNK_FRAMES)])
+  asr = NullASR(ASR.DEFAULT_LOCALE)
+  start = time.perf_counter()
+  for i in range(chunks):
+    asr._decode_chunk(chunk, False)
+  elapsed = time.perf_counter() - start
+  return {'decode_chunk_us': elapsed * 1000000 / chunks}
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='ASR preprocessing benchmark')
+  parser.add_argument('--chunks', type=int, default=2000, help='number of chunks')
+  args = parser.parse_args(argv)
+  results = measure(args.chunks)
+  print('decode_chunk: {us:.1f} us/chunk'.format(us=results['decode_chunk_us']))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,94 @@
+"""
+Choreography interpreter throughput benchmark.
+
+Usage: python -m nabd.benchmarks.choreography_bench [--ops N] [--runs N]
+
+Plays a synthetic LED-heavy choreography with no waits on null devices and
+reports interpreted ops per second.
+"""
+import argparse, asyncio, random, time, sys
+from nabd.choreography import ChoreographyInterpreter
+
+class NullDevice(object):
+  def set1(self, led, r, g, b):
+    pass
+
+  def setall(self, r, g, b):
+    pass
+
+  def begin_frame(self):
+    pass
+
+  def commit_frame(self):
+    pass
+
+  async def go(self, ear, position, direction):
+    pass
+
+  async def move(self, ear, delta, direction):
+    pass
+
+  async def wait_while_running(self):
+    pass
+
+  async def start_playing(self, sound):
+    pass
+
+  async def wait_until_done(self):
+    pass
+
+def synthetic_chor(ops_count, seed=0):
+  """
+  Build a choreography with ops_count set_led_color, set_led_off and
+  set_led_palette ops (mtl dialect), all with a zero wait.
+  """
+  rnd = random.Random(seed)
+  chor = bytearray()
+  for i in range(ops_count):
+    kind = i % 3
+    if kind == 0:
+      chor.extend([0, 7, rnd.randint(0, 4), rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255), 0, 0])
+    elif kind == 1:
+      chor.extend([0, 10, rnd.randint(0, 4)])
+    else:
+      chor.extend([0, 14, rnd.randint(0, 4), rnd.randint(0, 7)])
+  return bytes(chor)
+
+def bench(coro_factory, ops_count, runs):
+  loop = asyncio.new_event_loop()
+  try:
+    best = None
+    for run in range(runs):
+      start = time.perf_counter()
+      loop.run_until_complete(coro_factory())
+      elapsed = time.perf_counter() - start
+      if best == None or elapsed < best:
+        best = elapsed
+    return ops_count / best
+  finally:
+    loop.close()
+
+def measure(ops=30000, runs=5):
+  """
+  Return interpreted ops per second, from raw bytes and compiled.
+  """
+  null = NullDevice()
+  ci = ChoreographyInterpreter(null, null, null)
+  chor = synthetic_chor(ops)
+  results = {}
+  results['play_binary_ops_per_s'] = bench(lambda: ci.play_binary(chor), ops, runs)
+  if hasattr(ChoreographyInterpreter, 'compile'):
+    compiled = ChoreographyInterpreter.compile(chor)
+    results['play_compiled_ops_per_s'] = bench(lambda: ci.play_compiled(compiled, 0), ops, runs)
+  return results
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Choreography interpreter benchmark')
+  parser.add_argument('--ops', type=int, default=30000, help='number of ops in the synthetic choreography')
+  parser.add_argument('--runs', type=int, default=5, help='number of runs (best is reported)')
+  args = parser.parse_args(argv)
+  for name, ops_per_second in measure(args.ops, args.runs).items():
+    print('{name}: {ops:.0f} ops/s'.format(name=name[:-len('_ops_per_s')], ops=ops_per_second))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,100 @@
+"""
+LED thread benchmark.
+
+Usage: python -m nabd.benchmarks.leds_bench [--duration S] [--rate S]
+
+Pulses leds with null drivers and reports CPU use of the process (mostly
+the LED thread, the main thread sleeps), LED thread wakeups and do_show
+calls per second.
+"""
+import argparse, sys, time
+from nabd.leds import Leds, LedsSoft
+
+class CountingCondition(object):
+  """
+  Condition proxy counting wakeups of the waiting thread.
+  """
+  def __init__(self, condition):
+    self.condition = condition
+    self.wakeups = 0
+
+  def __enter__(self):
+    return self.condition.__enter__()
+
+  def __exit__(self, *args):
+    return self.condition.__exit__(*args)
+
+  def wait(self, timeout=None):
+    result = self.condition.wait(timeout)
+    self.wakeups = self.wakeups + 1
+    return result
+
+  def notify(self, n=1):
+    self.condition.notify(n)
+
+class NullLeds(LedsSoft):
+  def __init__(self):
+    self.sets = 0
+    self.shows = 0
+    super().__init__()
+
+  def do_set(self, led, red, green, blue):
+    self.sets = self.sets + 1
+
+  def do_show(self):
+    self.shows = self.shows + 1
+
+# Metrics for which lower is better, by suffix (see suite)
+LOWER_IS_BETTER = ['_cpu_percent', '_wakeups_per_s', '_do_set_per_s', '_do_show_per_s']
+
+SCENARIOS = {
+  # idle mode: bottom led pulsing
+  'idle': [(Leds.LED_BOTTOM, (255, 0, 255))],
+  # dim pulses, for which many steps do not change colors
+  'dim': [(Leds.LED_NOSE, (4, 2, 0)), (Leds.LED_LEFT, (3, 3, 3))],
+}
+
+def bench(pulses, duration):
+  leds = NullLeds()
+  leds.condition = CountingCondition(leds.condition)
+  for (led, (r, g, b)) in pulses:
+    leds.pulse(led, r, g, b)
+  time.sleep(0.5)
+  wakeups0, sets0, shows0 = leds.condition.wakeups, leds.sets, leds.shows
+  cpu0 = time.process_time()
+  time.sleep(duration)
+  cpu = time.process_time() - cpu0
+  wakeups, sets, shows = leds.condition.wakeups - wakeups0, leds.sets - sets0, leds.shows - shows0
+  leds.stop()
+  return (cpu * 100 / duration, wakeups / duration, sets / duration, shows / duration)
+
+def measure(duration=10.0, rate=0.01):
+  """
+  Return CPU use, wakeups, do_set and do_show calls per second of each
+  scenario.
+  """
+  saved_rate = LedsSoft.PULSING_RATE
+  LedsSoft.PULSING_RATE = rate
+  try:
+    results = {}
+    for name, pulses in SCENARIOS.items():
+      (cpu, wakeups, sets, shows) = bench(pulses, duration)
+      results[name + '_cpu_percent'] = cpu
+      results[name + '_wakeups_per_s'] = wakeups
+      results[name + '_do_set_per_s'] = sets
+      results[name + '_do_show_per_s'] = shows
+    return results
+  finally:
+    LedsSoft.PULSING_RATE = saved_rate
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='LED thread benchmark')
+  parser.add_argument('--duration', type=float, default=10.0, help='duration of each measure, in seconds')
+  parser.add_argument('--rate', type=float, default=0.01, help='pulsing rate, in seconds')
+  args = parser.parse_args(argv)
+  results = measure(args.duration, args.rate)
+  for name in SCENARIOS:
+    print('{name}: cpu {cpu:.2f}%, {wakeups:.1f} wakeups/s, {sets:.1f} do_set/s, {shows:.1f} do_show/s'.format(name=name, cpu=results[name + '_cpu_percent'], wakeups=results[name + '_wakeups_per_s'], sets=results[name + '_do_set_per_s'], shows=results[name + '_do_show_per_s']))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
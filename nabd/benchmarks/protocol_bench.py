@@ -0,0 +1,81 @@
+"""
+Protocol dispatch benchmark.
+
+Usage: python -m nabd.benchmarks.protocol_bench [--packets N] [--events N]
+
+Processes packets which do not play anything with Nabd.process_packet, and
+broadcasts events to 1, 10 and 100 services, with the test rabbit and null
+writers, and reports packets and writes per second.
+"""
+import argparse, asyncio, sys, time
+from nabd.nabd import Nabd
+from nabd.tests.mock import NabIOMock
+
+PACKETS = {
+  'info': {'type':'info', 'request_id':'bench', 'info_id':'bench', 'animation':{'tempo':25, 'colors':[{'left':'ff0000'}, {'right':'00ff00'}]}},
+  'ears': {'type':'ears', 'request_id':'bench', 'left':4, 'right':8},
+  'mode': {'type':'mode', 'request_id':'bench', 'mode':'idle', 'events':['ears', 'button']},
+  'wakeup': {'type':'wakeup', 'request_id':'bench'},
+  'cancel': {'type':'cancel', 'request_id':'bench'},
+}
+FAN_OUTS = [1, 10, 100]
+
+class NullWriter(object):
+  def __init__(self):
+    self.written = 0
+
+  def write(self, data):
+    self.written = self.written + len(data)
+
+async def dispatch(nabd, packet, count):
+  writer = NullWriter()
+  nabd.service_writers[writer] = ['asr']
+  start = time.perf_counter()
+  for i in range(count):
+    await nabd.process_packet(dict(packet), writer)
+  elapsed = time.perf_counter() - start
+  del nabd.service_writers[writer]
+  return count / elapsed
+
+def broadcast(nabd, fan_out, count):
+  writers = [NullWriter() for i in range(fan_out)]
+  for writer in writers:
+    nabd.service_writers[writer] = ['ears']
+  event = {'type':'ears_event', 'left':4, 'right':8}
+  start = time.perf_counter()
+  for i in range(count):
+    nabd.broadcast_event('ears', event)
+  elapsed = time.perf_counter() - start
+  for writer in writers:
+    del nabd.service_writers[writer]
+  return count * fan_out / elapsed
+
+def measure(packets=5000, events=2000):
+  """
+  Return packets processed per second for each packet type and packets
+  written per second for each broadcast fan-out.
+  """
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  try:
+    nabd = Nabd(NabIOMock())
+    results = {}
+    for (name, packet) in PACKETS.items():
+      results['dispatch_' + name + '_per_s'] = loop.run_until_complete(dispatch(nabd, packet, packets))
+    for fan_out in FAN_OUTS:
+      results['broadcast_{n}_writes_per_s'.format(n=fan_out)] = broadcast(nabd, fan_out, events)
+    return results
+  finally:
+    asyncio.set_event_loop(None)
+    loop.close()
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Protocol dispatch benchmark')
+  parser.add_argument('--packets', type=int, default=5000, help='number of packets of each type')
+  parser.add_argument('--events', type=int, default=2000, help='number of broadcast events of each fan-out')
+  args = parser.parse_args(argv)
+  for name, rate in measure(args.packets, args.events).items():
+    print('{name}: {rate:.0f}/s'.format(name=name[:-len('_per_s')], rate=rate))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,69 @@
+"""
+Resource lookup benchmark.
+
+Usage: python -m nabd.benchmarks.resources_bench [--lookups N]
+
+Looks up the sounds and choreographies used by services with Resources.find
+and reports lookups per second. The locale is pinned, so that only
+filesystem lookups are measured; lookups including the locale query are
+also measured if the database is available.
+"""
+import argparse, os, sys, time
+from unittest import mock
+import django
+from nabd.resources import Resources
+
+LOOKUPS = [
+  # (type, resources)
+  ('sounds', 'nabclockd/signature.mp3'),
+  ('sounds', 'nabclockd/7/*.mp3'),
+  ('sounds', 'nabmastodond/respirations/*.mp3'),
+  ('sounds', 'nabmastodond/communion.wav'),
+  ('sounds', 'nab8balld/answers/*.mp3'),
+  ('sounds', 'nabd/missing.mp3;nabsurprised/*.mp3'),
+  ('choreographies', 'nabtaichid/taichi.chor'),
+  ('choreographies', 'nabd/streaming/*.chor'),
+]
+
+def bench(lookups):
+  start = time.perf_counter()
+  count = 0
+  while count < lookups:
+    for (type, resources) in LOOKUPS:
+      Resources.find(type, resources)
+    count = count + len(LOOKUPS)
+  return count / (time.perf_counter() - start)
+
+def database_available():
+  try:
+    from nabd.i18n import get_locale
+    get_locale()
+    return True
+  except Exception:
+    return False
+
+def measure(lookups=2000):
+  """
+  Return lookups per second with the locale pinned, and with the locale
+  query if the database is available.
+  """
+  os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nabweb.settings')
+  django.setup()
+  results = {}
+  with mock.patch('nabd.i18n.get_locale', return_value='fr_FR'):
+    results['find_fs_per_s'] = bench(lookups)
+  if database_available():
+    results['find_per_s'] = bench(lookups)
+  else:
+    print('Warning : database unavailable, lookups with the locale query are not measured')
+  return results
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Resource lookup benchmark')
+  parser.add_argument('--lookups', type=int, default=2000, help='number of lookups of each measure')
+  args = parser.parse_args(argv)
+  for name, lookups_per_second in measure(args.lookups).items():
+    print('{name}: {lookups:.0f} lookups/s'.format(name=name[:-len('_per_s')], lookups=lookups_per_second))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,69 @@
+"""
+ALSA playback chunking benchmark.
+
+Usage: python -m nabd.benchmarks.sound_bench [--runs N]
+
+Plays an mp3 file, a wav file and PCM cache samples with SoundAlsa to the
+ALSA null device, which consumes chunks without waiting, and reports how
+many seconds of audio are decoded and chunked per second.
+"""
+import argparse, os, sys, time
+from nabd.sound_alsa import SoundAlsa
+from nabd.pcm_cache import PCMCache
+from nabd.duration import DurationEstimator
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MP3 = os.path.join(BASE_DIR, 'nabd', 'sounds', 'asr', 'listen.mp3')
+WAV = os.path.join(BASE_DIR, 'nabmastodond', 'sounds', 'nabmastodond', 'communion.wav')
+PCM_RATE = 48000
+PCM_CHANNELS = 2
+PCM_DURATION = 10.0
+
+class NullSoundAlsa(SoundAlsa):
+  """
+  SoundAlsa playing to the ALSA null device, without a sound card.
+  """
+  def __init__(self):
+    self.playback_device = 'null'
+    self.currently_playing = False
+    self.pcm_cache = None
+    self.stream_stats = {'underruns': 0, 'overruns': 0}
+
+  def play(self, filename):
+    self.currently_playing = True
+    self._play(filename)
+
+def bench(sound, filename, duration, runs):
+  best = None
+  for run in range(runs):
+    start = time.perf_counter()
+    sound.play(filename)
+    elapsed = time.perf_counter() - start
+    if best == None or elapsed < best:
+      best = elapsed
+  return duration / best
+
+def measure(runs=5):
+  """
+  Return seconds of audio played per second for each format.
+  """
+  sound = NullSoundAlsa()
+  results = {}
+  results['mp3_audio_s_per_s'] = bench(sound, MP3, DurationEstimator.mp3_duration(MP3), runs)
+  results['wav_audio_s_per_s'] = bench(sound, WAV, DurationEstimator.wav_duration(WAV), runs)
+  frames = int(PCM_RATE * PCM_DURATION)
+  header = {'rate': PCM_RATE, 'channels': PCM_CHANNELS, 'index': {'pcm': {'offset': 0, 'length': frames * PCM_CHANNELS * PCMCache.WIDTH}}}
+  sound.pcm_cache = PCMCache(None, BASE_DIR, header, memoryview(bytes(frames * PCM_CHANNELS * PCMCache.WIDTH)))
+  sound.pcm_cache.lookup = lambda filename: sound.pcm_cache.data
+  results['pcm_audio_s_per_s'] = bench(sound, 'pcm', PCM_DURATION, runs)
+  return results
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='ALSA playback chunking benchmark')
+  parser.add_argument('--runs', type=int, default=5, help='number of runs (best is reported)')
+  args = parser.parse_args(argv)
+  for name, speed in measure(args.runs).items():
+    print('{name}: {speed:.1f}x real time'.format(name=name[:-len('_audio_s_per_s')], speed=speed))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,192 @@
+"""
+Micro-benchmark suite of nabd hot paths.
+
+Usage: python -m nabd.benchmarks.suite [--quick] [--only NAME[,NAME...]]
+         [--results-dir DIR] [--compare REF] [--threshold PERCENT] [--check]
+
+Runs the hardware-free benchmarks of this package and saves their results
+in DIR/<commit>.json, DIR defaulting to nabd/benchmarks/results.
+Benchmarks whose dependencies are missing (e.g. alsaaudio or numpy) are
+skipped.
+Results are compared to those of REF, a commit or a results file, or by
+default to the most recent results of another commit on the same machine
+type and Python version. Changes worse than the threshold are reported as
+regressions, and --check makes them fail, unless REF was measured in
+another environment.
+"""
+import argparse, datetime, importlib, json, os, platform, subprocess, sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RESULTS_DIR = os.path.join(BASE_DIR, 'nabd', 'benchmarks', 'results')
+DEFAULT_THRESHOLD = 10.0
+
+# name -> (module, arguments of measure with --quick)
+BENCHMARKS = {
+  'choreography': ('nabd.benchmarks.choreography_bench', {'ops': 10000, 'runs': 3}),
+  'leds': ('nabd.benchmarks.leds_bench', {'duration': 2.0}),
+  'resources': ('nabd.benchmarks.resources_bench', {'lookups': 500}),
+  'sound': ('nabd.benchmarks.sound_bench', {'runs': 2}),
+  'asr': ('nabd.benchmarks.asr_bench', {'chunks': 500}),
+  'protocol': ('nabd.benchmarks.protocol_bench', {'packets': 1000, 'events': 500}),
+}
+
+def git(*args):
+  try:
+    return subprocess.run(['git'] + list(args), cwd=BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode('utf8').strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def run(names, quick=False):
+  """
+  Run benchmarks and return a results record.
+  """
+  record = {
+    'commit': git('rev-parse', 'HEAD'),
+    'dirty': git('status', '--porcelain', '--untracked-files=no') not in [None, ''],
+    'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    'machine': platform.machine(),
+    'python': platform.python_version(),
+    'results': {},
+    'lower_is_better': [],
+    'skipped': {},
+  }
+  for name in names:
+    (module_name, quick_args) = BENCHMARKS[name]
+    try:
+      module = importlib.import_module(module_name)
+    except ImportError as err:
+      print('Warning : skipping {name} benchmark ({err})'.format(name=name, err=err))
+      record['skipped'][name] = str(err)
+      continue
+    print('Running {name} benchmark'.format(name=name), file=sys.stderr)
+    results = module.measure(**quick_args) if quick else module.measure()
+    record['results'][name] = results
+    for metric in results:
+      if any([metric.endswith(suffix) for suffix in getattr(module, 'LOWER_IS_BETTER', [])]):
+        record['lower_is_better'].append(name + '.' + metric)
+  return record
+
+def save(record, results_dir):
+  """
+  Save a record as <commit>.json and return its path.
+  """
+  os.makedirs(results_dir, exist_ok=True)
+  path = os.path.join(results_dir, '{commit}.json'.format(commit=record['commit'] or 'unknown'))
+  with open(path, 'w') as f:
+    json.dump(record, f, indent=2, sort_keys=True)
+    f.write('\n')
+  return path
+
+def load(path):
+  with open(path) as f:
+    return json.load(f)
+
+def environment(record):
+  """
+  Return the (machine, Python minor version) the results were measured on.
+  """
+  python = record.get('python')
+  if python != None:
+    python = '.'.join(python.split('.')[:2])
+  return (record.get('machine'), python)
+
+def find_reference(results_dir, ref, commit, env=None):
+  """
+  Return the path of the results to compare to, or None.
+  ref is a results file or a commit (prefix). Without ref, the most recent
+  results of another commit measured in env (if not None) are used.
+  """
+  if ref != None:
+    if os.path.isfile(ref):
+      return ref
+    full_commit = git('rev-parse', '--verify', '--quiet', ref + '^{commit}') or ref
+    path = os.path.join(results_dir, '{commit}.json'.format(commit=full_commit))
+    if os.path.isfile(path):
+      return path
+    candidates = [f for f in os.listdir(results_dir) if f.startswith(ref) and f.endswith('.json')] if os.path.isdir(results_dir) else []
+    if len(candidates) == 1:
+      return os.path.join(results_dir, candidates[0])
+    return None
+  if not os.path.isdir(results_dir):
+    return None
+  latest = None
+  for filename in os.listdir(results_dir):
+    if not filename.endswith('.json') or filename == '{commit}.json'.format(commit=commit):
+      continue
+    path = os.path.join(results_dir, filename)
+    try:
+      reference = load(path)
+      date = reference['date']
+    except (OSError, ValueError, KeyError):
+      continue
+    if env != None and environment(reference) != env:
+      continue
+    if latest == None or date > latest[0]:
+      latest = (date, path)
+  return latest[1] if latest != None else None
+
+def compare(reference, record, threshold=DEFAULT_THRESHOLD):
+  """
+  Compare metrics present in both records.
+  Return a list of (metric, reference value, value, change in percent,
+  regression), change being positive when the metric improved.
+  """
+  lower_is_better = set(record['lower_is_better'])
+  changes = []
+  for (name, results) in sorted(record['results'].items()):
+    reference_results = reference['results'].get(name, {})
+    for (metric, value) in sorted(results.items()):
+      reference_value = reference_results.get(metric)
+      if reference_value == None or reference_value == 0:
+        continue
+      key = name + '.' + metric
+      change = (value - reference_value) * 100.0 / reference_value
+      if key in lower_is_better:
+        change = -change
+      changes.append((key, reference_value, value, change, change < -threshold))
+  return changes
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='nabd micro-benchmark suite')
+  parser.add_argument('--quick', action='store_true', help='run shorter benchmarks')
+  parser.add_argument('--only', help='comma-separated benchmarks to run ({names})'.format(names=','.join(BENCHMARKS)))
+  parser.add_argument('--results-dir', default=RESULTS_DIR, help='directory of results files')
+  parser.add_argument('--compare', help='commit or results file to compare to (default = most recent results)')
+  parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='regression threshold, in percent (default = {t})'.format(t=DEFAULT_THRESHOLD))
+  parser.add_argument('--check', action='store_true', help='exit with an error on regressions')
+  args = parser.parse_args(argv)
+  names = list(BENCHMARKS)
+  if args.only != None:
+    names = args.only.split(',')
+    for name in names:
+      if name not in BENCHMARKS:
+        parser.error('unknown benchmark {name}'.format(name=name))
+  record = run(names, args.quick)
+  reference_path = find_reference(args.results_dir, args.compare, record['commit'], environment(record))
+  path = save(record, args.results_dir)
+  print('Results saved to {path}'.format(path=path))
+  for (name, results) in sorted(record['results'].items()):
+    for (metric, value) in sorted(results.items()):
+      print('{name}.{metric}: {value:.6g}'.format(name=name, metric=metric, value=value))
+  if reference_path == None:
+    if args.compare != None:
+      print('Warning : no results for {ref}'.format(ref=args.compare))
+    return
+  reference = load(reference_path)
+  same_environment = environment(reference) == environment(record)
+  if not same_environment:
+    (machine, python) = environment(reference)
+    print('Warning : {ref} was measured on {machine} with Python {python}, not checking regressions'.format(ref=reference_path, machine=machine, python=python))
+  print('Compared to {commit} ({date}):'.format(commit=reference['commit'], date=reference['date']))
+  regressions = 0
+  for (key, reference_value, value, change, regression) in compare(reference, record, args.threshold):
+    if regression:
+      regressions = regressions + 1
+    print('{flag} {key}: {ref:.6g} -> {value:.6g} ({change:+.1f}%)'.format(flag='!' if regression else ' ', key=key, ref=reference_value, value=value, change=change))
+  if regressions > 0:
+    print('{n} regression(s) above {t}%'.format(n=regressions, t=args.threshold))
+    if args.check and same_environment:
+      exit(1)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,36 @@
+from .button import Button
+from .nabio import NabIO
+from .gestures import GestureRecognizer
+from .gpio_cdev import GPIOChip, LineEvents
+
+class ButtonCdev(Button):
+  """
+  Implementation of button with the GPIO character device.
+  Edges are read on the event loop with their kernel timestamps and fed to
+  the gesture recognizer.
+  """
+  BUTTON_LINE_2018 = 2
+  BUTTON_LINE_2019 = 17
+  CONSUMER = 'nabd-button'
+
+  def __init__(self, hw_model, chip=None):
+    if chip == None:
+      chip = GPIOChip()
+    self.recognizer = None
+    self.timeouts = GestureRecognizer.model_timeouts(hw_model)
+    if hw_model == NabIO.MODEL_2018:
+      line = ButtonCdev.BUTTON_LINE_2018
+    else:
+      line = ButtonCdev.BUTTON_LINE_2019
+    self.events = chip.request_events(line, GPIOChip.GPIOEVENT_REQUEST_BOTH_EDGES, ButtonCdev.CONSUMER)
+
+  def on_event(self, loop, callback):
+    self.recognizer = GestureRecognizer(loop, callback, timeouts=self.timeouts)
+    self.events.watch(loop, self._button_event)
+
+  def _button_event(self, timestamp_ns, edge):
+    """
+    Process an edge. Button is down when line is low.
+    Thread: main loop
+    """
+    self.recognizer.edge(edge == LineEvents.FALLING_EDGE, timestamp_ns / 1e9)
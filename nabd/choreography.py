@@ -1,6 +1,10 @@
-import random, time, asyncio
+import random, asyncio, os
 from .resources import Resources
+from .tracing import tracer
+from .metrics import metrics
 from .ears import Ears
+from .leds import Leds
+from .frame_scheduler import FrameScheduler, LatenessHistogram
 from contextlib import suppress
 
 class ChoreographyInterpreter:
@@ -15,9 +19,18 @@ class ChoreographyInterpreter:
     self.taichi_random = int(random.randint(0, 255) * 30 >> 8)
     self.taichi_directions = [0, 0]
     self.current_palette = [(0, 0, 0) for x in range(8)]
+    self.scheduler = FrameScheduler(ChoreographyInterpreter.frame_lateness)
 
   STREAMING_URN = 'urn:x-chor:streaming'
 
+  # When a frame is later than this, led writes are deferred and only the
+  # last color of each led is written once the interpreter caught up.
+  SKIP_LATE_LED_FRAMES = True
+  MAX_FRAME_LATENESS = 0.050
+
+  # Lateness of frames of all choreographies.
+  frame_lateness = LatenessHistogram()
+
   # from nominal.010120_as3.mtl
   MTL_OPCODE_HANDLDERS = [
     'nop',
@@ -128,127 +141,233 @@ class ChoreographyInterpreter:
 
   OPCODE_HANDLERS = {'mtl': MTL_OPCODE_HANDLDERS, 'vasm': VASM_OPCODE_HANDLERS, 'streaming': STREAMING_OPCODE_HANDLERS}
 
-  async def nop(self, index, chor):
-    return index
+  # Number of argument bytes of each opcode handler.
+  OPCODE_ARGUMENTS = {
+    'nop': 0,
+    'nop_1': 1,
+    'frame_duration': 1,
+    'set_led_color': 6,
+    'set_motor': 3,
+    'set_leds_color': 3,
+    'set_led_off': 1,
+    'set_led_palette': 2,
+    'set_led_palette_streaming': 2,
+    'randmidi': 0,
+    'avance': 2,
+    'ifne': 3,
+    'attend': 0,
+    'setmotordir': 2,
+  }
+
+  # Cache of compiled choreographies, (path, dialect) -> (mtime, ops)
+  compiled_cache = {}
 
-  async def nop_1(self, index, chor):
-    return index + 1
+  # Opcode handlers are called with decoded arguments.
+  # Handlers that do not need to wait are plain functions. Handlers for
+  # control flow return the index of the next op.
 
-  async def frame_duration(self, index, chor):
-    self.timescale = chor[index]
-    return index + 1
+  def nop(self):
+    pass
+
+  def nop_1(self, ignored):
+    pass
+
+  def frame_duration(self, timescale):
+    self.timescale = timescale
 
-  async def set_led_color(self, index, chor):
-    led = chor[index]
-    r = chor[index + 1]
-    g = chor[index + 2]
-    b = chor[index + 3]
+  def set_led_color(self, led, r, g, b, unused1, unused2):
     self.leds.set1(led, r, g, b)
-    return index + 6
 
-  async def set_motor(self, index, chor):
-    motor = chor[index]
-    position = chor[index + 1]
-    direction = chor[index + 2]
+  async def set_motor(self, motor, position, direction):
     await self.ears.go(motor, position, direction)
-    return index + 3
 
-  async def set_leds_color(self, index, chor):
-    r = chor[index]
-    g = chor[index + 1]
-    b = chor[index + 2]
+  def set_leds_color(self, r, g, b):
     self.leds.setall(r, g, b)
-    return index + 3
 
-  async def set_led_off(self, index, chor):
-    led = chor[index]
+  def set_led_off(self, led):
     self.leds.set1(led, 0, 0, 0)
-    return index + 1
 
-  async def set_led_palette(self, index, chor):
-    led = chor[index]
-    palette_ix = chor[index + 1] & 7
-    (r, g, b) = self.current_palette[palette_ix]
+  def set_led_palette(self, led, palette_ix):
+    (r, g, b) = self.current_palette[palette_ix & 7]
     self.leds.set1(led, r, g, b)
-    return index + 2
 
-  async def set_led_palette_streaming(self, index, chor):
-    led = chor[index]
-    col_ix = chor[index + 1] & 3
-    palette_ix = self.chorst_palettecolors[col_ix]
+  def set_led_palette_streaming(self, led, col_ix):
+    palette_ix = self.chorst_palettecolors[col_ix & 3]
     (r, g, b) = self.current_palette[palette_ix]
     self.leds.set1(led, r, g, b)
-    return index + 2
 
-  async def randmidi(self, index, chor):
+  async def randmidi(self):
     await self.sound.start_playing(random.choice(ChoreographyInterpreter.MIDI_LIST))
-    return index
 
-  async def avance(self, index, chor):
-    motor = chor[index]
-    delta = chor[index + 1]
+  async def avance(self, motor, delta):
     direction = self.taichi_directions[motor]
     if direction:
       delta = -delta
     await self.ears.move(motor, delta, direction)
-    return index + 2
 
-  async def ifne(self, index, chor):
-    if self.taichi_random == chor[index]:
-      return index + 3
-    rel = (chor[index + 1] << 8) + chor[index + 2]
-    if rel >= 32768:    # assumed signed (?)
-      rel = rel - 65536
-    return index + rel + 3
+  def ifne(self, value, target):
+    if self.taichi_random != value:
+      return target
 
-  async def attend(self, index, chor):
+  async def attend(self):
     await self.ears.wait_while_running()
     await self.sound.wait_until_done()
-    return index
 
-  async def setmotordir(self, index, chor):
-    motor = chor[index]
-    dir = chor[index + 1]
+  def setmotordir(self, motor, dir):
     self.taichi_directions[motor] = dir
-    return index + 2
 
-  async def play_binary(self, chor, opcodes='mtl', timescale=0):
-    if chor[0] == 1 and chor[1] == 1 and chor[2] == 1 and chor[3] == 1:
+  def jump(self, target):
+    return target
+
+  @staticmethod
+  def compile(chor, opcodes='mtl'):
+    """
+    Compile a binary choreography into a list of ops.
+    Each op is a tuple (delay_ticks, handler, args) where handler is a
+    function of this class called with the interpreter and args, or None to
+    end the choreography after the delay.
+    Byte offsets of ifne jumps are resolved to op indices.
+    """
+    opcode_handlers = ChoreographyInterpreter.OPCODE_HANDLERS[opcodes]
+    if len(chor) >= 4 and chor[0] == 1 and chor[1] == 1 and chor[2] == 1 and chor[3] == 1:
       # Consider this is the header
-      await self.do_play_binary(4, chor, opcodes, timescale)
+      start_index = 4
     else:
-      await self.do_play_binary(0, chor, opcodes, timescale)
+      start_index = 0
+    ops = []
+    op_indices = {}   # byte offset -> op index
+    jumps = []        # op index of ifne ops to fix
+    pending = [start_index]
+    while len(pending) > 0:
+      index = pending.pop()
+      if index in op_indices:
+        continue
+      while True:
+        if index in op_indices:
+          # Join already compiled code
+          ops.append((0, ChoreographyInterpreter.jump, (op_indices[index],)))
+          break
+        op_indices[index] = len(ops)
+        if index < 0 or index >= len(chor):
+          ops.append((0, None, ()))
+          break
+        wait = chor[index]
+        index = index + 2
+        if index > len(chor):
+          # taichi.chor ends with a wait
+          ops.append((wait, None, ()))
+          break
+        opcode = chor[index - 1]
+        if opcode >= len(opcode_handlers):
+          # 255 apparently used for end.
+          if opcode != 255:
+            print('Unknown opcode {opcode}'.format(opcode=opcode))
+          ops.append((wait, None, ()))
+          break
+        handler_name = opcode_handlers[opcode]
+        if handler_name not in ChoreographyInterpreter.OPCODE_ARGUMENTS:
+          print('Unknown opcode {opcode} {name}'.format(opcode=opcode, name=handler_name))
+          ops.append((wait, None, ()))
+          break
+        args_count = ChoreographyInterpreter.OPCODE_ARGUMENTS[handler_name]
+        args = tuple(chor[index:index + args_count])
+        if len(args) < args_count:
+          print('Truncated choreography at opcode {opcode}'.format(opcode=opcode))
+          ops.append((wait, None, ()))
+          break
+        if handler_name == 'ifne':
+          (value, rel_hi, rel_lo) = args
+          rel = (rel_hi << 8) + rel_lo
+          if rel >= 32768:    # assumed signed (?)
+            rel = rel - 65536
+          target = index + rel + 3
+          jumps.append(len(ops))
+          pending.append(target)
+          args = (value, target)
+        ops.append((wait, getattr(ChoreographyInterpreter, handler_name), args))
+        index = index + args_count
+    for op_index in jumps:
+      (wait, handler, (value, target)) = ops[op_index]
+      ops[op_index] = (wait, handler, (value, op_indices[target]))
+    return ops
+
+  @staticmethod
+  def load(path, opcodes='mtl'):
+    """
+    Return the compiled ops of a choreography file.
+    Compiled choreographies are cached by path, dialect and mtime.
+    """
+    key = (str(path), opcodes)
+    mtime = os.stat(key[0]).st_mtime
+    cached = ChoreographyInterpreter.compiled_cache.get(key)
+    if cached != None and cached[0] == mtime:
+      return cached[1]
+    with open(key[0], 'rb') as f:
+      ops = ChoreographyInterpreter.compile(f.read(), opcodes)
+    ChoreographyInterpreter.compiled_cache[key] = (mtime, ops)
+    return ops
 
-  async def do_play_binary(self, start_index, chor, opcodes, timescale):
-    index = start_index
+  async def play_binary(self, chor, opcodes='mtl', timescale=0):
+    await self.play_compiled(ChoreographyInterpreter.compile(chor, opcodes), timescale)
+
+  async def play_compiled(self, ops, timescale):
     self.timescale = timescale
+    scheduler = self.scheduler
+    scheduler.start()
+    leds = self.leds
+    deferred_leds = None
+    index = 0
+    count = len(ops)
+    # Led changes between two waits are applied as a single frame.
+    leds.begin_frame()
+    in_frame = True
+    try:
+      while index < count:
+        (wait, handler, args) = ops[index]
+        index = index + 1
+        if wait:
+          leds.commit_frame()
+          in_frame = False
+          # do some wait now
+          lateness = await scheduler.wait(wait * self.timescale / 1000.0)
+          leds.begin_frame()
+          in_frame = True
+          if lateness > ChoreographyInterpreter.MAX_FRAME_LATENESS and ChoreographyInterpreter.SKIP_LATE_LED_FRAMES:
+            if deferred_leds == None:
+              deferred_leds = _DeferredLeds(leds)
+              self.leds = deferred_leds
+          elif deferred_leds != None:
+            self.leds = leds
+            deferred_leds.flush()
+            deferred_leds = None
+        if handler is None:
+          return
+        result = handler(self, *args)
+        if result is not None:
+          if result.__class__ is int:
+            index = result
+          else:
+            leds.commit_frame()
+            in_frame = False
+            await result
+            leds.begin_frame()
+            in_frame = True
+    finally:
+      if deferred_leds != None:
+        self.leds = leds
+        if not in_frame:
+          leds.begin_frame()
+          in_frame = True
+        deferred_leds.flush()
+      if in_frame:
+        leds.commit_frame()
 
-    next_time = time.time()
-    opcode_handlers = ChoreographyInterpreter.OPCODE_HANDLERS[opcodes]
-    while index < len(chor):
-      wait = chor[index]
-      # do some wait now
-      next_time = next_time + (wait * self.timescale / 1000.0)
-      sleep_delta = next_time - time.time()
-      if sleep_delta > 0:
-        await asyncio.sleep(sleep_delta)
-      index = index + 2
-      if index > len(chor):
-        # taichi.chor ends with a wait
-        break
-      opcode = chor[index - 1]
-      try:
-        opcode_handler = opcode_handlers[opcode]
-        handler = getattr(self, opcode_handler)
-      except IndexError as err:
-        # 255 apparently used for end.
-        if opcode != 255:
-          print('Unknown opcode {opcode}'.format(opcode=opcode))
-        return
-      except AttributeError as err:
-        print('Unknown opcode {opcode} {err}'.format(opcode=opcode, err=err))
-        return
-      index = await handler(index, chor)
+  @staticmethod
+  def timing_stats():
+    """
+    Return lateness statistics of choreography frames.
+    """
+    return ChoreographyInterpreter.frame_lateness.stats()
 
   async def play_streaming(self, ref):
     ref0 = ref[len(ChoreographyInterpreter.STREAMING_URN):]
@@ -272,14 +391,14 @@ class ChoreographyInterpreter:
           await self.ears.go(Ears.RIGHT_EAR, pos, Ears.FORWARD_DIRECTION)
           chorst_oreille_chance = (chorst_oreille_chance + 1) % 4
       file = Resources.find('choreographies', ChoreographyInterpreter.STREAMING_CHOREGRAPHIES)
-      chor = file.read_bytes()
+      ops = ChoreographyInterpreter.load(file, 'streaming')
       chorst_tempo = 160 + random.randint(0, 90)
       chorst_loops = 3 + random.randint(0, 17)
       if self.current_palette_is_random:
         self.current_palette = random.choice(ChoreographyInterpreter.PALETTES)
       self.chorst_palettecolors = [random.randint(0, 7), random.randint(0, 7), random.randint(0, 7)]
       for ix in range(chorst_loops):
-        await self.play_binary(chor, 'streaming', chorst_tempo)
+        await self.play_compiled(ops, chorst_tempo)
 
   async def start(self, ref):
     if ref != self.running_ref:
@@ -305,10 +424,36 @@ class ChoreographyInterpreter:
     self.running_ref = None
 
   async def play(self, ref):
-    if ref.startswith(ChoreographyInterpreter.STREAMING_URN):
-      await self.play_streaming(ref)
-    else:
-      # Assume a resource for now.
-      file = Resources.find('choreographies', ref)
-      chor = file.read_bytes()
-      await self.play_binary(chor)
+    with tracer.span('choreography', ref=ref):
+      if ref.startswith(ChoreographyInterpreter.STREAMING_URN):
+        await self.play_streaming(ref)
+      else:
+        # Assume a resource for now.
+        file = Resources.find('choreographies', ref)
+        await self.play_compiled(ChoreographyInterpreter.load(file), 0)
+
+metrics.histogram('nabd_choreography_lateness_seconds', 'Lateness of choreography frames', bounds=LatenessHistogram.BOUNDS, function=lambda: {(): (list(ChoreographyInterpreter.frame_lateness.counts), ChoreographyInterpreter.frame_lateness.total, ChoreographyInterpreter.frame_lateness.count)})
+metrics.counter('nabd_choreography_skipped_led_writes_total', 'LED writes skipped in late choreography frames', function=lambda: {(): ChoreographyInterpreter.frame_lateness.skipped})
+
+class _DeferredLeds(object):
+  """
+  Leds proxy recording the last color of each led, used to skip
+  intermediate frames of a late choreography.
+  """
+  def __init__(self, leds):
+    self.leds = leds
+    self.colors = {}
+
+  def set1(self, led, red, green, blue):
+    if led in self.colors:
+      ChoreographyInterpreter.frame_lateness.skipped += 1
+    self.colors[led] = (red, green, blue)
+
+  def setall(self, red, green, blue):
+    for led in range(Leds.LED_COUNT):
+      self.set1(led, red, green, blue)
+
+  def flush(self):
+    for led, (r, g, b) in self.colors.items():
+      self.leds.set1(led, r, g, b)
+    self.colors = {}
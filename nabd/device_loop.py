@@ -0,0 +1,216 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+from .nabio import NabIO
+
+class DeviceLoop(object):
+  """
+  Event loop running in a dedicated thread for real-time device I/O
+  (choreographies, ears, leds and info animations), isolated from protocol
+  processing on the main loop.
+  The thread can run with a real-time scheduling priority (SCHED_FIFO).
+  """
+  THREAD_NAME = 'nabd-device'
+  SYNC_TIMEOUT = 5.0
+
+  def __init__(self, priority=None):
+    self.priority = priority
+    self.loop = None
+    self.thread = None
+
+  def start(self):
+    started = threading.Event()
+    self.thread = threading.Thread(target = self._run, args = [started], name = DeviceLoop.THREAD_NAME, daemon = True)
+    self.thread.start()
+    started.wait()
+
+  def _run(self, started):
+    """
+    Thread: device
+    """
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    if self.priority != None:
+      DeviceLoop.set_realtime_priority(self.priority)
+    self.loop.call_soon(started.set)
+    try:
+      self.loop.run_forever()
+    finally:
+      self.loop.close()
+
+  @staticmethod
+  def set_realtime_priority(priority):
+    """
+    Set SCHED_FIFO priority of the calling thread.
+    Return False if this is not permitted (CAP_SYS_NICE is required).
+    """
+    try:
+      os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+      return True
+    except (AttributeError, OSError) as err:
+      print('Warning : could not set real-time priority {priority} ({err})'.format(priority=priority, err=err))
+      return False
+
+  def in_thread(self):
+    return threading.current_thread() is self.thread
+
+  async def run(self, coro):
+    """
+    Run a coroutine on the device loop and wait for its result from the
+    calling loop. Cancelling the caller cancels the coroutine.
+    """
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+  def call(self, function, *args):
+    """
+    Queue a call on the device loop without waiting for it.
+    """
+    self.loop.call_soon_threadsafe(function, *args)
+
+  def call_sync(self, function, *args):
+    """
+    Call a function on the device loop and wait for its result.
+    Blocks the calling thread: reserved to setup, shutdown and quick calls.
+    """
+    if self.loop == None or self.loop.is_closed() or not self.loop.is_running() or self.in_thread():
+      return function(*args)
+    future = concurrent.futures.Future()
+    def do_call():
+      try:
+        future.set_result(function(*args))
+      except Exception as err:
+        future.set_exception(err)
+    self.loop.call_soon_threadsafe(do_call)
+    return future.result(DeviceLoop.SYNC_TIMEOUT)
+
+  def stop(self):
+    if self.loop != None and not self.loop.is_closed():
+      self.loop.call_soon_threadsafe(self.loop.stop)
+      self.thread.join(DeviceLoop.SYNC_TIMEOUT)
+
+class _DeviceSignal(object):
+  """
+  Condition variable substitute waited on the device loop and notified from
+  the protocol loop.
+  """
+  def __init__(self, device):
+    self.device = device
+    self.event = None
+    self.notified = False
+
+  async def wait(self):
+    """
+    Thread: device
+    """
+    if not self.notified:
+      self.event = asyncio.Event()
+      await self.event.wait()
+    return True
+
+  def notify(self):
+    self.device.call(self._notify)
+
+  def _notify(self):
+    self.notified = True
+    if self.event != None:
+      self.event.set()
+
+class NabIODeviceLoop(NabIO):
+  """
+  NabIO proxy running operations of another NabIO on a device loop.
+  Commands are queued to the device loop with thread-safe calls, and events
+  are forwarded back to the protocol loop.
+  """
+
+  def __init__(self, device, nabio):
+    self.device = device
+    self.nabio = nabio
+    self.leds = nabio.leds
+    self.ears = nabio.ears
+    self.sound = nabio.sound
+
+  @staticmethod
+  def create(factory, priority=None):
+    """
+    Start a device loop and create the proxied NabIO with factory on the
+    device thread, so that it binds to the device loop.
+    """
+    device = DeviceLoop(priority)
+    device.start()
+    return NabIODeviceLoop(device, device.call_sync(factory))
+
+  def stop(self):
+    self.device.stop()
+
+  async def setup_ears(self, left_ear, right_ear):
+    await self.device.run(self.nabio.setup_ears(left_ear, right_ear))
+
+  async def move_ears(self, left_ear, right_ear):
+    await self.device.run(self.nabio.move_ears(left_ear, right_ear))
+
+  def save_ears_positions(self):
+    self.device.call_sync(self.nabio.save_ears_positions)
+
+  def diagnostics(self):
+    return self.device.call_sync(self.nabio.diagnostics)
+
+  async def detect_ears_positions(self):
+    return await self.device.run(self.nabio.detect_ears_positions())
+
+  def set_leds(self, nose, left, center, right, bottom):
+    self.device.call(self.nabio.set_leds, nose, left, center, right, bottom)
+
+  def pulse(self, led, color):
+    self.device.call(self.nabio.pulse, led, color)
+
+  def bind_button_event(self, loop, callback):
+    forward = lambda event_type, time: loop.call_soon_threadsafe(callback, event_type, time)
+    self.device.call_sync(self.nabio.bind_button_event, self.device.loop, forward)
+
+  def bind_ears_event(self, loop, callback):
+    forward = lambda ear: loop.call_soon_threadsafe(callback, ear)
+    self.device.call_sync(self.nabio.bind_ears_event, self.device.loop, forward)
+
+  async def play_info(self, condvar, tempo, colors, duration=NabIO.INFO_LOOP_LENGTH):
+    """
+    Play info on the device loop while waiting on condvar on the protocol
+    loop. Notification is forwarded to the device loop.
+    """
+    signal = _DeviceSignal(self.device)
+    play = asyncio.ensure_future(self.device.run(self.nabio.play_info(signal, tempo, colors, duration)))
+    wait = asyncio.ensure_future(condvar.wait())
+    try:
+      await asyncio.wait([play, wait], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+      if not wait.done():
+        wait.cancel()
+      if not play.done():
+        signal.notify()
+      # condvar lock is re-acquired when wait completes or is cancelled
+      try:
+        await wait
+      except asyncio.CancelledError:
+        pass
+      await play
+
+  async def start_acquisition(self, acquisition_cb):
+    await self.device.run(self.nabio.start_acquisition(acquisition_cb))
+
+  async def end_acquisition(self):
+    await self.device.run(self.nabio.end_acquisition())
+
+  async def asr_failed(self):
+    await self.device.run(self.nabio.asr_failed())
+
+  async def play_message(self, signature, body):
+    await self.device.run(self.nabio.play_message(signature, body))
+
+  async def play_sequence(self, sequence):
+    await self.device.run(self.nabio.play_sequence(sequence))
+
+  def cancel(self):
+    self.device.call(self.nabio.cancel)
+
+  def has_sound_input(self):
+    return self.nabio.has_sound_input()
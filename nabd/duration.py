@@ -0,0 +1,227 @@
+import os
+import wave
+from .resources import Resources
+from .choreography import ChoreographyInterpreter
+from .tts import TTS
+from .audio_stream import AudioStream
+
+class DurationEstimator(object):
+  """
+  Static estimation of the duration of sequences, i.e. of choreographies and
+  sounds, without playing them.
+  Estimates are cached per resource and invalidated when the file changes.
+  Durations are in seconds, None meaning unknown or unbounded.
+  """
+
+  # MPEG audio bitrates in kbps, indexed by layer and bitrate index
+  MPEG1_BITRATES = {
+    1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+  }
+  MPEG2_BITRATES = {
+    1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+  }
+  # Sampling rates indexed by version bits (0: MPEG2.5, 2: MPEG2, 3: MPEG1)
+  MPEG_SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000],
+  }
+
+  def __init__(self, pcm_cache=None):
+    self.pcm_cache = pcm_cache
+    self.cache = {}   # (type, resource) -> (path, mtime, duration)
+
+  def sequence_duration(self, sequence, wait_choreographies=True):
+    """
+    Estimate the duration of a sequence as played by NabIO.
+    Items with audio last as long as their audio. Items without audio last
+    as long as their choreography for commands, while choreographies are
+    interrupted for messages.
+    """
+    total = 0.0
+    for seq_item in sequence:
+      if 'audio' in seq_item:
+        audio_list = seq_item['audio']
+        if isinstance(audio_list, str):
+          audio_list = [audio_list]
+        for resource in audio_list:
+          duration = self.audio_duration(resource)
+          if duration == None:
+            return None
+          total = total + duration
+      elif 'choreography' in seq_item and wait_choreographies:
+        duration = self.choreography_duration(seq_item['choreography'])
+        if duration == None:
+          return None
+        total = total + duration
+    return total
+
+  def message_duration(self, signature, body):
+    """
+    Estimate the duration of a message, i.e. a signature, a body and a
+    signature.
+    """
+    signature_duration = self.sequence_duration([signature], False)
+    body_duration = self.sequence_duration(body, False)
+    if signature_duration == None or body_duration == None:
+      return None
+    return 2 * signature_duration + body_duration
+
+  def audio_duration(self, resource):
+    """
+    Estimate the duration of an audio resource.
+    Streams have no known duration, and text-to-speech phrases only have one
+    once synthesized.
+    """
+    if AudioStream.is_stream(resource):
+      return None
+    if resource.startswith(TTS.URN_PREFIX):
+      return None
+    return self._cached('sounds', resource, self._audio_file_duration)
+
+  def choreography_duration(self, resource):
+    """
+    Estimate the duration of a choreography resource.
+    The streaming choreography loops until interrupted and has no duration.
+    """
+    if resource.startswith(ChoreographyInterpreter.STREAMING_URN):
+      return None
+    return self._cached('choreographies', resource, DurationEstimator.chor_file_duration)
+
+  def _cached(self, type, resource, compute):
+    key = (type, resource)
+    cached = self.cache.get(key)
+    if cached != None:
+      (path, mtime, duration) = cached
+      try:
+        if os.stat(path).st_mtime == mtime:
+          return duration
+      except OSError:
+        pass
+    file = Resources.find(type, resource)
+    if file == None:
+      return None
+    path = file.as_posix()
+    try:
+      mtime = os.stat(path).st_mtime
+      duration = compute(path)
+    except (OSError, ValueError, EOFError, wave.Error):
+      duration = None
+      mtime = None
+    if mtime != None:
+      self.cache[key] = (path, mtime, duration)
+    return duration
+
+  @staticmethod
+  def chor_file_duration(path):
+    return DurationEstimator.ops_duration(ChoreographyInterpreter.load(path))
+
+  @staticmethod
+  def ops_duration(ops):
+    """
+    Sum the waits of compiled ops, following frame_duration ops.
+    Conditional jumps are assumed not taken, and the estimation stops if the
+    choreography loops.
+    """
+    timescale = 0
+    total = 0.0
+    index = 0
+    visited = set()
+    while index < len(ops) and index not in visited:
+      visited.add(index)
+      (wait, handler, args) = ops[index]
+      total = total + wait * timescale / 1000.0
+      if handler is None:
+        break
+      if handler is ChoreographyInterpreter.frame_duration:
+        (timescale,) = args
+      if handler is ChoreographyInterpreter.jump:
+        (index,) = args
+      else:
+        index = index + 1
+    return total
+
+  def _audio_file_duration(self, path):
+    if self.pcm_cache != None:
+      pcm = self.pcm_cache.lookup(path)
+      if pcm != None:
+        return len(pcm) / (self.pcm_cache.rate * self.pcm_cache.frame_size())
+    if path.endswith('.wav'):
+      return DurationEstimator.wav_duration(path)
+    if path.endswith('.mp3'):
+      return DurationEstimator.mp3_duration(path)
+    return None
+
+  @staticmethod
+  def wav_duration(path):
+    with wave.open(path, 'rb') as f:
+      return f.getnframes() / f.getframerate()
+
+  @staticmethod
+  def mp3_duration(path):
+    """
+    Compute the duration of an MP3 file by walking its frame headers.
+    Return None if no frame was found.
+    """
+    with open(path, 'rb') as f:
+      data = f.read()
+    index = 0
+    if data[0:3] == b'ID3' and len(data) >= 10:
+      size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+      index = 10 + size
+      if data[5] & 0x10:
+        # footer
+        index = index + 10
+    total = 0.0
+    frames = 0
+    while index + 4 <= len(data):
+      frame = DurationEstimator._mp3_frame(data, index)
+      if frame == None:
+        # resync
+        index = index + 1
+        continue
+      (length, samples, rate) = frame
+      total = total + samples / rate
+      frames = frames + 1
+      index = index + length
+    if frames == 0:
+      return None
+    return total
+
+  @staticmethod
+  def _mp3_frame(data, index):
+    """
+    Decode the MPEG audio frame header at index.
+    Return (frame length, samples, sample rate) or None if it is not a valid
+    header.
+    """
+    b1 = data[index + 1]
+    b2 = data[index + 2]
+    if data[index] != 0xFF or (b1 & 0xE0) != 0xE0:
+      return None
+    version = (b1 >> 3) & 3
+    layer = 4 - ((b1 >> 1) & 3)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    padding = (b2 >> 1) & 1
+    if version == 1 or layer == 4 or bitrate_index == 0 or bitrate_index == 15 or rate_index == 3:
+      return None
+    if version == 3:
+      bitrate = DurationEstimator.MPEG1_BITRATES[layer][bitrate_index] * 1000
+    else:
+      bitrate = DurationEstimator.MPEG2_BITRATES[layer][bitrate_index] * 1000
+    rate = DurationEstimator.MPEG_SAMPLE_RATES[version][rate_index]
+    if layer == 1:
+      samples = 384
+      length = (12 * bitrate // rate + padding) * 4
+    elif layer == 2 or version == 3:
+      samples = 1152
+      length = 144 * bitrate // rate + padding
+    else:
+      samples = 576
+      length = 72 * bitrate // rate + padding
+    return (length, samples, rate)
@@ -1,4 +1,9 @@
 import abc
+import contextlib
+import json
+import os
+import time
+from .encoder_telemetry import EncoderTelemetry
 
 class Ears(object, metaclass=abc.ABCMeta):
   """ Interface for ears """
@@ -7,9 +12,14 @@ class Ears(object, metaclass=abc.ABCMeta):
 
   FORWARD_DIRECTION = 0
   BACKWARD_DIRECTION = 1
+  ANY_DIRECTION = 2     # shortest path
 
   STEPS = 17
 
+  # Positions saved on clean shutdown or sleep.
+  POSITIONS_FILE = '/var/lib/nabd/ears.json'
+  positions_saved = False
+
   @abc.abstractmethod
   def on_move(self, loop, callback):
     """
@@ -43,6 +53,9 @@ class Ears(object, metaclass=abc.ABCMeta):
     Go to a specific position
     If position is not within 0-(STEPS-1), it represents additional turns.
     For example, STEPS means to position the ear at 0 after at least a complete turn.
+    With ANY_DIRECTION, the ear turns in the direction requiring the fewest
+    steps, and additional turns are ignored.
+    A new target replaces the current one if the ear is still moving.
     """
     raise NotImplementedError( 'Should have implemented' )
 
@@ -50,3 +63,320 @@ class Ears(object, metaclass=abc.ABCMeta):
   async def wait_while_running(self):
     """ Wait until both motors have stopped as ears reached their target position """
     raise NotImplementedError( 'Should have implemented' )
+
+  def diagnostics(self):
+    """
+    Return health statistics of the ears, or None if they are not available.
+    """
+    return None
+
+  def save_positions(self):
+    """
+    Save the current positions of the ears, when they are known and the
+    motors are stopped, so that detection can be skipped at next start.
+    """
+    pass
+
+  def invalidate_positions(self):
+    """
+    Delete positions file saved by this instance, as positions are no
+    longer valid once a motor started or an ear was moved by hand.
+    """
+    if self.positions_saved:
+      self.positions_saved = False
+      try:
+        os.remove(Ears.POSITIONS_FILE)
+      except FileNotFoundError:
+        pass
+      except OSError as err:
+        print('Warning : could not delete ears positions file ({err})'.format(err=err))
+
+  @staticmethod
+  def write_positions_file(path, positions):
+    """
+    Write positions file, which also serves as a clean shutdown marker.
+    """
+    try:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      tmp_path = path + '.tmp'
+      with open(tmp_path, 'w') as f:
+        json.dump({'left': positions[0], 'right': positions[1]}, f)
+      os.replace(tmp_path, path)
+      return True
+    except OSError as err:
+      print('Warning : could not save ears positions ({err})'.format(err=err))
+      return False
+
+  @staticmethod
+  def consume_positions_file(path):
+    """
+    Read and delete positions file.
+    Return the positions or None if there was no valid file.
+    The file is deleted here, and by invalidate_positions as soon as the ears
+    move, so that positions are only trusted if they were saved after the
+    last move.
+    """
+    try:
+      with open(path) as f:
+        state = json.load(f)
+      os.remove(path)
+      positions = [state['left'], state['right']]
+      for position in positions:
+        if not isinstance(position, int) or position < 0 or position >= Ears.STEPS:
+          return None
+      return positions
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError, KeyError, TypeError) as err:
+      print('Warning : invalid ears positions file {path} ({err})'.format(path=path, err=err))
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      return None
+
+  @staticmethod
+  def shortest_direction(current, position):
+    """
+    Return (position, direction) to reach position from current with the
+    fewest steps, position being normalized within 0-(STEPS-1).
+    Forward is preferred on ties.
+    """
+    position = position % Ears.STEPS
+    forward_steps = (position - current) % Ears.STEPS
+    backward_steps = (current - position) % Ears.STEPS
+    if backward_steps < forward_steps:
+      return (position, Ears.BACKWARD_DIRECTION)
+    return (position, Ears.FORWARD_DIRECTION)
+
+class EarsMotors(Ears):
+  """
+  Ears driven by motors with encoders, the encoder wheel of each ear having
+  a missing hole revealing its position.
+  This is the motor and encoder state machine shared by hardware backends,
+  which only acquire encoder risings (with a time.monotonic_ns() timestamp)
+  and drive motor pins. The missing hole is detected from the delay between
+  risings.
+  State is protected by state_lock, held by callers of the methods below.
+  Backends receiving risings on another thread use a reentrant lock, others
+  may use no lock at all.
+  """
+  HOLES = Ears.STEPS
+
+  FORWARD_INCREMENT = 1
+  BACKWARD_INCREMENT = -1
+
+  MISSING_HOLE_DELAY_NS = 400000000   # delay between risings revealing the missing hole
+  DETECTION_POLL = 0.3
+  STALL_TIMEOUT = 1.0       # delay without rising after which a move times out
+
+  def __init__(self, state_lock=None):
+    if state_lock == None:
+      state_lock = contextlib.nullcontext()
+    self.state_lock = state_lock
+    self.running = [False, False]
+    self.targets = [0, 0]
+    # Positions saved on clean shutdown are verified when passing the
+    # missing hole, otherwise a detection is required.
+    positions = Ears.consume_positions_file(Ears.POSITIONS_FILE)
+    if positions == None:
+      self.positions = [None, None]
+    else:
+      self.positions = positions
+      self.targets = positions.copy()
+    self.previous_risings = [None, None]
+    self.detection_targets = [None, None]
+    self.position_errors = 0
+    self.last_activity = [0, 0]
+    self.telemetry = EncoderTelemetry()
+    self.directions = [1, 1]
+    self.callback = None
+
+  @abc.abstractmethod
+  def _set_motor(self, ear, direction):
+    """
+    Drive the motor pins of ear, direction being 1, -1 or 0 to stop.
+    """
+    raise NotImplementedError( 'Should have implemented' )
+
+  @abc.abstractmethod
+  def _notify(self):
+    """
+    Wake up tasks waiting for encoder events.
+    Thread: any, with state_lock
+    """
+    raise NotImplementedError( 'Should have implemented' )
+
+  def _encoder_event(self, ear, timestamp_ns):
+    """
+    Process a rising edge of an encoder.
+    Thread: encoder events
+    """
+    with self.state_lock:
+      direction = self.directions[ear]
+      self.telemetry.record(ear, direction, timestamp_ns)
+      self.last_activity[ear] = timestamp_ns
+      if direction == 0:
+        # ear moved by hand
+        self.positions[ear] = None
+        self.invalidate_positions()
+        if self.callback != None:
+          (loop, callback) = self.callback
+          loop.call_soon_threadsafe(callback, ear)
+        return
+      self.positions[ear] = (self.positions[ear] + direction) % EarsMotors.HOLES
+      if self.targets[ear] == None: # detection mode
+        self._detect_missing_hole(ear, direction, timestamp_ns)
+        self._notify()
+      else:
+        self._verify_position(ear, direction, timestamp_ns)
+        if self.positions[ear] == self.targets[ear]:
+          self._stop_motor(ear)
+          self._notify()
+        elif self.positions[ear] == (self.targets[ear] % EarsMotors.HOLES):
+          if self.targets[ear] >= EarsMotors.HOLES:
+            self.targets[ear] = self.targets[ear] - EarsMotors.HOLES
+          elif self.targets[ear] < 0:
+            self.targets[ear] = self.targets[ear] + EarsMotors.HOLES
+
+  def _detect_missing_hole(self, ear, direction, timestamp_ns):
+    """
+    Set the target of an ear being detected when the delay since the
+    previous rising reveals it just passed the missing hole.
+    The default target is the position the ear was in when detection started.
+    """
+    previous = self.previous_risings[ear]
+    self.previous_risings[ear] = timestamp_ns
+    if previous != None and timestamp_ns - previous > EarsMotors.MISSING_HOLE_DELAY_NS:
+      self.targets[ear] = self._detection_target(ear, (direction - self.positions[ear]) % EarsMotors.HOLES)
+      self.positions[ear] = direction % EarsMotors.HOLES
+
+  def _detection_target(self, ear, default):
+    target = self.detection_targets[ear]
+    if target == None:
+      return default
+    return target
+
+  def _verify_position(self, ear, direction, timestamp_ns):
+    """
+    Verify the position when passing the missing hole, i.e. when the delay
+    since the previous rising of a running motor is long enough.
+    Position after the missing hole is 1 forward and 16 backward.
+    """
+    previous = self.previous_risings[ear]
+    self.previous_risings[ear] = timestamp_ns
+    if previous != None and timestamp_ns - previous > EarsMotors.MISSING_HOLE_DELAY_NS:
+      expected = direction % EarsMotors.HOLES
+      if self.positions[ear] != expected:
+        print('Warning : ear {ear} was at {position} instead of {expected}, fixed'.format(ear=ear, position=self.positions[ear], expected=expected))
+        self.position_errors = self.position_errors + 1
+        self.positions[ear] = expected
+
+  def _stop_motor(self, ear):
+    self._set_motor(ear, 0)
+    self.running[ear] = False
+    self.directions[ear] = 0
+
+  def _start_motor(self, ear, direction):
+    """
+    Start motor for given ear.
+    ear = 0 or 1
+    direction = 1 or -1
+    """
+    self._set_motor(ear, direction)
+    self.invalidate_positions()
+    if not self.running[ear] or self.directions[ear] != direction:
+      # First rising after start gives no information on the missing hole
+      self.previous_risings[ear] = None
+      self.telemetry.start_move(ear)
+      self.last_activity[ear] = time.monotonic_ns()
+    self.running[ear] = True
+    self.directions[ear] = direction
+
+  def _running(self):
+    return self.running[0] or self.running[1]
+
+  def _start_detection(self, target_left, target_right):
+    """
+    Start detection of any ear in unknown position. Ears then go to the
+    given targets, or back to their initial position if None.
+    Backends wait for motors to stop, calling _detection_timeouts when no
+    rising was received for DETECTION_POLL.
+    """
+    start = time.monotonic_ns()
+    self.detection_targets = [target_left, target_right]
+    for ear in [0, 1]:
+      if self.positions[ear] == None:
+        self.positions[ear] = 0
+        self.targets[ear] = None
+        self._start_motor(ear, EarsMotors.FORWARD_INCREMENT)
+        self.previous_risings[ear] = start
+
+  def _detection_timeouts(self, now_ns):
+    """
+    Detect the missing hole of ears that stopped providing risings.
+    """
+    for ear in range(2):
+      if self.targets[ear] == None and now_ns - self.previous_risings[ear] > EarsMotors.MISSING_HOLE_DELAY_NS:
+        # At missing hole
+        self.targets[ear] = self._detection_target(ear, (- self.positions[ear]) % EarsMotors.HOLES)
+        self.positions[ear] = 0
+
+  def _stop_stalled_motors(self):
+    """
+    Stop motors that did not move for STALL_TIMEOUT, e.g. because the ear is
+    blocked. Position of the ear is then unknown.
+    """
+    now = time.monotonic_ns()
+    for ear in range(2):
+      if self.running[ear] and now - self.last_activity[ear] > self.STALL_TIMEOUT * 1e9:
+        print('Warning : ear {ear} move timed out'.format(ear=ear))
+        self._stop_motor(ear)
+        self.positions[ear] = None
+        self.telemetry.move_timed_out(ear)
+
+  def _set_target(self, ear, position, direction):
+    """
+    Start moving an ear in known position to a target, or retarget it.
+    See Ears.go
+    """
+    if direction == Ears.ANY_DIRECTION:
+      (position, direction) = Ears.shortest_direction(self.positions[ear], position)
+    self.targets[ear] = position
+    if direction:
+      dir = EarsMotors.BACKWARD_INCREMENT
+    else:
+      dir = EarsMotors.FORWARD_INCREMENT
+    if self.positions[ear] == self.targets[ear] % EarsMotors.HOLES:
+      if self.targets[ear] >= EarsMotors.HOLES:
+        self.targets[ear] = self.targets[ear] - EarsMotors.HOLES
+      elif self.targets[ear] < 0:
+        self.targets[ear] = self.targets[ear] + EarsMotors.HOLES
+      else:
+        # we already are at requested position
+        if self.running[ear]:
+          self._stop_motor(ear)
+          self._notify()
+        return
+    self._start_motor(ear, dir)
+
+  def save_positions(self):
+    with self.state_lock:
+      if self._running() or self.positions[0] == None or self.positions[1] == None:
+        return
+      positions = self.positions.copy()
+    self.positions_saved = Ears.write_positions_file(Ears.POSITIONS_FILE, positions)
+
+  async def move(self, motor, delta, direction):
+    await self.go(motor, self.targets[motor] + delta, direction)
+
+  def diagnostics(self):
+    with self.state_lock:
+      positions = self.positions.copy()
+    missing_hole_delay = EarsMotors.MISSING_HOLE_DELAY_NS / 1e9
+    return {
+      'positions': positions,
+      'position_errors': self.position_errors,
+      'missing_hole_delay': missing_hole_delay,
+      'encoders': self.telemetry.stats(missing_hole_delay),
+    }
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from .ears import EarsMotors
+from .gpio_cdev import GPIOChip
+
+class EarsCdev(EarsMotors):
+  """
+  Implementation of ears with the GPIO character device.
+  Encoder events are read on the event loop with their kernel timestamps, so
+  that no thread is involved and the detection of the missing hole does not
+  depend on scheduling latency.
+  Kernel timestamps are converted to time.monotonic_ns() by LineEvents,
+  whatever the clock of the kernel.
+  """
+  ENCODERS_LINES = [24, 23]
+  MOTOR_LINES = [[12, 11], [10, 9]]
+  ENABLE_LINES = [5, 6]
+  CONSUMER = 'nabd-ears'
+
+  def __init__(self, chip=None):
+    super().__init__()
+    if chip == None:
+      chip = GPIOChip()
+    self.lock = asyncio.Lock()
+    self.waiters = []
+    self.loop = None
+    self.encoders = [chip.request_events(line, GPIOChip.GPIOEVENT_REQUEST_RISING_EDGE, EarsCdev.CONSUMER) for line in EarsCdev.ENCODERS_LINES]
+    # motor lines of both ears followed by enable lines
+    self.output_values = [0, 0, 0, 0, 1, 1]
+    self.outputs = chip.request_outputs(EarsCdev.MOTOR_LINES[0] + EarsCdev.MOTOR_LINES[1] + EarsCdev.ENABLE_LINES, self.output_values, EarsCdev.CONSUMER)
+
+  def on_move(self, loop, callback):
+    self.callback = (loop, callback)
+    self._watch(loop)
+
+  def _watch(self, loop):
+    if self.loop is loop:
+      return
+    self.loop = loop
+    for ear, encoder in enumerate(self.encoders):
+      encoder.watch(loop, lambda timestamp_ns, edge, ear=ear: self._encoder_event(ear, timestamp_ns))
+
+  def _set_motor(self, ear, direction):
+    if direction == 0:
+      self.output_values[ear * 2] = 0
+      self.output_values[ear * 2 + 1] = 0
+    else:
+      dir_ix = int((1 - direction) / 2)
+      self.output_values[ear * 2 + 1 - dir_ix] = 0
+      self.output_values[ear * 2 + dir_ix] = 1
+    self.outputs.set_values(self.output_values)
+
+  def _notify(self):
+    waiters = self.waiters
+    self.waiters = []
+    for waiter in waiters:
+      if not waiter.done():
+        waiter.set_result(True)
+
+  async def _wait(self, timeout=None):
+    """
+    Wait for the next encoder event.
+    Return False on timeout.
+    """
+    waiter = asyncio.get_event_loop().create_future()
+    self.waiters.append(waiter)
+    try:
+      await asyncio.wait_for(waiter, timeout)
+      return True
+    except asyncio.TimeoutError:
+      return False
+    finally:
+      if waiter in self.waiters:
+        self.waiters.remove(waiter)
+
+  async def reset_ears(self, target_left, target_right):
+    async with self.lock:
+      self.positions = [None, None]
+      await self._run_detection(target_left, target_right)
+
+  async def _run_detection(self, target_left, target_right):
+    """
+    Run detection of any ear in unknown position.
+    Missing hole is detected by the encoder event handler from the kernel
+    timestamps, or here if the ear stopped providing events.
+    """
+    self._watch(asyncio.get_event_loop())
+    self._start_detection(target_left, target_right)
+    while self._running():
+      if not await self._wait(EarsMotors.DETECTION_POLL):
+        self._detection_timeouts(time.monotonic_ns())
+    return self.positions.copy()
+
+  async def wait_while_running(self):
+    while self._running():
+      if not await self._wait(self.STALL_TIMEOUT):
+        self._stop_stalled_motors()
+
+  async def detect_positions(self):
+    """
+    Get the position of the ears, running a detection if required.
+    """
+    async with self.lock:
+      if self.positions[0] == None or self.positions[1] == None:
+        return await self._run_detection(None, None)
+      return (self.positions[0], self.positions[1])
+
+  async def go(self, ear, position, direction):
+    """
+    Go to a specific position.
+    See Ears.go
+    """
+    async with self.lock:
+      # Return ears to a known state
+      if self.positions[0] == None or self.positions[1] == None:
+        await self._run_detection(0, 0)
+      self._set_target(ear, position, direction)
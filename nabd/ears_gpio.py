@@ -4,30 +4,28 @@ import asyncio
 import time
 import sys
 import atexit
-from concurrent.futures import ThreadPoolExecutor
-from .ears import Ears
+from .executors import registry, Lane
+from .ears import EarsMotors
 
 @atexit.register
 def cleanup_gpio():
   GPIO.setwarnings(False)
   GPIO.cleanup()
 
-class EarsGPIO(Ears):
+class EarsGPIO(EarsMotors):
+  """
+  Implementation of ears with RPi.GPIO.
+  Encoder risings are received on the RPi.GPIO event thread and stamped on
+  receipt. Detection and waits run on the ears executor, with encoder_cv.
+  """
   ENCODERS_CHANNELS = [24, 23]
   MOTOR_CHANNELS = [[12, 11], [10, 9]]
   ENABLE_CHANNELS = [5, 6]
-  HOLES = Ears.STEPS
-
-  FORWARD_INCREMENT = 1
-  BACKWARD_INCREMENT = -1
 
   def __init__(self):
-    self.running = [False, False]
-    self.targets = [0, 0]
     self.encoder_cv = Condition()
-    self.positions = [0, 0]
-    self.directions = [1, 1]
-    self.executor = ThreadPoolExecutor(max_workers=1)
+    super().__init__(self.encoder_cv)
+    self.executor = registry.lane('ears', priority=Lane.PRIORITY_HIGH)
     self.lock = asyncio.Lock()
     GPIO.setwarnings(True)
     GPIO.setmode(GPIO.BCM)
@@ -51,52 +49,28 @@ class EarsGPIO(Ears):
     Callback from GPIO.
     Thread: Rpi.GPIO event thread
     """
+    timestamp_ns = time.monotonic_ns()
     if channel == EarsGPIO.ENCODERS_CHANNELS[0]:
       ear = 0
     elif channel == EarsGPIO.ENCODERS_CHANNELS[1]:
       ear = 1
-    with self.encoder_cv:
-      direction = self.directions[ear]
-      if direction == 0:
-        self.positions[ear] = None
-        (loop, callback) = self.callback
-        loop.call_soon_threadsafe(lambda ear=ear: callback(ear))
-      else:
-        self.positions[ear] = (self.positions[ear] + direction) % EarsGPIO.HOLES
-        if self.targets[ear] == None: # reset mode
-          self.encoder_cv.notify()
-        else:
-          if self.positions[ear] == self.targets[ear]:
-            self._stop_motor(ear)
-            self.encoder_cv.notify()
-          elif self.positions[ear] == (self.targets[ear] % EarsGPIO.HOLES):
-            if self.targets[ear] >= EarsGPIO.HOLES:
-              self.targets[ear] = self.targets[ear] - EarsGPIO.HOLES
-            elif self.targets[ear] < 0:
-              self.targets[ear] = self.targets[ear] + EarsGPIO.HOLES
+    self._encoder_event(ear, timestamp_ns)
 
-  def _stop_motor(self, ear):
+  def _set_motor(self, ear, direction):
     """
-    Stop motor by changing the channels GPIOs.
-    Thread: RPi.GPIO event
+    Change the channels GPIOs of a motor.
+    Thread: RPi.GPIO event, main loop or executor, with encoder_cv
     """
-    for channel in EarsGPIO.MOTOR_CHANNELS[ear]:
-      GPIO.output(channel, GPIO.LOW)
-    self.running[ear] = False
-    self.directions[ear] = 0
+    if direction == 0:
+      for channel in EarsGPIO.MOTOR_CHANNELS[ear]:
+        GPIO.output(channel, GPIO.LOW)
+    else:
+      dir_ix = int((1 - direction) / 2)
+      GPIO.output(EarsGPIO.MOTOR_CHANNELS[ear][1 - dir_ix], GPIO.LOW)
+      GPIO.output(EarsGPIO.MOTOR_CHANNELS[ear][dir_ix], GPIO.HIGH)
 
-  def _start_motor(self, ear, direction):
-    """
-    Start motor for given ear.
-    ear = 0 or 1
-    direction = 1 or -1
-    Threads: main loop or executor
-    """
-    dir_ix = int((1 - direction) / 2)
-    GPIO.output(EarsGPIO.MOTOR_CHANNELS[ear][1 - dir_ix], GPIO.LOW)
-    GPIO.output(EarsGPIO.MOTOR_CHANNELS[ear][dir_ix], GPIO.HIGH)
-    self.running[ear] = True
-    self.directions[ear] = direction
+  def _notify(self):
+    self.encoder_cv.notify()
 
   def on_move(self, loop, callback):
     self.callback = (loop, callback)
@@ -110,60 +84,23 @@ class EarsGPIO(Ears):
     Reset ears by running a detection and ignoring the result.
     Thread: executor
     """
-    self.positions = [None, None]
+    with self.encoder_cv:
+      self.positions = [None, None]
     self._run_detection(target_left, target_right)
 
   def _run_detection(self, target_left, target_right):
     """
     Run detection of any ear in unknown position.
+    Missing hole is detected by the encoder callback from the delay between
+    risings, or here if the ear stopped providing risings.
     Thread: executor
     """
-    for ear in [0, 1]:
-      if self.positions[ear] == None:
-        self.positions[ear] = 0
-        self.targets[ear] = None
-        self._start_motor(ear, EarsGPIO.FORWARD_INCREMENT)
-    start = time.time()
-    previous_risings = [start, start]
     with self.encoder_cv:
-      current_positions = self.positions.copy()
-      while self.running[0] or self.running[1]:
-        if self.encoder_cv.wait(0.3):
-          # Got a signal
-          now = time.time()
-          for ear in range(2):
-            if self.targets[ear] == None and self.positions[ear] != current_positions[ear]:
-              delta = now - previous_risings[ear]
-              if delta > 0.4:
-                # passed the missing hole
-                if target_left != None and ear == Ears.LEFT_EAR:
-                  self.targets[ear] = target_left
-                elif target_right != None and ear == Ears.RIGHT_EAR:
-                  self.targets[ear] = target_right
-                else:
-                  self.targets[ear] = (self.directions[ear] - self.positions[ear]) % EarsGPIO.HOLES
-                self.positions[ear] = self.directions[ear]
-              current_positions[ear] = self.positions[ear]
-              previous_risings[ear] = now
-        else:
-          # Got no signal.
-          now = time.time()
-          for ear in range(2):
-            if self.targets[ear] == None:
-              delta = now - previous_risings[ear]
-              if delta > 0.4:
-                # At missing hole
-                if target_left != None and ear == Ears.LEFT_EAR:
-                  self.targets[ear] = target_left
-                elif target_right != None and ear == Ears.RIGHT_EAR:
-                  self.targets[ear] = target_right
-                else:
-                  self.targets[ear] = (- self.positions[ear]) % EarsGPIO.HOLES
-                self.positions[ear] = 0
-    return self.positions.copy()
-
-  async def move(self, motor, delta, direction):
-    await self.go(motor, self.targets[motor] + delta, direction)
+      self._start_detection(target_left, target_right)
+      while self._running():
+        if not self.encoder_cv.wait(EarsMotors.DETECTION_POLL):
+          self._detection_timeouts(time.monotonic_ns())
+      return self.positions.copy()
 
   async def wait_while_running(self):
     await asyncio.get_event_loop().run_in_executor(self.executor, self._do_wait_while_running)
@@ -174,8 +111,9 @@ class EarsGPIO(Ears):
     Thread: executor
     """
     with self.encoder_cv:
-      while self.running[0] or self.running[1]:
-        self.encoder_cv.wait()
+      while self._running():
+        if not self.encoder_cv.wait(self.STALL_TIMEOUT):
+          self._stop_stalled_motors()
 
   async def detect_positions(self):
     """
@@ -189,24 +127,11 @@ class EarsGPIO(Ears):
   async def go(self, ear, position, direction):
     """
     Go to a specific position.
-    If direction is 0, turn forward, otherwise, turn backward
-    If position is not within 0-16, it represents additional turns.
-    For example, 17 means to position the ear at 0 after at least a complete turn.
+    See Ears.go
     """
     async with self.lock:
       # Return ears to a known state
       if self.positions[0] == None or self.positions[1] == None:
         await asyncio.get_event_loop().run_in_executor(self.executor, self._run_detection, 0, 0)
-      self.targets[ear] = position
-      if direction:
-        dir = EarsGPIO.BACKWARD_INCREMENT
-      else:
-        dir = EarsGPIO.FORWARD_INCREMENT
-      if self.positions[ear] == self.targets[ear] % EarsGPIO.HOLES:
-        if self.targets[ear] >= EarsGPIO.HOLES:
-          self.targets[ear] = self.targets[ear] - EarsGPIO.HOLES
-        elif self.targets[ear] < 0:
-          self.targets[ear] = self.targets[ear] + EarsGPIO.HOLES
-        else:
-          return  # we already are at requested position
-      self._start_motor(ear, dir)
+      with self.encoder_cv:
+        self._set_target(ear, position, direction)
@@ -0,0 +1,124 @@
+import array
+import time
+
+class EncoderTelemetry(object):
+  """
+  Fixed-size ring buffer of encoder risings, with derived ear health
+  statistics.
+  Records are (monotonic_ns, ear, direction) stored in preallocated arrays,
+  so that recording from the encoder callback does not allocate. Each record
+  also carries the number of the move it belongs to, so that intervals are
+  only measured between risings of a same move.
+  Records are written by the encoder callback and read by the loop without
+  a lock: statistics may miss the most recent record.
+  """
+  CAPACITY = 1024
+
+  def __init__(self, capacity=CAPACITY):
+    self.capacity = capacity
+    self.timestamps = array.array('q', [0]) * capacity
+    self.ears = array.array('b', [0]) * capacity
+    self.directions = array.array('b', [0]) * capacity
+    self.moves = array.array('l', [0]) * capacity
+    self.count = 0                  # total number of records
+    self.current_moves = [0, 0]     # move counter, by ear
+    self.timed_out_moves = [0, 0]
+
+  def start_move(self, ear):
+    """
+    Signal that the motor of ear started or changed direction.
+    """
+    self.current_moves[ear] = self.current_moves[ear] + 1
+
+  def record(self, ear, direction, timestamp_ns=None):
+    """
+    Record a rising, direction being 0 if the motor was stopped (ear moved
+    by the user).
+    """
+    if timestamp_ns == None:
+      timestamp_ns = time.monotonic_ns()
+    index = self.count % self.capacity
+    self.timestamps[index] = timestamp_ns
+    self.ears[index] = ear
+    self.directions[index] = direction
+    self.moves[index] = self.current_moves[ear]
+    self.count = self.count + 1
+
+  def move_timed_out(self, ear):
+    self.timed_out_moves[ear] = self.timed_out_moves[ear] + 1
+
+  def events(self):
+    """
+    Return recorded (monotonic_ns, ear, direction) tuples, oldest first.
+    """
+    return [(timestamp_ns, ear, direction) for (timestamp_ns, ear, direction, move) in self._records()]
+
+  def _records(self):
+    count = self.count
+    first = max(0, count - self.capacity)
+    records = []
+    for n in range(first, count):
+      index = n % self.capacity
+      records.append((self.timestamps[index], self.ears[index], self.directions[index], self.moves[index]))
+    return records
+
+  def intervals(self, ear):
+    """
+    Return intervals in nanoseconds between consecutive risings of ear while
+    its motor was running in a same direction.
+    """
+    intervals = []
+    previous = None
+    for (timestamp_ns, record_ear, direction, move) in self._records():
+      if record_ear != ear:
+        continue
+      if direction == 0:
+        previous = None
+        continue
+      if previous != None and previous[1] == move:
+        intervals.append(timestamp_ns - previous[0])
+      previous = (timestamp_ns, move)
+    return intervals
+
+  def stats(self, missing_hole_delay):
+    """
+    Compute statistics by ear for a given missing hole delay (in seconds):
+    - steps_per_second: median speed
+    - steps, gaps: counts of intervals below and above the delay
+    - max_step_interval, min_gap_interval: in seconds
+    - gap_confidence: margin between the delay and the closest interval,
+      relative to the delay (0: ambiguous, 1: clear)
+    - suggested_missing_hole_delay: midpoint between the longest step and
+      the shortest gap
+    - timed_out_moves
+    """
+    threshold_ns = missing_hole_delay * 1e9
+    result = []
+    for ear in range(2):
+      intervals = sorted(self.intervals(ear))
+      steps = [interval for interval in intervals if interval <= threshold_ns]
+      gaps = [interval for interval in intervals if interval > threshold_ns]
+      ear_stats = {
+        'steps': len(steps),
+        'gaps': len(gaps),
+        'steps_per_second': None,
+        'max_step_interval': None,
+        'min_gap_interval': None,
+        'gap_confidence': None,
+        'suggested_missing_hole_delay': None,
+        'timed_out_moves': self.timed_out_moves[ear],
+      }
+      margins = []
+      if len(steps) > 0:
+        ear_stats['steps_per_second'] = 1e9 / steps[len(steps) // 2]
+        ear_stats['max_step_interval'] = steps[-1] / 1e9
+        margins.append(threshold_ns - steps[-1])
+      if len(gaps) > 0:
+        ear_stats['min_gap_interval'] = gaps[0] / 1e9
+        margins.append(gaps[0] - threshold_ns)
+      if len(margins) > 0:
+        ear_stats['gap_confidence'] = min(1.0, min(margins) / threshold_ns)
+      if len(steps) > 0 and len(gaps) > 0:
+        ear_stats['suggested_missing_hole_delay'] = (steps[-1] + gaps[0]) / 2e9
+      result.append(ear_stats)
+    return result
@@ -0,0 +1,282 @@
+import collections
+import concurrent.futures
+import contextvars
+import itertools
+import queue
+import threading
+import time
+
+class Lane(concurrent.futures.Executor):
+  """
+  Named and bounded executor for a subsystem.
+  Tasks of a lane run in submission order, with at most max_workers tasks
+  running at once. A dedicated lane has its own threads, while other lanes
+  share the threads of the registry, the lane with the highest priority
+  (lowest value) being served first.
+  Lanes record queue depth, wait time and run time.
+  Tasks run in the context variables of their submitter (e.g. trace ids).
+  """
+  PRIORITY_HIGH = 0
+  PRIORITY_NORMAL = 1
+  PRIORITY_LOW = 2
+
+  STUCK_AFTER = 30.0      # seconds
+
+  def __init__(self, registry, name, max_workers=1, priority=PRIORITY_NORMAL, dedicated=False, stuck_after=STUCK_AFTER):
+    self.registry = registry
+    self.name = name
+    self.max_workers = max_workers
+    self.priority = priority
+    self.dedicated = dedicated
+    self.stuck_after = stuck_after
+    self.lock = threading.Lock()
+    self.pending = collections.deque()
+    self.running = {}         # task id -> (description, start time)
+    self.scheduled = 0        # tasks handed to workers, running or queued
+    self.queued = 0           # tasks handed to workers, not started yet
+    self.threads = []
+    self.work_queue = None
+    self.shutdown_requested = False
+    self.submitted = 0
+    self.completed = 0
+    self.failed = 0
+    self.total_wait = 0.0
+    self.max_wait = 0.0
+    self.total_run = 0.0
+    self.max_run = 0.0
+
+  def submit(self, fn, *args, **kwargs):
+    future = concurrent.futures.Future()
+    description = getattr(fn, '__qualname__', repr(fn))
+    with self.lock:
+      if self.shutdown_requested:
+        raise RuntimeError('cannot schedule new futures after shutdown')
+      self.pending.append((future, fn, args, kwargs, description, time.monotonic(), contextvars.copy_context()))
+      self.submitted = self.submitted + 1
+    self._schedule()
+    return future
+
+  def _schedule(self):
+    """
+    Hand pending tasks to workers within the concurrency bound.
+    """
+    with self.lock:
+      count = min(len(self.pending) - self.queued, self.max_workers - self.scheduled)
+      if count <= 0:
+        return
+      self.scheduled = self.scheduled + count
+      self.queued = self.queued + count
+      if self.dedicated:
+        if self.work_queue == None:
+          self.work_queue = queue.SimpleQueue()
+        while len(self.threads) < self.max_workers:
+          name = '{name}-{index}'.format(name=self.name, index=len(self.threads))
+          self.threads.append(self.registry._start_thread(name, self._dedicated_worker))
+    for _ in range(count):
+      if self.dedicated:
+        self.work_queue.put(self)
+      else:
+        self.registry._enqueue(self)
+
+  def _dedicated_worker(self):
+    while True:
+      lane = self.work_queue.get()
+      if lane == None:
+        return
+      lane._run_next()
+
+  def _run_next(self):
+    """
+    Run the oldest pending task.
+    Thread: lane or registry worker
+    """
+    with self.lock:
+      self.queued = self.queued - 1
+      if len(self.pending) == 0:
+        self.scheduled = self.scheduled - 1
+        return
+      (future, fn, args, kwargs, description, submitted, context) = self.pending.popleft()
+      start = time.monotonic()
+      wait = start - submitted
+      self.total_wait = self.total_wait + wait
+      self.max_wait = max(self.max_wait, wait)
+      task_id = id(future)
+      self.running[task_id] = (description, start)
+    try:
+      if future.set_running_or_notify_cancel():
+        try:
+          result = context.run(fn, *args, **kwargs)
+        except BaseException as err:
+          future.set_exception(err)
+          with self.lock:
+            self.failed = self.failed + 1
+        else:
+          future.set_result(result)
+    finally:
+      run_time = time.monotonic() - start
+      with self.lock:
+        del self.running[task_id]
+        self.completed = self.completed + 1
+        self.total_run = self.total_run + run_time
+        self.max_run = max(self.max_run, run_time)
+        self.scheduled = self.scheduled - 1
+      self._schedule()
+
+  def shutdown(self, wait=True, cancel_futures=False):
+    with self.lock:
+      self.shutdown_requested = True
+      if cancel_futures:
+        while len(self.pending) > 0:
+          self.pending.popleft()[0].cancel()
+      threads = list(self.threads)
+    if self.dedicated and self.work_queue != None:
+      for _ in threads:
+        self.work_queue.put(None)
+      if wait:
+        for thread in threads:
+          thread.join()
+
+  def stuck_tasks(self, now=None):
+    """
+    Return (description, age) of tasks running for more than stuck_after.
+    Long-running tasks such as audio playback are never stuck, with
+    stuck_after set to None.
+    """
+    return [(description, age) for (task_id, description, age) in self._stuck_tasks(now)]
+
+  def _stuck_tasks(self, now=None):
+    if self.stuck_after == None:
+      return []
+    if now == None:
+      now = time.monotonic()
+    with self.lock:
+      return [(task_id, description, now - start) for (task_id, (description, start)) in self.running.items() if now - start > self.stuck_after]
+
+  def stats(self):
+    with self.lock:
+      started = self.completed + len(self.running)
+      return {
+        'priority': self.priority,
+        'dedicated': self.dedicated,
+        'max_workers': self.max_workers,
+        'queue_depth': len(self.pending),
+        'running': len(self.running),
+        'submitted': self.submitted,
+        'completed': self.completed,
+        'failed': self.failed,
+        'avg_wait_time': self.total_wait / started if started > 0 else None,
+        'max_wait_time': self.max_wait,
+        'avg_run_time': self.total_run / self.completed if self.completed > 0 else None,
+        'max_run_time': self.max_run,
+      }
+
+class ExecutorRegistry(object):
+  """
+  Inventory of the executors of nabd.
+  Subsystems get a named lane, and lanes that are not dedicated share a
+  small pool of threads. Threads are created lazily, with an optional
+  reduced stack size for boards with little memory.
+  """
+  SHARED_WORKERS = 2
+  WATCHDOG_INTERVAL = 10.0
+
+  def __init__(self, shared_workers=SHARED_WORKERS, stack_size=None):
+    self.shared_workers = shared_workers
+    self.stack_size = stack_size
+    self.lanes = {}
+    self.lock = threading.Lock()
+    self.stack_size_lock = threading.Lock()
+    self.shared_queue = queue.PriorityQueue()
+    self.shared_threads = []
+    self.sequence = itertools.count()
+    self.reported = set()
+
+  def set_stack_size(self, stack_size):
+    """
+    Set the stack size of threads created from now on.
+    Raise ValueError if the size is rejected by threading (e.g. under 32 KiB).
+    """
+    with self.stack_size_lock:
+      previous = threading.stack_size(stack_size)
+      threading.stack_size(previous)
+      self.stack_size = stack_size
+
+  def lane(self, name, max_workers=1, priority=Lane.PRIORITY_NORMAL, dedicated=False, stuck_after=Lane.STUCK_AFTER):
+    """
+    Return the lane with this name, creating it on first call.
+    """
+    with self.lock:
+      lane = self.lanes.get(name)
+      if lane == None:
+        lane = Lane(self, name, max_workers, priority, dedicated, stuck_after)
+        self.lanes[name] = lane
+      return lane
+
+  def _start_thread(self, name, target):
+    with self.stack_size_lock:
+      if self.stack_size != None:
+        previous = threading.stack_size(self.stack_size)
+      try:
+        thread = threading.Thread(target = target, name = name, daemon = True)
+        thread.start()
+      finally:
+        if self.stack_size != None:
+          threading.stack_size(previous)
+    return thread
+
+  def _enqueue(self, lane):
+    self.shared_queue.put((lane.priority, next(self.sequence), lane))
+    with self.lock:
+      if len(self.shared_threads) < self.shared_workers:
+        name = 'shared-{index}'.format(index=len(self.shared_threads))
+        self.shared_threads.append(self._start_thread(name, self._shared_worker))
+
+  def _shared_worker(self):
+    while True:
+      (priority, sequence, lane) = self.shared_queue.get()
+      lane._run_next()
+
+  def stats(self):
+    return {name: lane.stats() for (name, lane) in self.lanes.items()}
+
+  def stuck_tasks(self):
+    """
+    Return (lane name, description, age) of stuck tasks.
+    """
+    now = time.monotonic()
+    stuck = []
+    for lane in list(self.lanes.values()):
+      for (description, age) in lane.stuck_tasks(now):
+        stuck.append((lane.name, description, age))
+    return stuck
+
+  @staticmethod
+  def threads():
+    """
+    Return the names of all threads of the process.
+    """
+    return sorted([thread.name for thread in threading.enumerate()])
+
+  def diagnostics(self):
+    return {
+      'lanes': self.stats(),
+      'stuck': [{'lane': lane, 'task': description, 'age': age} for (lane, description, age) in self.stuck_tasks()],
+      'threads': ExecutorRegistry.threads(),
+    }
+
+  def report_stuck_tasks(self):
+    """
+    Print a warning for each task that got stuck, once per task.
+    Tasks are forgotten once they are no longer stuck.
+    """
+    now = time.monotonic()
+    stuck = set()
+    for lane in list(self.lanes.values()):
+      for (task_id, description, age) in lane._stuck_tasks(now):
+        key = (lane.name, task_id)
+        stuck.add(key)
+        if key not in self.reported:
+          print('Warning : {task} stuck in {lane} executor for {age:.1f} seconds'.format(task=description, lane=lane.name, age=age))
+    self.reported = stuck
+
+registry = ExecutorRegistry()
@@ -0,0 +1,80 @@
+import asyncio
+import bisect
+
+class LatenessHistogram(object):
+  """
+  Histogram of frame lateness, i.e. how late frames were played compared to
+  their scheduled time.
+  """
+  # Upper bounds of buckets, in seconds. Last bucket is unbounded.
+  BOUNDS = [0.001, 0.002, 0.005, 0.010, 0.020, 0.050, 0.100, 0.200, 0.500, 1.0]
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.counts = [0] * (len(LatenessHistogram.BOUNDS) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.skipped = 0
+
+  def record(self, lateness):
+    self.counts[bisect.bisect_left(LatenessHistogram.BOUNDS, lateness)] += 1
+    self.count = self.count + 1
+    self.total = self.total + lateness
+    if lateness > self.max:
+      self.max = lateness
+
+  def stats(self):
+    """
+    Return a JSON-serializable representation of the histogram.
+    Buckets are keyed by their upper bound in milliseconds.
+    """
+    buckets = {}
+    for bound, count in zip(LatenessHistogram.BOUNDS, self.counts):
+      buckets[str(int(bound * 1000))] = count
+    buckets['+Inf'] = self.counts[-1]
+    return {
+      'frames': self.count,
+      'skipped_led_writes': self.skipped,
+      'mean_lateness_ms': (self.total / self.count * 1000.0) if self.count else 0.0,
+      'max_lateness_ms': self.max * 1000.0,
+      'lateness_ms': buckets
+    }
+
+class FrameScheduler(object):
+  """
+  Drift-free frame scheduler based on the monotonic clock.
+  Frame times are computed from the start time and accumulated delays, so
+  a late frame does not shift subsequent frames, and wall clock changes
+  (e.g. NTP corrections at boot) do not affect timing.
+  The default clock is the time of the running loop, which is monotonic
+  for regular loops and virtual for VirtualTimeEventLoop.
+  """
+  def __init__(self, histogram=None, clock=None):
+    self.histogram = histogram
+    self.clock = clock
+    self.now = clock
+    self.next_time = None
+    self.lateness = 0.0
+
+  def start(self):
+    if self.clock == None:
+      self.now = asyncio.get_event_loop().time
+    self.next_time = self.now()
+    self.lateness = 0.0
+
+  async def wait(self, delay):
+    """
+    Wait until next frame, delay seconds after the previous one.
+    Return how late the frame is, in seconds.
+    """
+    self.next_time = self.next_time + delay
+    sleep_delta = self.next_time - self.now()
+    if sleep_delta > 0:
+      await asyncio.sleep(sleep_delta)
+    self.lateness = max(0.0, self.now() - self.next_time)
+    if self.histogram != None:
+      self.histogram.record(self.lateness)
+    return self.lateness
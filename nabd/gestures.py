@@ -0,0 +1,98 @@
+import time
+
+class GestureRecognizer(object):
+  """
+  Button gesture state machine running on the event loop.
+  It is fed with timestamped edges and emits down and up events as well as
+  gestures, using loop timers for timeouts.
+  Gestures are defined by a table: for each state, a button edge ('down' or
+  'up') leads to a new state and either emits a gesture or arms a timer.
+  When the timer expires, its gesture is emitted and the machine returns to
+  the initial state. Timeouts are named, and configurable per model.
+  """
+  INITIAL_STATE = 'idle'
+
+  #
+  # idle --- down --> pressed --- hold timeout ---> hold
+  #                    |
+  #                    --- up ---> released --- double click timeout ---> click
+  #                                 |
+  #                                 --- down ---> pressed2 --- click and hold timeout ---> click_and_hold
+  #                                                |
+  #                                                --- up ---> released2 --- triple click timeout ---> double_click
+  #                                                             |
+  #                                                             --- down ---> pressed3 --- triple click timeout ---> click_and_hold
+  #                                                                            |
+  #                                                                            --- up ---> triple_click
+  #
+  # state -> {edge: (next state, gesture emitted now, timeout name, gesture emitted on timeout)}
+  GESTURES = {
+    'idle': {'down': ('pressed', None, 'hold', 'hold')},
+    'pressed': {'up': ('released', None, 'double_click', 'click')},
+    'released': {'down': ('pressed2', None, 'click_and_hold', 'click_and_hold')},
+    'pressed2': {'up': ('released2', None, 'triple_click', 'double_click')},
+    'released2': {'down': ('pressed3', None, 'triple_click', 'click_and_hold')},
+    'pressed3': {'up': ('idle', 'triple_click', None, None)},
+  }
+
+  TIMEOUTS = {
+    'hold': 2.0,
+    'click_and_hold': 2.0,
+    'double_click': 0.15,
+    'triple_click': 0.15,
+  }
+
+  # Timeouts overriding TIMEOUTS, by model
+  MODEL_TIMEOUTS = {}
+
+  def __init__(self, loop, callback, gestures=GESTURES, timeouts=TIMEOUTS, clock=time.monotonic):
+    self.loop = loop
+    self.callback = callback
+    self.gestures = gestures
+    self.timeouts = timeouts
+    self.clock = clock
+    self.state = GestureRecognizer.INITIAL_STATE
+    self.button_state = 'up'
+    self.timer = None
+
+  @staticmethod
+  def model_timeouts(hw_model):
+    timeouts = GestureRecognizer.TIMEOUTS.copy()
+    timeouts.update(GestureRecognizer.MODEL_TIMEOUTS.get(hw_model, {}))
+    return timeouts
+
+  def edge(self, pressed, timestamp):
+    """
+    Process an edge, timestamp being the clock time when it occurred.
+    Edges repeating the current button state are ignored.
+    Thread: loop
+    """
+    if pressed:
+      edge = 'down'
+    else:
+      edge = 'up'
+    if edge == self.button_state:
+      return
+    self.button_state = edge
+    if self.timer:
+      self.timer.cancel()
+      self.timer = None
+    self._emit(edge, timestamp)
+    transition = self.gestures[self.state].get(edge)
+    if transition == None:
+      return
+    (self.state, gesture, timeout, timeout_gesture) = transition
+    if gesture != None:
+      self._emit(gesture, timestamp)
+    if timeout != None:
+      # Timer runs from the edge, not from when it was processed
+      delay = self.timeouts[timeout] - (self.clock() - timestamp)
+      self.timer = self.loop.call_later(max(0, delay), self._timeout, timeout_gesture, timestamp + self.timeouts[timeout])
+
+  def _timeout(self, gesture, timestamp):
+    self.timer = None
+    self.state = GestureRecognizer.INITIAL_STATE
+    self._emit(gesture, timestamp)
+
+  def _emit(self, event, timestamp):
+    self.callback(event, time.time() - (self.clock() - timestamp))
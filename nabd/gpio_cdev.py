@@ -0,0 +1,176 @@
+import fcntl
+import os
+import struct
+import time
+
+class GPIOChip(object):
+  """
+  GPIO chip accessed through the Linux GPIO character device (v1 uAPI, as
+  used by libgpiod 1.x).
+  On a Raspberry Pi, line offsets of gpiochip0 are BCM GPIO numbers.
+  """
+  DEFAULT_PATH = '/dev/gpiochip0'
+
+  # ioctls, from linux/gpio.h
+  GPIO_GET_LINEHANDLE_IOCTL = 0xC16CB403
+  GPIO_GET_LINEEVENT_IOCTL = 0xC030B404
+
+  GPIOHANDLE_REQUEST_INPUT = 1 << 0
+  GPIOHANDLE_REQUEST_OUTPUT = 1 << 1
+  GPIOEVENT_REQUEST_RISING_EDGE = 1 << 0
+  GPIOEVENT_REQUEST_FALLING_EDGE = 1 << 1
+  GPIOEVENT_REQUEST_BOTH_EDGES = GPIOEVENT_REQUEST_RISING_EDGE | GPIOEVENT_REQUEST_FALLING_EDGE
+
+  GPIOHANDLES_MAX = 64
+  LABEL_SIZE = 32
+
+  # struct gpioevent_request
+  EVENT_REQUEST_FORMAT = '=III32si'
+  # struct gpiohandle_request
+  HANDLE_REQUEST_FORMAT = '=64II64B32sIi'
+
+  def __init__(self, path=DEFAULT_PATH):
+    self.path = path
+    self.fd = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+
+  def request_events(self, offset, edges, label):
+    """
+    Request edge events for a line, configured as input.
+    Return a LineEvents object.
+    """
+    request = bytearray(struct.pack(GPIOChip.EVENT_REQUEST_FORMAT,
+      offset,
+      GPIOChip.GPIOHANDLE_REQUEST_INPUT,
+      edges,
+      label.encode('ascii')[:GPIOChip.LABEL_SIZE - 1],
+      0))
+    fcntl.ioctl(self.fd, GPIOChip.GPIO_GET_LINEEVENT_IOCTL, request)
+    fd = struct.unpack(GPIOChip.EVENT_REQUEST_FORMAT, request)[4]
+    return LineEvents(fd)
+
+  def request_outputs(self, offsets, default_values, label):
+    """
+    Request lines as outputs.
+    Return a LineHandle object.
+    """
+    count = len(offsets)
+    padding = GPIOChip.GPIOHANDLES_MAX - count
+    request = bytearray(struct.pack(GPIOChip.HANDLE_REQUEST_FORMAT,
+      *(list(offsets) + [0] * padding),
+      GPIOChip.GPIOHANDLE_REQUEST_OUTPUT,
+      *(list(default_values) + [0] * padding),
+      label.encode('ascii')[:GPIOChip.LABEL_SIZE - 1],
+      count,
+      0))
+    fcntl.ioctl(self.fd, GPIOChip.GPIO_GET_LINEHANDLE_IOCTL, request)
+    fd = struct.unpack(GPIOChip.HANDLE_REQUEST_FORMAT, request)[-1]
+    return LineHandle(fd, count)
+
+  def close(self):
+    os.close(self.fd)
+
+class LineHandle(object):
+  """
+  Output lines requested together.
+  """
+  GPIOHANDLE_GET_LINE_VALUES_IOCTL = 0xC040B408
+  GPIOHANDLE_SET_LINE_VALUES_IOCTL = 0xC040B409
+
+  def __init__(self, fd, count):
+    self.fd = fd
+    self.count = count
+
+  def set_values(self, values):
+    data = bytearray(GPIOChip.GPIOHANDLES_MAX)
+    data[0:len(values)] = bytes(values)
+    fcntl.ioctl(self.fd, LineHandle.GPIOHANDLE_SET_LINE_VALUES_IOCTL, data)
+
+  def get_values(self):
+    data = bytearray(GPIOChip.GPIOHANDLES_MAX)
+    fcntl.ioctl(self.fd, LineHandle.GPIOHANDLE_GET_LINE_VALUES_IOCTL, data)
+    return list(data[0:self.count])
+
+  def close(self):
+    os.close(self.fd)
+
+class LineEvents(object):
+  """
+  Edge events of an input line.
+  The event file descriptor is watched by the asyncio loop, so that events
+  are processed on the loop thread, with the timestamp set by the kernel
+  when the interrupt occurred. This timestamp is CLOCK_MONOTONIC since
+  Linux 5.7 and CLOCK_REALTIME before: it is converted to the
+  time.monotonic_ns() clock before being passed to the callback.
+  """
+  # struct gpioevent_data
+  EVENT_FORMAT = '=QI4x'
+  EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+  RISING_EDGE = 0x01
+  FALLING_EDGE = 0x02
+  READ_EVENTS = 16
+
+  def __init__(self, fd):
+    self.fd = fd
+    self.loop = None
+    self.callback = None
+    self.buffer = b''
+
+  @staticmethod
+  def pack_event(timestamp_ns, edge):
+    return struct.pack(LineEvents.EVENT_FORMAT, timestamp_ns, edge)
+
+  @staticmethod
+  def to_monotonic_ns(timestamp_ns, monotonic_ns, realtime_ns):
+    """
+    Convert an event timestamp to the monotonic clock, given both clocks
+    read when the event was received. The timestamp is in the domain of the
+    clock it is closest to, as both clocks are far apart (boot and epoch).
+    """
+    if abs(timestamp_ns - realtime_ns) < abs(timestamp_ns - monotonic_ns):
+      return timestamp_ns - realtime_ns + monotonic_ns
+    return timestamp_ns
+
+  def watch(self, loop, callback):
+    """
+    Call callback(timestamp_ns, edge) on loop for each event, with the
+    timestamp on the time.monotonic_ns() clock.
+    """
+    self.unwatch()
+    self.loop = loop
+    self.callback = callback
+    os.set_blocking(self.fd, False)
+    loop.add_reader(self.fd, self._on_readable)
+
+  def unwatch(self):
+    if self.loop != None:
+      self.loop.remove_reader(self.fd)
+      self.loop = None
+
+  def _on_readable(self):
+    """
+    Read available events.
+    Thread: loop
+    """
+    try:
+      data = os.read(self.fd, LineEvents.EVENT_SIZE * LineEvents.READ_EVENTS)
+    except BlockingIOError:
+      return
+    if data == b'':
+      self.unwatch()
+      return
+    data = self.buffer + data
+    usable = len(data) - len(data) % LineEvents.EVENT_SIZE
+    self.buffer = data[usable:]
+    monotonic_ns = time.monotonic_ns()
+    realtime_ns = time.time_ns()
+    for (timestamp_ns, edge) in struct.iter_unpack(LineEvents.EVENT_FORMAT, data[:usable]):
+      self.callback(LineEvents.to_monotonic_ns(timestamp_ns, monotonic_ns, realtime_ns), edge)
+
+  def value(self):
+    data = bytearray(GPIOChip.GPIOHANDLES_MAX)
+    fcntl.ioctl(self.fd, LineHandle.GPIOHANDLE_GET_LINE_VALUES_IOCTL, data)
+    return data[0]
+
+  def close(self):
+    self.unwatch()
+    os.close(self.fd)
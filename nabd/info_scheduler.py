@@ -0,0 +1,164 @@
+import hashlib
+import json
+import math
+
+class InfoScheduler(object):
+  """
+  Rotation of info animations displayed in idle mode.
+  Infos are deduplicated by content hash, ordered by priority and shown for
+  their dwell time. Infos with the same tempo that use disjoint leds are
+  composited into a single slot, and a changed info is shown in the next
+  slot.
+  """
+  DEFAULT_PRIORITY = 0
+  DEFAULT_DWELL = 15.0          # seconds, see NabIO.INFO_LOOP_LENGTH
+  LEDS = ['left', 'center', 'right']
+  MAX_COMPOSITE_FRAMES = 64
+
+  def __init__(self):
+    self.infos = {}             # info_id -> entry
+    self.sequence = 0           # insertion counter, for a stable order
+    self.urgent = None          # id of the info to show next
+    self.last_slot = None       # ids of the infos of the last played slot
+
+  @staticmethod
+  def content_hash(animation):
+    return hashlib.sha1(json.dumps(animation, sort_keys=True).encode('utf8')).hexdigest()
+
+  @staticmethod
+  def used_leds(animation):
+    leds = set()
+    for color in animation['colors']:
+      for led in InfoScheduler.LEDS:
+        if color.get(led):
+          leds.add(led)
+    return leds
+
+  def __len__(self):
+    return len(self.infos)
+
+  def update(self, info_id, animation, priority=DEFAULT_PRIORITY, dwell=DEFAULT_DWELL):
+    """
+    Add or update an info.
+    Return False if the info was already displayed with the same animation,
+    priority and dwell time.
+    """
+    content_hash = InfoScheduler.content_hash(animation)
+    entry = self.infos.get(info_id)
+    if entry != None and entry['hash'] == content_hash and entry['priority'] == priority and entry['dwell'] == dwell:
+      return False
+    if entry == None:
+      self.sequence = self.sequence + 1
+      order = self.sequence
+    else:
+      order = entry['order']
+    self.infos[info_id] = {
+      'animation': animation,
+      'hash': content_hash,
+      'leds': InfoScheduler.used_leds(animation),
+      'priority': priority,
+      'dwell': dwell,
+      'order': order,
+    }
+    self.urgent = info_id
+    return True
+
+  def remove(self, info_id):
+    """
+    Remove an info.
+    Return False if there was no such info.
+    """
+    if info_id not in self.infos:
+      return False
+    del self.infos[info_id]
+    if self.urgent == info_id:
+      self.urgent = None
+    return True
+
+  def slots(self):
+    """
+    Group infos into slots, by decreasing priority.
+    Each slot is a list of info ids sharing a tempo and using disjoint leds.
+    """
+    ordered = sorted(self.infos.items(), key=lambda item: (-item[1]['priority'], item[1]['order']))
+    slots = []
+    for info_id, entry in ordered:
+      for slot in slots:
+        if self._can_composite(slot, entry):
+          slot['ids'].append(info_id)
+          slot['leds'] = slot['leds'] | entry['leds']
+          slot['frames'] = InfoScheduler._lcm(slot['frames'], len(entry['animation']['colors']))
+          break
+      else:
+        slots.append({
+          'ids': [info_id],
+          'tempo': entry['animation']['tempo'],
+          'leds': set(entry['leds']),
+          'frames': len(entry['animation']['colors']),
+        })
+    return [slot['ids'] for slot in slots]
+
+  def _can_composite(self, slot, entry):
+    animation = entry['animation']
+    if animation['tempo'] != slot['tempo'] or len(slot['leds'] & entry['leds']) > 0:
+      return False
+    return InfoScheduler._lcm(slot['frames'], len(animation['colors'])) <= InfoScheduler.MAX_COMPOSITE_FRAMES
+
+  @staticmethod
+  def _lcm(a, b):
+    if a == 0 or b == 0:
+      return max(a, b)
+    return a * b // math.gcd(a, b)
+
+  def next_slot(self):
+    """
+    Return the next slot to display as a (tempo, colors, dwell) tuple, or
+    None if there is no info.
+    The slot including the last changed info comes first, then slots
+    rotate.
+    """
+    slots = self.slots()
+    if len(slots) == 0:
+      self.last_slot = None
+      return None
+    slot = None
+    if self.urgent != None:
+      for ids in slots:
+        if self.urgent in ids:
+          slot = ids
+          break
+      self.urgent = None
+    if slot == None:
+      slot = slots[0]
+      if self.last_slot != None:
+        for index, ids in enumerate(slots):
+          if len(set(ids) & set(self.last_slot)) > 0:
+            slot = slots[(index + 1) % len(slots)]
+            break
+    self.last_slot = slot
+    return self.composite(slot)
+
+  def composite(self, ids):
+    """
+    Merge infos of a slot into a single animation.
+    """
+    entries = [self.infos[info_id] for info_id in ids]
+    tempo = entries[0]['animation']['tempo']
+    dwell = max([entry['dwell'] for entry in entries])
+    if len(entries) == 1 and len(entries[0]['animation']['colors']) > 0:
+      return (tempo, entries[0]['animation']['colors'], dwell)
+    frames = 1
+    for entry in entries:
+      frames = InfoScheduler._lcm(frames, len(entry['animation']['colors']))
+    colors = []
+    for index in range(frames):
+      color = {}
+      for entry in entries:
+        entry_colors = entry['animation']['colors']
+        if len(entry_colors) == 0:
+          continue
+        entry_color = entry_colors[index % len(entry_colors)]
+        for led in entry['leds']:
+          color[led] = entry_color.get(led)
+      colors.append(color)
+    return (tempo, colors, dwell)
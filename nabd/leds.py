@@ -1,6 +1,8 @@
 import abc
+import bisect
 import time
 from threading import Thread, Lock, Condition
+from .metrics import metrics
 
 class Leds(object, metaclass=abc.ABCMeta):
   """ Interface for leds """
@@ -33,102 +35,229 @@ class Leds(object, metaclass=abc.ABCMeta):
     """
     raise NotImplementedError( 'Should have implemented' )
 
+  def play_timeline(self, timeline):
+    """
+    Play a LedTimeline in loop, replacing any playing timeline.
+    """
+    raise NotImplementedError( 'Should have implemented' )
+
+  def stop_timeline(self):
+    """
+    Stop the playing timeline, if any. Leds keep their current color.
+    """
+    raise NotImplementedError( 'Should have implemented' )
+
+  def begin_frame(self):
+    """
+    Start a frame: changes until commit_frame are applied at once.
+    Frames can be nested.
+    """
+    pass
+
+  def commit_frame(self):
+    """
+    Apply changes of the current frame.
+    """
+    pass
+
   def stop(self):
     """
     Stop the leds thread, if any.
     """
     pass
 
+class LedTimeline(object):
+  """
+  Looping animation compiled to frames, played by the leds thread.
+  Frames are (duration in seconds, [(led, (r, g, b)), ...]) tuples.
+  Raise ValueError if the animation does not last.
+  """
+  def __init__(self, frames):
+    self.frames = [colors for (duration, colors) in frames]
+    self.ends = []
+    end = 0.0
+    for (duration, colors) in frames:
+      end = end + duration
+      self.ends.append(end)
+    if not end > 0:
+      raise ValueError('Timeline period must be positive')
+    self.period = end
+
+  def frame_at(self, elapsed):
+    """
+    Return the index of the frame at elapsed seconds since the start and the
+    delay until the next frame.
+    """
+    offset = elapsed % self.period
+    index = min(bisect.bisect_right(self.ends, offset), len(self.ends) - 1)
+    return (index, self.ends[index] - offset)
+
 class LedsSoft(Leds, metaclass=abc.ABCMeta):
   """
   Base implementation with software pulsing.
+  Pulse waveforms are precomputed as integer tables and the thread only
+  pushes leds that changed since the last frame.
+  Timelines are also played by the thread, so that animations do not
+  require any wake up of the caller.
   """
   PULSING_RATE   = 0.200    # every 200ms
   PULSING_STEPS  = 10       # number of steps to reach target color
+  GAMMA          = None     # gamma correction of pulses, e.g. 2.2
+
+  shows_total = metrics.counter('nabd_led_shows_total', 'LED frames shown')
 
   def __init__(self):
     self.condition = Condition()
     self.pending = []
-    self.pulsing = {}
+    self.pulsing = {}                   # led -> (waveform, runs, phase)
     self.pending_lock = Lock()
+    self.frame_depth = 0
+    self.frame_pending = []
+    self.framebuffer = [None] * Leds.LED_COUNT
+    self.timeline = None                # (timeline, start, frame index)
     self.last_pulse = None
     self.running = True
-    self.thread = Thread(target = self.run, daemon = True)
+    self.thread = Thread(target = self.run, name = 'leds', daemon = True)
     self.thread.start()
 
+  def pulse_levels(self):
+    """
+    Return the levels of a pulse period, from 0 to PULSING_STEPS and back.
+    """
+    steps = self.PULSING_STEPS
+    return [min(k, 2 * steps - k) for k in range(2 * steps)]
+
+  def pulse_waveform(self, red, green, blue):
+    """
+    Compute the colors of a pulse period to a given color.
+    """
+    steps = self.PULSING_STEPS
+    if self.GAMMA == None:
+      correct = lambda v: v
+    else:
+      gamma = self.GAMMA
+      correct = lambda v: int(round(255 * ((v / 255) ** gamma)))
+    return [(correct(red * level // steps), correct(green * level // steps), correct(blue * level // steps)) for level in self.pulse_levels()]
+
+  @staticmethod
+  def waveform_runs(waveform):
+    """
+    Compute, for each phase of a waveform, the number of steps until the
+    color changes, so that the thread does not wake up for nothing.
+    """
+    count = len(waveform)
+    runs = []
+    for phase in range(count):
+      run = 1
+      while run < count and waveform[(phase + run) % count] == waveform[phase]:
+        run = run + 1
+      runs.append(run)
+    return runs
+
   def run(self):
+    frame = [None] * Leds.LED_COUNT
     with self.condition:
       while self.running:
-        show = False
         with self.pending_lock:
-          for cmd, led, (r, g, b) in self.pending:
-            if cmd == 'pulse':
-              self.do_set(led, 0, 0, 0)
-              show = True
-              if self.last_pulse == None:
-                self.last_pulse = time.time()
-              color_incr = (r / LedsSoft.PULSING_STEPS, g / LedsSoft.PULSING_STEPS, b / LedsSoft.PULSING_STEPS)
-              self.pulsing[led] = ((r, g, b), (0, 0, 0), 1, color_incr)
-            elif cmd == 'set':
-              if led in self.pulsing:
-                del self.pulsing[led]
-              self.do_set(led, r, g, b)
-              show = True
+          pending = self.pending
           self.pending = []
+        for cmd, led, color in pending:
+          if cmd == 'pulse':
+            if self.last_pulse == None:
+              self.last_pulse = time.time()
+            waveform = self.pulse_waveform(*color)
+            self.pulsing[led] = (waveform, LedsSoft.waveform_runs(waveform), 0)
+            frame[led] = waveform[0]
+          elif cmd == 'set':
+            if led in self.pulsing:
+              del self.pulsing[led]
+            frame[led] = color
+          elif cmd == 'timeline':
+            if color == None:
+              self.timeline = None
+            else:
+              self.timeline = (color, time.time(), None)
         next_pulse = None
         if len(self.pulsing) > 0:
-          now = time.time()
-          next_pulse = self.last_pulse + LedsSoft.PULSING_RATE
-          if now >= next_pulse:
-            self.last_pulse = next_pulse
-            next_pulse = next_pulse + LedsSoft.PULSING_RATE
-            new_pulsing = {}
-            for led, pulse in self.pulsing.items():
-              (target, (current_r, current_g, current_b), direction, incr) = pulse
-              (target_r, target_g, target_b) = target
-              (incr_r, incr_g, incr_b) = incr
-              if direction == 1 and target_r == int(current_r) and target_g == int(current_g) and target_b == int(current_b):
-                direction = -1
-              elif direction == -1 and int(current_r) == 0 and int(current_g) == 0 and int(current_b) == 0:
-                direction = 1
-              if direction == 1:
-                new_r = min(current_r + incr_r, target_r)
-                new_g = min(current_g + incr_g, target_g)
-                new_b = min(current_b + incr_b, target_b)
-              else:
-                new_r = max(current_r - incr_r, 0)
-                new_g = max(current_g - incr_g, 0)
-                new_b = max(current_b - incr_b, 0)
-              self.do_set(led, int(new_r), int(new_g), int(new_b))
-              show = True
-              new_pulsing[led] = (target, (new_r, new_g, new_b), direction, incr)
-            self.pulsing = new_pulsing
+          ticks = int((time.time() - self.last_pulse) / self.PULSING_RATE)
+          if ticks > 0:
+            self.last_pulse = self.last_pulse + ticks * self.PULSING_RATE
+          next_steps = None
+          for led, (waveform, runs, phase) in self.pulsing.items():
+            if ticks > 0:
+              phase = (phase + ticks) % len(waveform)
+              self.pulsing[led] = (waveform, runs, phase)
+              frame[led] = waveform[phase]
+            if next_steps == None or runs[phase] < next_steps:
+              next_steps = runs[phase]
+          next_pulse = self.last_pulse + next_steps * self.PULSING_RATE
         else:
           self.last_pulse = None
-        if show:
+        next_step = None
+        if self.timeline != None:
+          (timeline, start, current) = self.timeline
+          now = time.time()
+          (index, delay) = timeline.frame_at(now - start)
+          if index != current:
+            for led, led_color in timeline.frames[index]:
+              if led in self.pulsing:
+                del self.pulsing[led]
+              frame[led] = led_color
+            self.timeline = (timeline, start, index)
+          next_step = now + delay
+        dirty = False
+        for led in range(Leds.LED_COUNT):
+          color = frame[led]
+          if color != None and color != self.framebuffer[led]:
+            (r, g, b) = color
+            self.do_set(led, r, g, b)
+            self.framebuffer[led] = color
+            dirty = True
+        if dirty:
+          LedsSoft.shows_total.inc()
           self.do_show()
         timeout = None
-        if next_pulse != None:
-          delta = next_pulse - time.time()
+        if next_pulse != None or next_step != None:
+          wakeup = min([t for t in (next_pulse, next_step) if t != None])
+          delta = wakeup - time.time()
           timeout = max(0, delta)
         self.condition.wait(timeout=timeout)
 
   def set1(self, led, red, green, blue):
-    with self.pending_lock:
-      self.pending.append(('set', led, (red, green, blue)))
-    with self.condition:
-      self.condition.notify()
+    self._push([('set', led, (red, green, blue))])
 
   def pulse(self, led, red, green, blue):
-    with self.pending_lock:
-      self.pending.append(('pulse', led, (red, green, blue)))
-    with self.condition:
-      self.condition.notify()
+    self._push([('pulse', led, (red, green, blue))])
 
   def setall(self, red, green, blue):
+    self._push([('set', led, (red, green, blue)) for led in range(Leds.LED_COUNT)])
+
+  def play_timeline(self, timeline):
+    self._push([('timeline', None, timeline)])
+
+  def stop_timeline(self):
+    self._push([('timeline', None, None)])
+
+  def begin_frame(self):
+    self.frame_depth = self.frame_depth + 1
+
+  def commit_frame(self):
+    self.frame_depth = self.frame_depth - 1
+    if self.frame_depth == 0 and len(self.frame_pending) > 0:
+      commands = self.frame_pending
+      self.frame_pending = []
+      self._push(commands)
+
+  def _push(self, commands):
+    """
+    Send commands to the leds thread, or keep them until the current frame
+    is committed.
+    """
+    if self.frame_depth > 0:
+      self.frame_pending.extend(commands)
+      return
     with self.pending_lock:
-      for led in range(Leds.LED_COUNT):
-        self.pending.append(('set', led, (red, green, blue)))
+      self.pending.extend(commands)
     with self.condition:
       self.condition.notify()
 
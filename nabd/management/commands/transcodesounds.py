@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from nabd.pcm_cache import PCMCache
+
+class Command(BaseCommand):
+  help = 'Transcode the sound library into raw PCM in the sound card native format'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--rate', type=int, help='Sample rate (default: native rate of detected card)')
+    parser.add_argument('--channels', type=int, help='Number of channels (default: native channels of detected card)')
+    parser.add_argument('--output', default=None, help='Output container (default: nabd/{filename})'.format(filename=PCMCache.DEFAULT_FILENAME))
+
+  def handle(self, *args, **options):
+    rate = options['rate']
+    channels = options['channels']
+    if rate == None or channels == None:
+      (native_rate, native_channels) = self.native_format()
+      if rate == None:
+        rate = native_rate
+      if channels == None:
+        channels = native_channels
+    if channels not in [1, 2]:
+      raise CommandError('Unsupported number of channels {channels}'.format(channels=channels))
+    output = options['output']
+    if output == None:
+      output = PCMCache.default_path()
+    filenames = list(PCMCache.sound_files(settings.BASE_DIR, settings.INSTALLED_APPS))
+    self.stdout.write('Transcoding {count} files to {rate} Hz, {channels} channel(s)'.format(count=len(filenames), rate=rate, channels=channels))
+    count = PCMCache.build(output, settings.BASE_DIR, filenames, rate, channels)
+    self.stdout.write(self.style.SUCCESS('Wrote {count} sounds to {output}'.format(count=count, output=output)))
+
+  def native_format(self):
+    try:
+      from nabd.sound_alsa import SoundAlsa
+      return SoundAlsa.NATIVE_FORMATS[SoundAlsa.sound_card()]
+    except (ImportError, RuntimeError) as err:
+      raise CommandError('Could not detect sound card ({err}), please specify --rate and --channels'.format(err=err))
@@ -0,0 +1,232 @@
+import asyncio, bisect, threading
+
+class Metric(object):
+  """
+  Named metric with optional labels, holding one value per combination of
+  label values. Values can also be computed when collected, by a function
+  returning a dict of label values tuple -> value.
+  Thread: any
+  """
+  TYPE = None
+
+  def __init__(self, name, help, labels=(), function=None):
+    self.name = name
+    self.help = help
+    self.labels = tuple(labels)
+    self.function = function
+    self.lock = threading.Lock()
+    self.values = {}                    # label values tuple -> value
+
+  def _key(self, labels):
+    return tuple([str(labels[label]) for label in self.labels])
+
+  def collect(self):
+    """
+    Return a dict of label values tuple -> value.
+    """
+    if self.function != None:
+      return self.function()
+    with self.lock:
+      return {key: self._copy(value) for (key, value) in self.values.items()}
+
+  def _copy(self, value):
+    return value
+
+  def reset(self):
+    with self.lock:
+      self.values = {}
+
+  def snapshot(self):
+    """
+    Return a JSON-serializable representation of the metric.
+    """
+    values = []
+    for (key, value) in sorted(self.collect().items()):
+      entry = {'labels': dict(zip(self.labels, key))}
+      entry.update(self._snapshot_value(value))
+      values.append(entry)
+    return {'type': self.TYPE, 'help': self.help, 'values': values}
+
+  def _snapshot_value(self, value):
+    return {'value': value}
+
+  def samples(self):
+    """
+    Return (name, labels, value) samples in Prometheus exposition format.
+    """
+    return [(self.name, dict(zip(self.labels, key)), value) for (key, value) in sorted(self.collect().items())]
+
+class Counter(Metric):
+  TYPE = 'counter'
+
+  def inc(self, amount=1, **labels):
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+  TYPE = 'gauge'
+
+  def set(self, value, **labels):
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = value
+
+class Histogram(Metric):
+  """
+  Histogram with fixed buckets. Values are (counts, sum, count), counts
+  being the number of observations in each bucket, the last bucket being
+  unbounded.
+  """
+  TYPE = 'histogram'
+  # Upper bounds of buckets, in seconds.
+  BOUNDS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+  def __init__(self, name, help, labels=(), function=None, bounds=BOUNDS):
+    super().__init__(name, help, labels, function)
+    self.bounds = list(bounds)
+
+  def observe(self, value, **labels):
+    key = self._key(labels)
+    with self.lock:
+      if key not in self.values:
+        self.values[key] = ([0] * (len(self.bounds) + 1), 0.0, 0)
+      (counts, total, count) = self.values[key]
+      counts[bisect.bisect_left(self.bounds, value)] += 1
+      self.values[key] = (counts, total + value, count + 1)
+
+  def _copy(self, value):
+    (counts, total, count) = value
+    return (list(counts), total, count)
+
+  def quantile(self, counts, count, q):
+    """
+    Estimate a quantile as the upper bound of the bucket reaching it.
+    Return None if there is no observation, or the quantile is in the
+    unbounded bucket.
+    """
+    if count == 0:
+      return None
+    rank = q * count
+    cumulative = 0
+    for (bound, bucket_count) in zip(self.bounds, counts):
+      cumulative = cumulative + bucket_count
+      if cumulative >= rank:
+        return bound
+    return None
+
+  def _snapshot_value(self, value):
+    (counts, total, count) = value
+    buckets = {}
+    for (bound, bucket_count) in zip(self.bounds, counts):
+      buckets[repr(bound)] = bucket_count
+    buckets['+Inf'] = counts[-1]
+    return {
+      'count': count,
+      'sum': total,
+      'mean': total / count if count > 0 else None,
+      'p50': self.quantile(counts, count, 0.50),
+      'p95': self.quantile(counts, count, 0.95),
+      'p99': self.quantile(counts, count, 0.99),
+      'buckets': buckets,
+    }
+
+  def samples(self):
+    samples = []
+    for (key, (counts, total, count)) in sorted(self.collect().items()):
+      labels = dict(zip(self.labels, key))
+      cumulative = 0
+      for (bound, bucket_count) in zip(self.bounds + [None], counts):
+        cumulative = cumulative + bucket_count
+        bucket_labels = dict(labels)
+        bucket_labels['le'] = '+Inf' if bound == None else repr(bound)
+        samples.append((self.name + '_bucket', bucket_labels, cumulative))
+      samples.append((self.name + '_sum', labels, total))
+      samples.append((self.name + '_count', labels, count))
+    return samples
+
+class MetricsRegistry(object):
+  """
+  Inventory of the metrics of nabd.
+  Metrics are created by the modules updating them. Creating a metric that
+  already exists returns it, replacing its function if one is given.
+  """
+  def __init__(self):
+    self.metrics = {}
+    self.lock = threading.Lock()
+
+  def _metric(self, cls, name, help, labels, function, **kwargs):
+    with self.lock:
+      metric = self.metrics.get(name)
+      if metric == None:
+        metric = cls(name, help, labels, function, **kwargs)
+        self.metrics[name] = metric
+      elif function != None:
+        metric.function = function
+      return metric
+
+  def counter(self, name, help, labels=(), function=None):
+    return self._metric(Counter, name, help, labels, function)
+
+  def gauge(self, name, help, labels=(), function=None):
+    return self._metric(Gauge, name, help, labels, function)
+
+  def histogram(self, name, help, labels=(), function=None, bounds=Histogram.BOUNDS):
+    return self._metric(Histogram, name, help, labels, function, bounds=bounds)
+
+  def reset(self):
+    for metric in list(self.metrics.values()):
+      metric.reset()
+
+  def snapshot(self):
+    return {name: metric.snapshot() for (name, metric) in sorted(self.metrics.items())}
+
+  def prometheus(self):
+    """
+    Return metrics in Prometheus text exposition format.
+    """
+    lines = []
+    for (name, metric) in sorted(self.metrics.items()):
+      lines.append('# HELP {name} {help}'.format(name=name, help=metric.help))
+      lines.append('# TYPE {name} {type}'.format(name=name, type=metric.TYPE))
+      for (sample_name, labels, value) in metric.samples():
+        if len(labels) > 0:
+          label_str = ','.join(['{k}="{v}"'.format(k=k, v=MetricsRegistry._escape(v)) for (k, v) in labels.items()])
+          lines.append('{name}{{{labels}}} {value}'.format(name=sample_name, labels=label_str, value=MetricsRegistry._format(value)))
+        else:
+          lines.append('{name} {value}'.format(name=sample_name, value=MetricsRegistry._format(value)))
+    return '\n'.join(lines) + '\n'
+
+  @staticmethod
+  def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+  @staticmethod
+  def _format(value):
+    if value == None:
+      return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+  async def serve_prometheus(self, port, host='localhost'):
+    """
+    Serve metrics in Prometheus text format over HTTP, on any path.
+    Return the server.
+    """
+    async def handle(reader, writer):
+      try:
+        while True:
+          line = await reader.readline()
+          if line == b'' or line == b'\r\n' or line == b'\n':
+            break
+        body = self.prometheus().encode('utf8')
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n')
+        writer.write('Content-Length: {length}\r\n\r\n'.format(length=len(body)).encode('ascii'))
+        writer.write(body)
+        await writer.drain()
+      except (ConnectionResetError, BrokenPipeError):
+        pass
+      finally:
+        writer.close()
+    return await asyncio.start_server(handle, host, port)
+
+metrics = MetricsRegistry()
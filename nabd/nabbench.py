@@ -0,0 +1,247 @@
+"""
+nabd protocol load generator.
+
+Usage: python -m nabd.nabbench [--clients N] [--packets N] [--mix SPEC]
+         [--transport tcp|unix] [--port N] [--nabio sim|mock]
+         [--virtual-time] [--output FILE]
+
+Runs nabd with a simulated rabbit and N service clients on the same loop.
+Each client sends packets drawn from the mix, e.g. info:4,command:2, and
+waits for each response. Throughput and p50/p95/p99 latencies of responses
+(per packet type) and of the start of playback (commands and messages,
+measured when nabd starts performing them) are reported as JSON.
+
+With --virtual-time, playback takes no time and latencies only reflect
+protocol processing and queueing.
+"""
+import argparse, asyncio, json, os, random, shutil, socket, sys, tempfile, time
+from nabcommon.clock import VirtualTimeEventLoop
+from .nabd import Nabd
+
+SOUND = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sounds', 'asr', 'listen.mp3')
+PACKET_TYPES = ['info', 'command', 'message', 'ears', 'mode']
+DEFAULT_MIX = 'info:4,command:2,message:1,ears:2,mode:1'
+CONNECT_RETRIES = 50
+CONNECT_DELAY = 0.05
+
+def parse_mix(spec):
+  """
+  Parse a mix specification, type:weight pairs separated by commas.
+  Return a list of (type, weight).
+  """
+  mix = []
+  for item in spec.split(','):
+    (packet_type, _, weight) = item.partition(':')
+    if packet_type not in PACKET_TYPES:
+      raise ValueError('Unknown packet type {t}'.format(t=packet_type))
+    mix.append((packet_type, int(weight) if weight != '' else 1))
+  return mix
+
+def percentiles(samples):
+  """
+  Return count, p50, p95, p99 and max of samples (in seconds) in ms,
+  using the nearest-rank method, or None if there is no sample.
+  """
+  if len(samples) == 0:
+    return None
+  ordered = sorted(samples)
+  def rank(p):
+    index = max(0, int(-(-p * len(ordered) // 100)) - 1)
+    return ordered[index] * 1000.0
+  return {
+    'count': len(ordered),
+    'p50': rank(50),
+    'p95': rank(95),
+    'p99': rank(99),
+    'max': ordered[-1] * 1000.0,
+  }
+
+async def connect(path=None, port=None):
+  """
+  Connect to nabd on a Unix socket or a TCP port of localhost, retrying
+  while it starts.
+  """
+  for retry in range(CONNECT_RETRIES):
+    try:
+      if path != None:
+        return await asyncio.open_unix_connection(path)
+      return await asyncio.open_connection('localhost', port)
+    except (ConnectionRefusedError, FileNotFoundError):
+      await asyncio.sleep(CONNECT_DELAY)
+  raise ConnectionRefusedError('Could not connect to nabd')
+
+def make_packet(packet_type, request_id, rnd, client):
+  """
+  Build a packet of the given type. Playable items use an absolute sound
+  path and no choreography, so that they do not depend on the database.
+  """
+  if packet_type == 'info':
+    color = '{c:06x}'.format(c=rnd.randint(0, 0xFFFFFF))
+    return {'type':'info', 'request_id':request_id, 'info_id':'nabbench{c}'.format(c=client), 'animation':{'tempo':25, 'colors':[{'left':color}, {'right':color}]}}
+  if packet_type == 'command':
+    return {'type':'command', 'request_id':request_id, 'sequence':[{'audio':[SOUND]}]}
+  if packet_type == 'message':
+    return {'type':'message', 'request_id':request_id, 'signature':{'audio':[SOUND], 'choreography':None}, 'body':[{'audio':[SOUND], 'choreography':None}]}
+  if packet_type == 'ears':
+    return {'type':'ears', 'request_id':request_id, 'left':rnd.randint(0, 16), 'right':rnd.randint(0, 16)}
+  return {'type':'mode', 'request_id':request_id, 'mode':'idle', 'events':['ears', 'button']}
+
+class NabBench(object):
+  def __init__(self, clients, packets, mix, path=None, port=None, seed=0):
+    self.clients = clients
+    self.packets = packets
+    self.mix = mix
+    self.path = path
+    self.port = port
+    self.seed = seed
+    self.sent = {}                      # request_id -> (type, send time)
+    self.started = {}                   # request_id -> start of playback time
+    self.latencies = {packet_type: [] for packet_type in PACKET_TYPES}
+    self.errors = 0
+
+  def instrument(self, nabd):
+    """
+    Record when nabd starts performing commands and messages.
+    """
+    for name in ['perform_command', 'perform_message']:
+      perform = getattr(nabd, name)
+      async def timed_perform(packet, perform=perform):
+        if 'request_id' in packet:
+          self.started[packet['request_id']] = time.monotonic()
+        await perform(packet)
+      setattr(nabd, name, timed_perform)
+
+  async def client(self, index):
+    rnd = random.Random(self.seed * 1000 + index)
+    (reader, writer) = await connect(self.path, self.port)
+    try:
+      types = [packet_type for (packet_type, weight) in self.mix]
+      weights = [weight for (packet_type, weight) in self.mix]
+      for count in range(self.packets):
+        packet_type = rnd.choices(types, weights)[0]
+        request_id = '{c}-{n}'.format(c=index, n=count)
+        packet = make_packet(packet_type, request_id, rnd, index)
+        start = time.monotonic()
+        self.sent[request_id] = (packet_type, start)
+        writer.write((json.dumps(packet) + '\r\n').encode('utf8'))
+        while True:
+          line = await reader.readline()
+          if line == b'':
+            raise ConnectionResetError('nabd closed the connection')
+          response = json.loads(line.decode('utf8'))
+          if response['type'] == 'response' and response.get('request_id') == request_id:
+            break
+        self.latencies[packet_type].append(time.monotonic() - start)
+        if response['status'] != 'ok':
+          self.errors = self.errors + 1
+    finally:
+      writer.close()
+
+  async def run_clients(self):
+    start = time.monotonic()
+    await asyncio.gather(*[self.client(index) for index in range(self.clients)])
+    return time.monotonic() - start
+
+  def run(self, nabio, virtual_time=False):
+    """
+    Run nabd and the clients, and return the results.
+    """
+    duration = run_nabd(nabio, lambda nabd: self.run_clients(), self.path, self.port, virtual_time, self.instrument)
+    return self.results(duration)
+
+  def results(self, duration):
+    total = sum([len(samples) for samples in self.latencies.values()])
+    start_latencies = {'command': [], 'message': []}
+    for (request_id, started) in self.started.items():
+      (packet_type, sent) = self.sent[request_id]
+      start_latencies[packet_type].append(started - sent)
+    all_latencies = []
+    for samples in self.latencies.values():
+      all_latencies.extend(samples)
+    return {
+      'clients': self.clients,
+      'packets': total,
+      'errors': self.errors,
+      'duration': duration,
+      'throughput': total / duration if duration > 0 else None,
+      'response_latency_ms': dict([('all', percentiles(all_latencies))] + [(packet_type, percentiles(samples)) for (packet_type, samples) in self.latencies.items()]),
+      'start_latency_ms': {packet_type: percentiles(samples) for (packet_type, samples) in start_latencies.items()},
+    }
+
+def run_nabd(nabio, clients, path=None, port=None, virtual_time=False, setup=None):
+  """
+  Run nabd with nabio on a new loop, on a Unix socket or a TCP port, until
+  the coroutine returned by clients(nabd) completes, and return its result.
+  setup(nabd) is called before nabd runs.
+  """
+  if virtual_time:
+    loop = VirtualTimeEventLoop()
+  else:
+    loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  nabd = Nabd(nabio)
+  if setup != None:
+    setup(nabd)
+  async def run_clients():
+    try:
+      return await clients(nabd)
+    finally:
+      nabd.stop()
+  clients_task = loop.create_task(run_clients())
+  try:
+    if path != None:
+      nabd.run(path=path)
+    else:
+      nabd.run(port=port)
+  finally:
+    asyncio.set_event_loop(None)
+  return clients_task.result()
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(('localhost', 0))
+    return s.getsockname()[1]
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='nabd protocol load generator')
+  parser.add_argument('--clients', type=int, default=4, help='number of service clients')
+  parser.add_argument('--packets', type=int, default=100, help='number of packets sent by each client')
+  parser.add_argument('--mix', default=DEFAULT_MIX, help='packet mix, as type:weight pairs (default = {mix})'.format(mix=DEFAULT_MIX))
+  parser.add_argument('--transport', choices=['tcp', 'unix'], default='tcp', help='service transport')
+  parser.add_argument('--port', type=int, default=0, help='TCP port (default = any free port)')
+  parser.add_argument('--nabio', choices=['sim', 'mock'], default='sim', help='simulated rabbit or test mock')
+  parser.add_argument('--virtual-time', action='store_true', help='run nabd on virtual time')
+  parser.add_argument('--seed', type=int, default=0, help='random seed of packet generation')
+  parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+  args = parser.parse_args(argv)
+  mix = parse_mix(args.mix)
+  if args.nabio == 'mock':
+    from .tests.mock import NabIOMock
+    nabio = NabIOMock()
+  else:
+    from .nabio_sim import NabIOSim
+    nabio = NabIOSim()
+  tmpdir = None
+  path = None
+  port = None
+  if args.transport == 'unix':
+    tmpdir = tempfile.mkdtemp(prefix='nabbench')
+    path = os.path.join(tmpdir, 'nabd.sock')
+  else:
+    port = args.port if args.port != 0 else free_port()
+  try:
+    bench = NabBench(args.clients, args.packets, mix, path, port, args.seed)
+    results = bench.run(nabio, args.virtual_time)
+  finally:
+    if tmpdir != None:
+      shutil.rmtree(tmpdir, ignore_errors=True)
+  results['config'] = {'mix': args.mix, 'transport': args.transport, 'nabio': args.nabio, 'virtual_time': args.virtual_time}
+  output = json.dumps(results, indent=2, sort_keys=True)
+  if args.output != None:
+    with open(args.output, 'w') as f:
+      f.write(output + '\n')
+  else:
+    print(output)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -1,13 +1,20 @@
-import asyncio, json, datetime, collections, sys, getopt, os, socket
+import asyncio, json, datetime, collections, contextvars, sys, getopt, os, socket
 from lockfile.pidlockfile import PIDLockFile
 from lockfile import AlreadyLocked, LockFailed
 from pydoc import locate
 from .leds import Leds
+from .ears import Ears
+from .duration import DurationEstimator
+from .info_scheduler import InfoScheduler
+from .executors import registry, ExecutorRegistry
+from .tracing import tracer
+from .metrics import metrics
 from django.conf import settings
 from django.apps import apps
+from django.utils.dateparse import parse_datetime
 from nabcommon.nabservice import NabService
+from nabcommon.clock import Clock
 
-import time
 import traceback
 
 class Nabd:
@@ -17,6 +24,20 @@ class Nabd:
 
   SYSTEMD_ACTIVATED_FD = 3
 
+  PACKET_TYPES = ['info', 'ears', 'command', 'message', 'cancel', 'wakeup', 'sleep', 'mode', 'diagnostics', 'stats']
+
+  # Time (monotonic) at which the packet being processed was received
+  received_at = contextvars.ContextVar('received_at', default=None)
+
+  packets_total = metrics.counter('nabd_packets_total', 'Packets received from services', ['type'])
+  response_latency = metrics.histogram('nabd_response_latency_seconds', 'Delay between packets and their response', ['type'])
+  queue_age = metrics.histogram('nabd_queue_age_seconds', 'Time spent by items in the idle queue')
+  expired_total = metrics.counter('nabd_expired_total', 'Items expired before they could be played', ['stage'])
+  broadcasts_total = metrics.counter('nabd_broadcasts_total', 'Events broadcast to services', ['event'])
+  broadcast_packets_total = metrics.counter('nabd_broadcast_packets_total', 'Event packets written to services', ['event'])
+  asr_duration = metrics.histogram('nabd_asr_duration_seconds', 'Duration of speech recognition after recording')
+  nlu_duration = metrics.histogram('nabd_nlu_duration_seconds', 'Duration of intent recognition')
+
   def __init__(self, nabio):
     if not settings.configured:
       conf = {
@@ -42,7 +63,7 @@ class Nabd:
     self.idle_queue = collections.deque()
     # Current position of ears in idle mode
     self.ears = {'left': Nabd.INIT_EAR_POSITION, 'right': Nabd.INIT_EAR_POSITION}
-    self.info = {}                      # Info persists across service connections.
+    self.info = InfoScheduler()         # Info persists across service connections.
     self.state = 'idle'                 # 'asleep'/'idle'/'interactive'/'playing'/'recording'
     self.service_writers = {}           # Dictionary of writers, i.e. connected services
                                         # For each writer, value is the list of registered events
@@ -50,7 +71,16 @@ class Nabd:
     self.interactive_service_events = [] # Events registered in interactive mode
     self.running = True
     self.loop = None
+    self.clock = Clock.REAL             # Replaced by the clock of the loop in run
     self._ears_moved_task = None
+    self._ears_move_task = None
+    self.duration_estimator = DurationEstimator(nabio.sound.pcm_cache)
+    self.playing_end = None             # Expected end (monotonic) of the playing item, if known
+    self.recorder = None                # SessionRecorder, if traffic is recorded
+    metrics.gauge('nabd_queue_depth', 'Items in the idle queue', function=lambda: {(): len(self.idle_queue)})
+    metrics.gauge('nabd_queue_oldest_age_seconds', 'Age of the oldest item in the idle queue', function=self._queue_oldest_age)
+    metrics.gauge('nabd_services', 'Connected services', function=lambda: {(): len(self.service_writers)})
+    metrics.gauge('nabd_state', 'Current state', ['state'], function=lambda: {(self.state,): 1})
     Nabd.leds_boot(self.nabio, 2)
     if self.nabio.has_sound_input():
       from .asr import ASR
@@ -68,6 +98,7 @@ class Nabd:
   async def sleep_setup(self):
     self.nabio.set_leds(None, None, None, None, None)
     await self.nabio.move_ears(Nabd.SLEEP_EAR_POSITION, Nabd.SLEEP_EAR_POSITION)
+    self.nabio.save_ears_positions()
 
   async def idle_worker_loop(self):
     """
@@ -82,9 +113,9 @@ class Nabd:
             item = self.idle_queue.popleft()
             await self.process_idle_item(item)
           else:
-            if self.state == 'idle' and len(self.info.items()) > 0:
-              for key, value in self.info.items():
-                await self.nabio.play_info(self.idle_cv, value['tempo'], value['colors'])
+            if self.state == 'idle' and len(self.info) > 0:
+              (tempo, colors, dwell) = self.info.next_slot()
+              await self.nabio.play_info(self.idle_cv, tempo, colors, dwell)
             else:
               await self.idle_cv.wait()
     except KeyboardInterrupt:
@@ -113,9 +144,27 @@ class Nabd:
     """
     Process an item from the idle queue.
     The lock is acquired when this function is called.
+    Items are (packet, writer, span of the wait in the queue), and are
+    processed in their trace.
     """
+    token = tracer.activate(None)
+    received_token = Nabd.received_at.set(None)
+    try:
+      await self._process_idle_items(item)
+    finally:
+      tracer.deactivate(token)
+      Nabd.received_at.reset(received_token)
+
+  async def _process_idle_items(self, item):
     while True:
-      if 'expiration_date' in item[0] and item[0]['expiration_date'] < datetime.now():
+      wait_span = item[2]
+      if not wait_span.ended:
+        wait_span.end()
+        Nabd.queue_age.observe(self.clock.monotonic() - wait_span.start)
+      tracer.activate(wait_span.trace_id)
+      Nabd.received_at.set(wait_span.start)
+      if Nabd.is_expired(item[0], 0, self.clock):
+        Nabd.expired_total.inc(stage='queue')
         self.write_response_packet(item[0], {'status':'expired'}, item[1])
         if len(self.idle_queue) == 0:
           await self.set_state('idle')
@@ -123,18 +172,19 @@ class Nabd:
         else:
           item = self.idle_queue.popleft()
       else:
-        if item[0]['type'] == 'command':
+        if item[0]['type'] == 'command' or item[0]['type'] == 'message':
           await self.set_state('playing')
-          await self.perform_command(item[0])
-          self.write_response_packet(item[0], {'status':'ok'}, item[1])
-          if len(self.idle_queue) == 0:
-            await self.set_state('idle')
-            break
+          duration = self.estimate_duration(item[0])
+          if duration != None:
+            self.playing_end = self.clock.monotonic() + duration
           else:
-            item = self.idle_queue.popleft()
-        elif item[0]['type'] == 'message':
-          await self.set_state('playing')
-          await self.perform_message(item[0])
+            self.playing_end = None
+          with tracer.span('play', type=item[0]['type'], duration=duration):
+            if item[0]['type'] == 'command':
+              await self.perform_command(item[0])
+            else:
+              await self.perform_message(item[0])
+          self.playing_end = None
           self.write_response_packet(item[0], {'status':'ok'}, item[1])
           if len(self.idle_queue) == 0:
             await self.set_state('idle')
@@ -166,6 +216,103 @@ class Nabd:
         else:
           raise RuntimeError('Unexpected packet {packet}'.format(packet=item[0]))
 
+  async def enqueue_playable_item(self, packet, writer):
+    """
+    Enqueue a command or a message.
+    Reject it immediately if it cannot be played before its expiration.
+    The estimation does not require the lock, which is held by the idle
+    worker while an item is playing.
+    """
+    eta = None
+    if 'expiration' in packet:
+      eta = self.queue_eta()
+    if eta != None and Nabd.is_expired(packet, eta, self.clock):
+      expected_start = self.clock.now() + datetime.timedelta(seconds=eta)
+      Nabd.expired_total.inc(stage='enqueue')
+      self.write_response_packet(packet, {'status':'expired','expected_start':expected_start.isoformat()}, writer)
+    else:
+      with tracer.span('enqueue', eta=eta):
+        async with self.idle_cv:
+          self.idle_queue.append((packet, writer, tracer.span('queue_wait')))
+          self.idle_cv.notify()
+
+  def estimate_duration(self, packet):
+    """
+    Estimate the duration of a command or a message, in seconds.
+    Return None if it is unknown.
+    """
+    try:
+      if packet['type'] == 'command':
+        return self.duration_estimator.sequence_duration(packet['sequence'])
+      if packet['type'] == 'message':
+        signature = {}
+        if 'signature' in packet:
+          signature = packet['signature']
+        return self.duration_estimator.message_duration(signature, packet['body'])
+    except (TypeError, KeyError, AttributeError):
+      # Malformed sequence, will be reported when played.
+      pass
+    return None
+
+  def queue_eta(self):
+    """
+    Estimate the delay, in seconds, before an item enqueued now would start.
+    Return None if it is unknown, e.g. if the rabbit is asleep, interactive
+    or if the duration of any enqueued item is unknown.
+    """
+    if self.state == 'idle':
+      eta = 0.0
+    elif self.state == 'playing':
+      if self.playing_end == None:
+        return None
+      eta = max(0.0, self.playing_end - self.clock.monotonic())
+    else:
+      return None
+    for (packet, writer, wait_span) in self.idle_queue:
+      if packet['type'] == 'sleep':
+        continue
+      duration = self.estimate_duration(packet)
+      if duration == None:
+        return None
+      eta = eta + duration
+    return eta
+
+  @staticmethod
+  def check_expiration(packet):
+    """
+    Validate the expiration slot of a packet when it is received, removing it
+    if it is null (no expiration).
+    Return an error message or None.
+    """
+    if 'expiration' in packet:
+      if packet['expiration'] == None:
+        del packet['expiration']
+      else:
+        try:
+          expiration = parse_datetime(packet['expiration'])
+        except (TypeError, ValueError):
+          expiration = None
+        if expiration == None:
+          return 'Invalid expiration slot'
+    return None
+
+  @staticmethod
+  def is_expired(packet, delay, clock=Clock.REAL):
+    """
+    Determine if a packet will be expired in delay seconds.
+    Expiration dates without a timezone are local times.
+    """
+    if 'expiration' not in packet:
+      return False
+    expiration = parse_datetime(packet['expiration'])
+    if expiration == None:
+      return False
+    if expiration.tzinfo == None:
+      now = clock.now(None)
+    else:
+      now = clock.now()
+    return expiration < now + datetime.timedelta(seconds=delay)
+
   async def transition_to_idle(self):
     """
     Transition to idle from asleep.
@@ -179,6 +326,8 @@ class Nabd:
 
   async def set_state(self, new_state):
     if new_state != self.state:
+      if self.state == 'idle':
+        self.cancel_ears_move()
       if new_state == 'idle':
         await self.idle_setup()
       if new_state == 'asleep':
@@ -186,20 +335,35 @@ class Nabd:
       self.state = new_state
       self.broadcast_state()
 
+  @staticmethod
+  def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
   async def process_info_packet(self, packet, writer):
     """ Process an info packet """
     if 'info_id' in packet:
       if 'animation' in packet:
         if not 'tempo' in packet['animation'] or not 'colors' in packet['animation']:
           self.write_response_packet(packet, {'status':'error','class':'MalformedPacket','message':'Missing required tempo & colors slots in animation'}, writer)
-        else:
-          self.info[packet['info_id']] = packet['animation']
+          return
+        tempo = packet['animation']['tempo']
+        colors = packet['animation']['colors']
+        if not Nabd.is_number(tempo) or tempo <= 0 or not isinstance(colors, list) or len(colors) == 0:
+          self.write_response_packet(packet, {'status':'error','class':'MalformedPacket','message':'tempo must be a positive number and colors a non-empty list'}, writer)
+          return
+        priority = packet.get('priority', InfoScheduler.DEFAULT_PRIORITY)
+        dwell = packet.get('dwell', InfoScheduler.DEFAULT_DWELL)
+        if not Nabd.is_number(priority) or not Nabd.is_number(dwell) or dwell <= 0:
+          self.write_response_packet(packet, {'status':'error','class':'MalformedPacket','message':'priority must be a number and dwell a positive number'}, writer)
+          return
+        changed = self.info.update(packet['info_id'], packet['animation'], priority, dwell)
       else:
-        del self.info[packet['info_id']]
+        changed = self.info.remove(packet['info_id'])
       self.write_response_packet(packet, {'status':'ok'}, writer)
-      # Signal idle loop to make sure we display updated info
-      async with self.idle_cv:
-        self.idle_cv.notify()
+      if changed:
+        # Signal idle loop to make sure we display updated info
+        async with self.idle_cv:
+          self.idle_cv.notify()
     else:
       self.write_response_packet(packet, {'status':'error','class':'MalformedPacket','message':'Missing required info_id slot'}, writer)
 
@@ -210,34 +374,61 @@ class Nabd:
     if 'right' in packet:
       self.ears['right'] = packet['right']
     if self.state == 'idle':
-      await self.nabio.move_ears(self.ears['left'], self.ears['right'])
+      self.request_ears_move()
     self.write_response_packet(packet, {'status':'ok'}, writer)
 
+  def request_ears_move(self):
+    """
+    Move ears to their idle position in the background.
+    Requests received while ears are moving are coalesced: only the latest
+    position is reached afterwards.
+    """
+    if self._ears_move_task == None or self._ears_move_task.done():
+      self._ears_move_task = asyncio.ensure_future(self._ears_move_loop())
+
+  def cancel_ears_move(self):
+    """
+    Cancel the background move of ears to their idle position, when leaving
+    idle state, so that it does not interfere with moves of the new state.
+    """
+    if self._ears_move_task != None:
+      self._ears_move_task.cancel()
+      self._ears_move_task = None
+
+  async def _ears_move_loop(self):
+    while self.state == 'idle':
+      target = (self.ears['left'], self.ears['right'])
+      await self.nabio.move_ears(target[0], target[1])
+      if target == (self.ears['left'], self.ears['right']):
+        break
+
   async def process_command_packet(self, packet, writer):
     """ Process a command packet """
-    if 'sequence' in packet:
+    error = Nabd.check_expiration(packet)
+    if error != None:
+      self.write_response_packet(packet, {'status':'error','class':'MalformedPacket','message':error}, writer)
+    elif 'sequence' in packet:
       if self.interactive_service_writer == writer:
         # interactive => play command immediately
         await self.perform_command(packet)
         self.write_response_packet(packet, {'status':'ok'}, writer)
       else:
-        async with self.idle_cv:
-          self.idle_queue.append((packet, writer))
-          self.idle_cv.notify()
+        await self.enqueue_playable_item(packet, writer)
     else:
       self.write_response_packet(packet, {'status':'error','class':'MalformedPacket','message':'Missing required sequence slot'}, writer)
 
   async def process_message_packet(self, packet, writer):
     """ Process a message packet """
-    if 'body' in packet:
+    error = Nabd.check_expiration(packet)
+    if error != None:
+      self.write_response_packet(packet, {'status':'error','class':'MalformedPacket','message':error}, writer)
+    elif 'body' in packet:
       if self.interactive_service_writer == writer:
         # interactive => play command immediately
         await self.perform_message(packet)
         self.write_response_packet(packet, {'status':'ok'}, writer)
       else:
-        async with self.idle_cv:
-          self.idle_queue.append((packet, writer))
-          self.idle_cv.notify()
+        await self.enqueue_playable_item(packet, writer)
     else:
       self.write_response_packet(packet, {'status':'error','class':'MalformedPacket','message':'Missing required body slot'}, writer)
 
@@ -257,14 +448,14 @@ class Nabd:
       self.write_response_packet(packet, {'status':'ok'}, writer)
     else:
       async with self.idle_cv:
-        self.idle_queue.append((packet, writer))
+        self.idle_queue.append((packet, writer, tracer.span('queue_wait')))
         self.idle_cv.notify()
 
   async def process_mode_packet(self, packet, writer):
     """ Process a mode packet """
     if 'mode' in packet and packet['mode'] == 'interactive':
       async with self.idle_cv:
-        self.idle_queue.append((packet, writer))
+        self.idle_queue.append((packet, writer, tracer.span('queue_wait')))
         self.idle_cv.notify()
     elif 'mode' in packet and packet['mode'] == 'idle':
       if 'events' in packet:
@@ -278,8 +469,40 @@ class Nabd:
     else:
       self.write_response_packet(packet, {'status':'error','class':'UnknownPacket','message':'Unknown or malformed mode packet'}, writer)
 
+  async def process_diagnostics_packet(self, packet, writer):
+    """ Process a diagnostics packet """
+    diagnostics = self.nabio.diagnostics()
+    diagnostics['executors'] = registry.diagnostics()
+    if 'trace' in packet and packet['trace'] != False:
+      if packet['trace'] == True:
+        diagnostics['trace'] = tracer.export()
+      else:
+        diagnostics['trace'] = tracer.export(str(packet['trace']))
+    self.write_response_packet(packet, {'status':'ok','diagnostics':diagnostics}, writer)
+
+  async def process_stats_packet(self, packet, writer):
+    """ Process a stats packet """
+    self.write_response_packet(packet, {'status':'ok','stats':metrics.snapshot()}, writer)
+
+  @staticmethod
+  def packet_type(packet):
+    """
+    Return the type of a packet for metrics: its type if it is known,
+    'unknown' or 'malformed' (no type slot) otherwise.
+    """
+    if not isinstance(packet, dict) or 'type' not in packet:
+      return 'malformed'
+    if packet['type'] in Nabd.PACKET_TYPES:
+      return packet['type']
+    return 'unknown'
+
+  def _queue_oldest_age(self):
+    now = self.clock.monotonic()
+    return {(): max([now - wait_span.start for (packet, writer, wait_span) in self.idle_queue], default=0.0)}
+
   async def process_packet(self, packet, writer):
     """ Process a packet from a service """
+    Nabd.packets_total.inc(type=Nabd.packet_type(packet))
     if 'type' in packet:
       processors = {
         'info': self.process_info_packet,
@@ -290,20 +513,27 @@ class Nabd:
         'wakeup': self.process_wakeup_packet,
         'sleep': self.process_sleep_packet,
         'mode': self.process_mode_packet,
+        'diagnostics': self.process_diagnostics_packet,
+        'stats': self.process_stats_packet,
       }
       if packet['type'] in processors:
-        await processors[packet['type']](packet, writer)
+        with tracer.span('process_packet', type=packet['type']):
+          await processors[packet['type']](packet, writer)
       else:
         self.write_response_packet(packet, {'status':'error','class':'UnknownPacket','message':'Unknown type ' + str(packet['type'])}, writer)
     else:
       self.write_response_packet(packet, {'status':'error','class':'MalformedPacket','message':'Missing type slot'}, writer)
 
   def write_packet(self, response, writer):
+    if self.recorder != None:
+      self.recorder.outbound(writer, response)
     writer.write((json.dumps(response) + '\r\n').encode('utf8'))
 
   def broadcast_event(self, event_type, response):
+    Nabd.broadcasts_total.inc(event=event_type)
     for sw, events in self.service_writers.items():
       if event_type in events:
+        Nabd.broadcast_packets_total.inc(event=event_type)
         self.write_packet(response, sw)
 
   def write_response_packet(self, original_packet, template, writer):
@@ -311,6 +541,10 @@ class Nabd:
     if 'request_id' in original_packet:
       response_packet['request_id'] = original_packet['request_id']
     response_packet['type'] = 'response'
+    tracer.instant('response', status=response_packet.get('status'))
+    received = Nabd.received_at.get()
+    if received != None and isinstance(original_packet, dict):
+      Nabd.response_latency.observe(self.clock.monotonic() - received, type=Nabd.packet_type(original_packet))
     self.write_packet(response_packet, writer)
 
   def broadcast_state(self):
@@ -322,15 +556,25 @@ class Nabd:
 
   # Handle service through TCP/IP protocol
   async def service_loop(self, reader, writer):
+    if self.recorder != None:
+      self.recorder.open(writer)
     self.write_state_packet(writer)
     self.service_writers[writer] = ['asr']
     try:
       while not reader.at_eof():
         line = await reader.readline()
         if line != b'' and line != b'\r\n':
+          if self.recorder != None:
+            self.recorder.inbound(writer, line)
           try:
             packet = json.loads(line.decode('utf8'))
-            await self.process_packet(packet, writer)
+            token = tracer.activate(tracer.trace_id(packet))
+            received_token = Nabd.received_at.set(self.clock.monotonic())
+            try:
+              await self.process_packet(packet, writer)
+            finally:
+              tracer.deactivate(token)
+              Nabd.received_at.reset(received_token)
           except UnicodeDecodeError as e:
             self.write_packet({'type':'response','status':'error','class':'UnicodeDecodeError','message':str(e)}, writer)
           except json.decoder.JSONDecodeError as e:
@@ -338,7 +582,8 @@ class Nabd:
       writer.close()
       if sys.version_info >= (3,7):
         await writer.wait_closed()
-    except ConnectionResetError:
+    except (ConnectionResetError, BrokenPipeError):
+      # Service disconnected
       pass
     except Exception:
       print(traceback.format_exc())
@@ -346,6 +591,8 @@ class Nabd:
       if self.interactive_service_writer == writer:
         await self.exit_interactive()
       del self.service_writers[writer]
+      if self.recorder != None:
+        self.recorder.close(writer)
 
   async def perform_command(self, packet):
     await self.nabio.play_sequence(packet['sequence'])
@@ -372,11 +619,15 @@ class Nabd:
 
   async def stop_asr(self):
     await self.nabio.end_acquisition()
-    now = time.time()
+    now = self.clock.time()
+    start = self.clock.monotonic()
     decoded_str = await self.asr.get_decoded_string(True)
+    Nabd.asr_duration.observe(self.clock.monotonic() - start)
     # ASR model needs to be improved, log outcome.
     print("asr => %s" % decoded_str)
+    start = self.clock.monotonic()
     response = await self.nlu.interpret(decoded_str)
+    Nabd.nlu_duration.observe(self.clock.monotonic() - start)
 #   print("nlu => %s" % str(response))
     await self.set_state('idle')
     if response == None:
@@ -386,6 +637,7 @@ class Nabd:
       self.broadcast_event('asr', {'type':'asr_event', 'nlu': response, 'time': now})
 
   async def _shutdown(self):
+    # sleep_setup also saves ears positions.
     await self.sleep_setup()
     os.system('/sbin/halt')
 
@@ -416,19 +668,34 @@ class Nabd:
       if self.state != 'asleep':
         self.broadcast_event('ears', {'type':'ears_event', 'left': left, 'right': right})
 
-  def run(self):
+  def run(self, port=NabService.PORT_NUMBER, path=None, metrics_port=None):
+    """
+    Run nabd, serving services on a TCP port of localhost or on a Unix
+    socket if path is set, and metrics in Prometheus format on metrics_port
+    of localhost if it is set.
+    """
     self.loop = asyncio.get_event_loop()
+    self.clock = Clock.of(self.loop)
+    tracer.clock = self.clock
     self.nabio.bind_button_event(self.loop, self.button_callback)
     self.nabio.bind_ears_event(self.loop, self.ears_callback)
+    self.check_executors()
     setup_task = self.loop.create_task(self.idle_setup())
     idle_task = self.loop.create_task(self.idle_worker_loop())
     if os.environ.get('LISTEN_PID', None) == str(os.getpid()):
       server_task = self.loop.create_task(asyncio.start_server(self.service_loop, sock=socket.fromfd(Nabd.SYSTEMD_ACTIVATED_FD, socket.AF_INET, socket.SOCK_STREAM)))
+    elif path != None:
+      server_task = self.loop.create_task(asyncio.start_unix_server(self.service_loop, path))
     else:
-      server_task = self.loop.create_task(asyncio.start_server(self.service_loop, 'localhost', NabService.PORT_NUMBER))
+      server_task = self.loop.create_task(asyncio.start_server(self.service_loop, 'localhost', port))
+    tasks = [setup_task, idle_task, server_task]
+    metrics_task = None
+    if metrics_port != None:
+      metrics_task = self.loop.create_task(metrics.serve_prometheus(metrics_port))
+      tasks.append(metrics_task)
     try:
       self.loop.run_forever()
-      for t in [setup_task, idle_task, server_task]:
+      for t in tasks:
         if t.done():
           t_ex = t.exception()
           if t_ex:
@@ -438,6 +705,7 @@ class Nabd:
     except Exception:
       print(traceback.format_exc())
     finally:
+      self.nabio.save_ears_positions()
       self.loop.run_until_complete(self.stop_idle_worker())
       for writer in self.service_writers.copy():
         writer.close()
@@ -451,8 +719,14 @@ class Nabd:
         self.loop.run_until_complete(t)    # give canceled tasks the last chance to run
       server = server_task.result()
       server.close()
+      if metrics_task != None and metrics_task.done() and metrics_task.exception() == None:
+        metrics_task.result().close()
       self.loop.close()
 
+  def check_executors(self):
+    registry.report_stuck_tasks()
+    self.loop.call_later(ExecutorRegistry.WATCHDOG_INTERVAL, self.check_executors)
+
   def stop(self):
     if not self.loop.is_closed():
       self.loop.call_soon_threadsafe(lambda : self.loop.stop())
@@ -477,9 +751,24 @@ class Nabd:
     pidfilepath = "/var/run/nabd.pid"
     usage = 'nabd [options]\n' \
      + ' -h                   display this message\n' \
-     + ' --pidfile=<pidfile>  define pidfile (default = {pidfilepath})\n'.format(pidfilepath=pidfilepath)
+     + ' --pidfile=<pidfile>  define pidfile (default = {pidfilepath})\n'.format(pidfilepath=pidfilepath) \
+     + ' --nabio=<hw|sim>     hardware or simulated rabbit (default = hw)\n' \
+     + ' --sim-timeline=<file>  export timeline of simulated rabbit on exit\n' \
+     + ' --gpio=<rpi|cdev>    GPIO backend for ears and button (default = rpi)\n' \
+     + ' --device-loop        run device I/O on a dedicated thread\n' \
+     + ' --device-priority=<priority>  SCHED_FIFO priority (1-99) of the device thread\n' \
+     + ' --thread-stack-size=<kib>  stack size of executor threads\n' \
+     + ' --record=<file>      append traffic with services to file\n' \
+     + ' --metrics-port=<port>  serve metrics in Prometheus format on this port\n'
+    nabio_backend = 'hw'
+    sim_timeline = None
+    record = None
+    metrics_port = None
+    gpio = 'rpi'
+    device_loop = False
+    device_priority = None
     try:
-      opts, args = getopt.getopt(argv,"h",["pidfile=","nabio="])
+      opts, args = getopt.getopt(argv,"h",["pidfile=","nabio=","sim-timeline=","gpio=","device-loop","device-priority=","thread-stack-size=","record=","metrics-port="])
     except getopt.GetoptError:
       print(usage)
       exit(2)
@@ -489,14 +778,72 @@ class Nabd:
         exit(0)
       elif opt == '--pidfile':
         pidfilepath = arg
+      elif opt == '--nabio':
+        if arg not in ['hw', 'sim']:
+          print(usage)
+          exit(2)
+        nabio_backend = arg
+      elif opt == '--sim-timeline':
+        sim_timeline = arg
+      elif opt == '--gpio':
+        if arg not in ['rpi', 'cdev']:
+          print(usage)
+          exit(2)
+        gpio = arg
+      elif opt == '--device-loop':
+        device_loop = True
+      elif opt == '--device-priority':
+        device_loop = True
+        try:
+          device_priority = int(arg)
+        except ValueError:
+          device_priority = None
+        if device_priority == None or device_priority < 1 or device_priority > 99:
+          print(usage)
+          exit(2)
+      elif opt == '--thread-stack-size':
+        try:
+          registry.set_stack_size(int(arg) * 1024)
+        except ValueError:
+          print(usage)
+          exit(2)
+      elif opt == '--record':
+        record = arg
+      elif opt == '--metrics-port':
+        try:
+          metrics_port = int(arg)
+        except ValueError:
+          metrics_port = None
+        if metrics_port == None or metrics_port < 1 or metrics_port > 65535:
+          print(usage)
+          exit(2)
     pidfile = PIDLockFile(pidfilepath, timeout=-1)
     try:
       with pidfile:
-        from .nabio_hw import NabIOHW
-        nabio = NabIOHW()
+        if nabio_backend == 'sim':
+          from .nabio_sim import NabIOSim
+          factory = lambda: NabIOSim()
+        else:
+          from .nabio_hw import NabIOHW
+          factory = lambda: NabIOHW(gpio)
+        if device_loop:
+          from .device_loop import NabIODeviceLoop
+          nabio = NabIODeviceLoop.create(factory, device_priority)
+        else:
+          nabio = factory()
         Nabd.leds_boot(nabio, 1)
         nabd = Nabd(nabio)
-        nabd.run()
+        if record != None:
+          from .session_recorder import SessionRecorder
+          nabd.recorder = SessionRecorder(record)
+        nabd.run(metrics_port=metrics_port)
+        if nabd.recorder != None:
+          nabd.recorder.stop()
+        if device_loop:
+          nabio.stop()
+          nabio = nabio.nabio
+        if sim_timeline != None and nabio_backend == 'sim':
+          nabio.timeline.export(sim_timeline)
     except AlreadyLocked:
       print('nabd already running? (pid={pid})'.format(pid=pidfile.read_pid()))
       exit(1)
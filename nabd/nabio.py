@@ -1,6 +1,13 @@
 import abc
 import asyncio
+import collections
+import json
+import sys
+import time
 from .choreography import ChoreographyInterpreter
+from .preroll import Preroll
+from .leds import Leds, LedTimeline
+from .tracing import tracer
 
 class NabIO(object, metaclass=abc.ABCMeta):
   """ Interface for I/O interactions with a nabaztag """
@@ -11,6 +18,10 @@ class NabIO(object, metaclass=abc.ABCMeta):
 
   # Each info loop lasts 15 seconds
   INFO_LOOP_LENGTH = 15.0
+  INFO_TIMELINES_SIZE = 16              # Compiled info animations kept
+
+  def __init__(self):
+    self.info_timelines = collections.OrderedDict() # Compiled info animations, LRU
 
   @abc.abstractmethod
   async def setup_ears(self, left_ear, right_ear):
@@ -24,9 +35,23 @@ class NabIO(object, metaclass=abc.ABCMeta):
     """
     Move ears to a given position and return only when they reached this
     position.
+    Ears may take the shortest path. A concurrent call retargets them.
     """
     raise NotImplementedError( 'Should have implemented' )
 
+  def save_ears_positions(self):
+    """
+    Save ears positions, as a clean shutdown marker allowing to skip ears
+    detection at next start.
+    """
+    self.ears.save_positions()
+
+  def diagnostics(self):
+    """
+    Return diagnostics of the hardware, as a JSON-serializable dict.
+    """
+    return {'ears': self.ears.diagnostics()}
+
   @abc.abstractmethod
   async def detect_ears_positions(self):
     """
@@ -70,23 +95,92 @@ class NabIO(object, metaclass=abc.ABCMeta):
     """
     raise NotImplementedError( 'Should have implemented' )
 
-  @abc.abstractmethod
-  async def play_info(self, condvar, tempo, colors):
+  async def play_info(self, condvar, tempo, colors, duration=INFO_LOOP_LENGTH):
     """
     Play an info animation.
     tempo & colors are as described in the nabd protocol.
-    Run the animation in loop for the complete info duration (15 seconds) or until condvar is notified
+    Run the animation in loop for duration seconds (default is 15 seconds) or until condvar is notified
 
     If 'left'/'center'/'right' slots are absent, the light is off.
+    The leds play the compiled animation, the loop only waits once.
     """
-    raise NotImplementedError( 'Should have implemented' )
+    key = json.dumps([tempo, colors], sort_keys=True)
+    timeline = self.info_timelines.get(key)
+    if timeline == None:
+      timeline = NabIO._compile_info(tempo, colors)
+      self.info_timelines[key] = timeline
+      if len(self.info_timelines) > NabIO.INFO_TIMELINES_SIZE:
+        self.info_timelines.popitem(last=False)
+    else:
+      self.info_timelines.move_to_end(key)
+    self.leds.play_timeline(timeline)
+    try:
+      await NabIO._wait_on_condvar(condvar, duration * 1000)
+    finally:
+      self.leds.stop_timeline()
+
+  @staticmethod
+  def _compile_info(tempo, colors):
+    """
+    Compile an info animation into a looping LedTimeline.
+    """
+    step = tempo * 10 / 1000
+    return LedTimeline([(step, NabIO._convert_info_color(color)) for color in colors])
+
+  @staticmethod
+  async def _wait_on_condvar(condvar, ms):
+    timeout = False
+    try:
+      await asyncio.wait_for(condvar.wait(), ms / 1000)
+    except asyncio.TimeoutError:
+      # asyncio condition bug with Python < 3.7
+      # https://bugs.python.org/issue32751
+      # https://bugs.python.org/issue33638
+      if sys.version_info < (3,7):
+        await asyncio.sleep(0) # tentative workaround
+      timeout = True
+    return timeout
+
+  @staticmethod
+  def _convert_info_color(color):
+    animation = []
+    for led_ix, led in [(Leds.LED_LEFT, 'left'), (Leds.LED_CENTER, 'center'), (Leds.LED_RIGHT, 'right')]:
+      if color.get(led):
+        int_value = int(color[led], 16)
+        values = ((int_value >> 16) & 0xFF, (int_value >> 8) & 0xFF, int_value & 0xFF)
+      else:
+        values = (0, 0, 0)
+      animation.append((led_ix, values))
+    return animation
+
+  # Recording starts together with the listen sound, and samples recorded
+  # during the last ASR_PREROLL seconds of it and after it are passed to ASR.
+  # Up to ASR_HOLD seconds of samples are held until the end of the listen
+  # sound is signaled.
+  ASR_CONCURRENT_LISTEN = True
+  ASR_PREROLL = 0.3
+  ASR_HOLD = 2.0
+  ASR_SAMPLE_RATE = 16000
+  ASR_SAMPLE_WIDTH = 2
 
   async def start_acquisition(self, acquisition_cb):
     """
     Play listen sound and start acquisition, calling callback with sound samples.
     """
-    await self.sound.play_list(["asr/listen.mp3"], False)
-    await self.sound.start_recording(acquisition_cb)
+    if NabIO.ASR_CONCURRENT_LISTEN:
+      preroll_bytes = int(NabIO.ASR_PREROLL * NabIO.ASR_SAMPLE_RATE) * NabIO.ASR_SAMPLE_WIDTH
+      hold_bytes = int(NabIO.ASR_HOLD * NabIO.ASR_SAMPLE_RATE) * NabIO.ASR_SAMPLE_WIDTH
+      preroll = Preroll(acquisition_cb, preroll_bytes, hold_bytes, NabIO.ASR_SAMPLE_RATE, NabIO.ASR_SAMPLE_WIDTH)
+      self.sound.playback_end = None
+      await self.sound.start_recording(preroll.feed)
+      await self.sound.play_list(["asr/listen.mp3"], False)
+      cue_end = self.sound.playback_end
+      if cue_end == None:
+        cue_end = time.monotonic()
+      preroll.release(cue_end)
+    else:
+      await self.sound.play_list(["asr/listen.mp3"], False)
+      await self.sound.start_recording(acquisition_cb)
 
   async def end_acquisition(self):
     """
@@ -105,25 +199,27 @@ class NabIO(object, metaclass=abc.ABCMeta):
     """
     Play a message, i.e. a signature, a body and a signature.
     """
-    preloaded_sig = await self._preload([signature])
-    preloaded_body = await self._preload(body)
-    ci = ChoreographyInterpreter(self.leds, self.ears, self.sound)
-    await self._play_preloaded(ci, preloaded_sig, ChoreographyInterpreter.STREAMING_URN)
-    await self._play_preloaded(ci, preloaded_body, ChoreographyInterpreter.STREAMING_URN)
-    await self._play_preloaded(ci, preloaded_sig, ChoreographyInterpreter.STREAMING_URN)
-    await ci.stop()
+    with tracer.span('play_message'):
+      preloaded_sig = await self._preload([signature])
+      preloaded_body = await self._preload(body)
+      ci = ChoreographyInterpreter(self.leds, self.ears, self.sound)
+      await self._play_preloaded(ci, preloaded_sig, ChoreographyInterpreter.STREAMING_URN)
+      await self._play_preloaded(ci, preloaded_body, ChoreographyInterpreter.STREAMING_URN)
+      await self._play_preloaded(ci, preloaded_sig, ChoreographyInterpreter.STREAMING_URN)
+      await ci.stop()
 
   async def play_sequence(self, sequence):
     """
     Play a simple sequence
     """
-    preloaded = await self._preload(sequence)
-    ci = ChoreographyInterpreter(self.leds, self.ears, self.sound)
-    played_audio = await self._play_preloaded(ci, preloaded, None)
-    if played_audio:
-      await ci.stop()
-    else:
-      await ci.wait_until_complete()
+    with tracer.span('play_sequence'):
+      preloaded = await self._preload(sequence)
+      ci = ChoreographyInterpreter(self.leds, self.ears, self.sound)
+      played_audio = await self._play_preloaded(ci, preloaded, None)
+      if played_audio:
+        await ci.stop()
+      else:
+        await ci.wait_until_complete()
 
   async def _play_preloaded(self, ci, preloaded, default_chor):
     for seq_item in preloaded:
@@ -142,6 +238,10 @@ class NabIO(object, metaclass=abc.ABCMeta):
         return False
 
   async def _preload(self, sequence):
+    with tracer.span('preload', items=len(sequence)):
+      return await self._preload_items(sequence)
+
+  async def _preload_items(self, sequence):
     preloaded_sequence = []
     for seq_item in sequence:
       if 'audio' in seq_item:
@@ -151,8 +251,9 @@ class NabIO(object, metaclass=abc.ABCMeta):
           audio_list = [seq_item['audio']]
         else:
           audio_list = seq_item['audio']
-        for res in audio_list:
-          f = await self.sound.preload(res)
+        # Preload concurrently, text-to-speech syntheses run ahead of playback
+        preloaded_files = await asyncio.gather(*[self.sound.preload(res) for res in audio_list])
+        for f in preloaded_files:
           if f != None:
             preloaded_audio_list.append(f)
         seq_item['audio'] = preloaded_audio_list
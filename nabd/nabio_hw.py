@@ -1,44 +1,56 @@
-import asyncio, time, sys
 from .nabio import NabIO
 from .leds import Leds
 from .ears import Ears
-from .ears_gpio import EarsGPIO
 from .button import Button
-from .button_gpio import ButtonGPIO
 from .leds_neopixel import LedsNeoPixel
 from .sound_alsa import SoundAlsa
 
 class NabIOHW(NabIO):
   """
   Implementation of nabio for Raspberry Pi hardware.
+  Ears and button use either RPi.GPIO or the GPIO character device (cdev).
   """
+  GPIO_BACKENDS = ['rpi', 'cdev']
 
-  def __init__(self):
+  def __init__(self, gpio='rpi'):
     super().__init__()
     self.model = NabIOHW.detect_model()
     self.leds = LedsNeoPixel()
-    self.ears = EarsGPIO()
+    if gpio == 'cdev':
+      from .gpio_cdev import GPIOChip
+      from .ears_cdev import EarsCdev
+      from .button_cdev import ButtonCdev
+      chip = GPIOChip()
+      self.ears = EarsCdev(chip)
+      self.button = ButtonCdev(self.model, chip)
+    else:
+      from .ears_gpio import EarsGPIO
+      from .button_gpio import ButtonGPIO
+      self.ears = EarsGPIO()
+      self.button = ButtonGPIO(self.model)
     self.sound = SoundAlsa(self.model)
-    self.button = ButtonGPIO(self.model)
 
   async def setup_ears(self, left_ear, right_ear):
     await self.ears.reset_ears(left_ear, right_ear)
 
   async def move_ears(self, left_ear, right_ear):
-    await self.ears.go(Ears.LEFT_EAR, left_ear, Ears.FORWARD_DIRECTION)
-    await self.ears.go(Ears.RIGHT_EAR, right_ear, Ears.FORWARD_DIRECTION)
+    # Both motors run concurrently and a subsequent call retargets them.
+    await self.ears.go(Ears.LEFT_EAR, left_ear, Ears.ANY_DIRECTION)
+    await self.ears.go(Ears.RIGHT_EAR, right_ear, Ears.ANY_DIRECTION)
     await self.ears.wait_while_running()
 
   async def detect_ears_positions(self):
     return await self.ears.detect_positions()
 
   def set_leds(self, nose, left, center, right, bottom):
+    self.leds.begin_frame()
     for (led_ix, led) in [(Leds.LED_NOSE, nose), (Leds.LED_LEFT, left), (Leds.LED_CENTER, center), (Leds.LED_RIGHT, right), (Leds.LED_BOTTOM, bottom)]:
       if led == None:
         (r, g, b) = (0, 0, 0)
       else:
         (r, g, b) = led
       self.leds.set1(led_ix, r, g, b)
+    self.leds.commit_frame()
 
   def pulse(self, led_ix, color):
     (r, g, b) = color
@@ -50,52 +62,6 @@ class NabIOHW(NabIO):
   def bind_ears_event(self, loop, callback):
     self.ears.on_move(loop, callback)
 
-  async def play_info(self, condvar, tempo, colors):
-    animation = [NabIOHW._convert_info_color(color) for color in colors]
-    step_ms = tempo * 10
-    start = time.time()
-    index = 0
-    while time.time() - start < NabIO.INFO_LOOP_LENGTH:
-      step = animation[index]
-      for led_ix, rgb in step:
-        r, g, b = rgb
-        self.leds.set1(led_ix, r, g, b)
-      if await NabIOHW._wait_on_condvar(condvar, step_ms):
-        index = (index + 1) % len(animation)
-      else:
-        break
-
-  @staticmethod
-  async def _wait_on_condvar(condvar, ms):
-    timeout = False
-    try:
-      await asyncio.wait_for(condvar.wait(), ms / 1000)
-    except asyncio.TimeoutError:
-      # asyncio condition bug with Python < 3.7
-      # https://bugs.python.org/issue32751
-      # https://bugs.python.org/issue33638
-      if sys.version_info < (3,7):
-        await asyncio.sleep(0) # tentative workaround
-      timeout = True
-    return timeout
-
-  @staticmethod
-  def _convert_info_color(color):
-    animation = []
-    for led_ix, led in [(Leds.LED_LEFT, 'left'), (Leds.LED_CENTER, 'center'), (Leds.LED_RIGHT, 'right')]:
-      values = []
-      if color[led]:
-        int_value = int(color[led], 16)
-        values.append((int_value >> 16) & 0xFF) # r
-        values.append((int_value >> 8) & 0xFF)  # g
-        values.append(int_value & 0xFF)         # b
-      else:
-        values.append(0)
-        values.append(0)
-        values.append(0)
-      animation.append((led_ix, values))
-    return animation
-
   def cancel(self):
     pass
 
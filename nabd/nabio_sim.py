@@ -0,0 +1,346 @@
+import asyncio, json
+from .nabio import NabIO
+from .leds import Leds
+from .ears import Ears
+from .sound import Sound
+from .duration import DurationEstimator
+from .tracing import tracer
+from nabcommon.clock import Clock
+
+class SimTimeline(object):
+  """
+  Time-stamped record of what a simulated rabbit shows and plays.
+  Events are (time, kind, data) tuples, time being in seconds since the
+  first event (or the last reset), according to the loop time, rounded to
+  the microsecond.
+  Kinds are:
+  - 'leds': colors of the five leds, as 'rrggbb' strings
+  - 'pulse': [led, 'rrggbb']
+  - 'ear': [ear, position]
+  - 'motor': [ear, direction], direction being 1, -1 or 0 when stopped
+  - 'audio': [resource, duration], duration being None if unknown
+  - 'audio_end': resource, played entirely
+  - 'audio_stop': resource, interrupted
+  - 'record': True when recording starts, False when it stops
+  - 'button': event
+  """
+  def __init__(self):
+    self.events = []
+    self.origin = None
+
+  def now(self):
+    now = asyncio.get_event_loop().time()
+    if self.origin == None:
+      self.origin = now
+    return round(now - self.origin, 6)
+
+  def reset(self):
+    self.events = []
+    self.origin = None
+
+  def record(self, kind, data):
+    self.events.append((self.now(), kind, data))
+
+  def filter(self, kind):
+    return [(time, data) for (time, event_kind, data) in self.events if event_kind == kind]
+
+  def export(self, path):
+    """
+    Export the timeline as JSON lines, one [time, kind, data] array per
+    event with time in milliseconds, for diffing.
+    """
+    with open(path, 'w') as f:
+      for (time, kind, data) in self.events:
+        f.write(json.dumps([round(time * 1000), kind, data], separators=(',', ':')))
+        f.write('\n')
+
+  @staticmethod
+  def load(path):
+    """
+    Load an exported timeline, returning (time, kind, data) tuples.
+    """
+    with open(path) as f:
+      return [(time / 1000, kind, data) for (time, kind, data) in [json.loads(line) for line in f if line.strip() != '']]
+
+class LedsSim(Leds):
+  """
+  Simulated leds with a framebuffer.
+  Committed frames are recorded if they changed the framebuffer. Pulses
+  are recorded as such and timelines are played with loop timers.
+  """
+  OFF = '000000'
+
+  def __init__(self, timeline):
+    self.timeline = timeline
+    self.framebuffer = [LedsSim.OFF] * Leds.LED_COUNT
+    self.recorded = None
+    self.frame_depth = 0
+    self.playing = None                 # (timeline, frame index, timer handle)
+
+  @staticmethod
+  def color(red, green, blue):
+    return '{r:02x}{g:02x}{b:02x}'.format(r=red, g=green, b=blue)
+
+  def set1(self, led, red, green, blue):
+    self.framebuffer[led] = LedsSim.color(red, green, blue)
+    self._show()
+
+  def setall(self, red, green, blue):
+    self.framebuffer = [LedsSim.color(red, green, blue)] * Leds.LED_COUNT
+    self._show()
+
+  def pulse(self, led, red, green, blue):
+    self.timeline.record('pulse', [led, LedsSim.color(red, green, blue)])
+
+  def play_timeline(self, timeline):
+    self.stop_timeline()
+    self._play_frame(timeline, 0)
+
+  def _play_frame(self, timeline, index):
+    self.begin_frame()
+    for (led, (red, green, blue)) in timeline.frames[index]:
+      self.set1(led, red, green, blue)
+    self.commit_frame()
+    delay = timeline.ends[index]
+    if index > 0:
+      delay = delay - timeline.ends[index - 1]
+    next_index = (index + 1) % len(timeline.frames)
+    handle = asyncio.get_event_loop().call_later(delay, self._play_frame, timeline, next_index)
+    self.playing = (timeline, next_index, handle)
+
+  def stop_timeline(self):
+    if self.playing != None:
+      self.playing[2].cancel()
+      self.playing = None
+
+  def begin_frame(self):
+    self.frame_depth = self.frame_depth + 1
+
+  def commit_frame(self):
+    self.frame_depth = self.frame_depth - 1
+    self._show()
+
+  def _show(self):
+    if self.frame_depth == 0 and self.framebuffer != self.recorded:
+      self.recorded = self.framebuffer.copy()
+      self.timeline.record('leds', self.recorded)
+
+class EarsSim(Ears):
+  """
+  Simulated ears with motors turning at a constant speed.
+  Like real ears, the encoder wheel has a missing hole, and the step
+  crossing it (to position 0) takes twice as long.
+  """
+  STEP_DURATION = 0.125     # seconds between two holes
+  MISSING_HOLE_STEPS = 2    # the missing hole doubles the step
+
+  def __init__(self, timeline):
+    self.timeline = timeline
+    self.positions = [0, 0]
+    self.remaining = [0, 0]             # steps to go
+    self.directions = [0, 0]            # 1, -1 or 0 when stopped
+    self.tasks = [None, None]
+    self.callback = None
+
+  def on_move(self, loop, callback):
+    self.callback = (loop, callback)
+
+  def turn(self, ear, position):
+    """
+    Simulate a user moving an ear to a position.
+    """
+    self.positions[ear] = position % Ears.STEPS
+    self.timeline.record('ear', [ear, self.positions[ear]])
+    if self.callback != None:
+      (loop, callback) = self.callback
+      loop.call_soon_threadsafe(callback, ear)
+
+  async def reset_ears(self, target_left, target_right):
+    await self.go(Ears.LEFT_EAR, target_left, Ears.ANY_DIRECTION)
+    await self.go(Ears.RIGHT_EAR, target_right, Ears.ANY_DIRECTION)
+    await self.wait_while_running()
+
+  async def move(self, ear, delta, direction):
+    await self.go(ear, self.positions[ear] + delta, direction)
+
+  async def detect_positions(self):
+    await self.wait_while_running()
+    return (self.positions[0], self.positions[1])
+
+  async def go(self, ear, position, direction):
+    """
+    Go to a specific position.
+    See EarsGPIO.go
+    """
+    if direction == Ears.ANY_DIRECTION:
+      (position, direction) = Ears.shortest_direction(self.positions[ear], position)
+    if direction == Ears.FORWARD_DIRECTION:
+      steps = (position - self.positions[ear]) % Ears.STEPS
+      increment = 1
+    else:
+      steps = (self.positions[ear] - position) % Ears.STEPS
+      increment = -1
+    if steps == 0 and (position >= Ears.STEPS or position < 0):
+      steps = Ears.STEPS
+    self.remaining[ear] = steps
+    if steps == 0:
+      self._set_direction(ear, 0)
+      return
+    self._set_direction(ear, increment)
+    if self.tasks[ear] == None or self.tasks[ear].done():
+      self.tasks[ear] = asyncio.ensure_future(self._run_motor(ear))
+
+  def _set_direction(self, ear, direction):
+    if self.directions[ear] != direction:
+      self.directions[ear] = direction
+      self.timeline.record('motor', [ear, direction])
+
+  async def _run_motor(self, ear):
+    while self.remaining[ear] > 0:
+      next_position = (self.positions[ear] + self.directions[ear]) % Ears.STEPS
+      crossed = next_position if self.directions[ear] > 0 else self.positions[ear]
+      if crossed == 0:
+        await asyncio.sleep(EarsSim.STEP_DURATION * EarsSim.MISSING_HOLE_STEPS)
+      else:
+        await asyncio.sleep(EarsSim.STEP_DURATION)
+      if self.remaining[ear] == 0:
+        # retargeted to current position
+        break
+      self.positions[ear] = (self.positions[ear] + self.directions[ear]) % Ears.STEPS
+      self.remaining[ear] = self.remaining[ear] - 1
+      self.timeline.record('ear', [ear, self.positions[ear]])
+    self._set_direction(ear, 0)
+
+  async def wait_while_running(self):
+    tasks = [task for task in self.tasks if task != None and not task.done()]
+    if len(tasks) > 0:
+      await asyncio.gather(*tasks)
+
+  def diagnostics(self):
+    return {'positions': self.positions.copy()}
+
+class SoundSim(Sound):
+  """
+  Virtual sound card: sounds last as long as their estimated duration.
+  Sounds with an unknown duration (e.g. streams) play until stopped.
+  """
+  def __init__(self, timeline):
+    self.timeline = timeline
+    self.playing = None                 # (resource, future, timer handle)
+    self.recording = False
+
+  async def start_playing_preloaded(self, filename):
+    await self.stop_playing()
+    duration = SoundSim.duration(filename)
+    future = asyncio.get_event_loop().create_future()
+    handle = None
+    if duration != None:
+      handle = asyncio.get_event_loop().call_later(duration, self._end, filename, future)
+    self.playing = (filename, future, handle)
+    self.timeline.record('audio', [filename, duration])
+    tracer.instant('first_sample', resource=filename)
+
+  @staticmethod
+  def duration(filename):
+    try:
+      if filename.endswith('.wav'):
+        return DurationEstimator.wav_duration(filename)
+      if filename.endswith('.mp3'):
+        return DurationEstimator.mp3_duration(filename)
+    except (OSError, ValueError, EOFError) as err:
+      print('Warning : could not estimate duration of {f} ({err})'.format(f=filename, err=err))
+    return None
+
+  def _end(self, filename, future):
+    if not future.done():
+      self.timeline.record('audio_end', filename)
+      future.set_result(True)
+
+  async def wait_until_done(self):
+    if self.playing != None:
+      await asyncio.shield(self.playing[1])
+
+  async def stop_playing(self):
+    if self.playing != None:
+      (filename, future, handle) = self.playing
+      self.playing = None
+      if not future.done():
+        if handle != None:
+          handle.cancel()
+        self.timeline.record('audio_stop', filename)
+        future.set_result(False)
+
+  async def start_recording(self, stream_cb):
+    await self.stop_recording()
+    self.recording = stream_cb
+    self.timeline.record('record', True)
+
+  async def stop_recording(self):
+    if self.recording:
+      stream_cb = self.recording
+      self.recording = False
+      self.timeline.record('record', False)
+      stream_cb(b'', True)
+
+class NabIOSim(NabIO):
+  """
+  Simulated rabbit, to run nabd headless (e.g. for regression tests and
+  benchmarks). Leds, ears and sound are recorded on a timeline, which can
+  be exported.
+  """
+
+  def __init__(self, timeline=None):
+    super().__init__()
+    if timeline == None:
+      timeline = SimTimeline()
+    self.timeline = timeline
+    self.leds = LedsSim(timeline)
+    self.ears = EarsSim(timeline)
+    self.sound = SoundSim(timeline)
+    self.button_callback = None
+
+  async def setup_ears(self, left_ear, right_ear):
+    await self.ears.reset_ears(left_ear, right_ear)
+
+  async def move_ears(self, left_ear, right_ear):
+    await self.ears.go(Ears.LEFT_EAR, left_ear, Ears.ANY_DIRECTION)
+    await self.ears.go(Ears.RIGHT_EAR, right_ear, Ears.ANY_DIRECTION)
+    await self.ears.wait_while_running()
+
+  async def detect_ears_positions(self):
+    return await self.ears.detect_positions()
+
+  def set_leds(self, nose, left, center, right, bottom):
+    self.leds.begin_frame()
+    for (led_ix, led) in [(Leds.LED_NOSE, nose), (Leds.LED_LEFT, left), (Leds.LED_CENTER, center), (Leds.LED_RIGHT, right), (Leds.LED_BOTTOM, bottom)]:
+      if led == None:
+        (r, g, b) = (0, 0, 0)
+      else:
+        (r, g, b) = led
+      self.leds.set1(led_ix, r, g, b)
+    self.leds.commit_frame()
+
+  def pulse(self, led_ix, color):
+    (r, g, b) = color
+    self.leds.pulse(led_ix, r, g, b)
+
+  def bind_button_event(self, loop, callback):
+    self.button_callback = (loop, callback)
+
+  def press(self, event):
+    """
+    Simulate a button event.
+    """
+    self.timeline.record('button', event)
+    if self.button_callback != None:
+      (loop, callback) = self.button_callback
+      loop.call_soon_threadsafe(callback, event, Clock.of(loop).time())
+
+  def bind_ears_event(self, loop, callback):
+    self.ears.on_move(loop, callback)
+
+  def cancel(self):
+    pass
+
+  def has_sound_input(self):
+    return False
@@ -0,0 +1,168 @@
+"""
+Replay traffic recorded by nabd --record.
+
+Usage: python -m nabd.nabreplay FILE [--session N] [--fast] [--port N]
+         [--nabio sim|mock] [--virtual-time] [--output FILE]
+
+Re-drives nabd with the packets sent by services, on as many connections
+and with the recorded timing, or as fast as possible with --fast. In fast
+mode, a packet is sent once the responses recorded before it on its
+connection were received, as services wait for them. In both modes, a
+connection is closed once its recorded responses were received.
+By default, nabd runs in-process with a simulated rabbit. With --port,
+packets are sent to a running nabd instead.
+Responses are compared to the recorded ones by request_id, and a summary
+is printed as JSON.
+"""
+import argparse, asyncio, json, os, shutil, sys, tempfile, time
+from .session_recorder import SessionRecorder
+from .nabbench import connect, run_nabd
+
+class SessionReplayer(object):
+  RESPONSE_TIMEOUT = 10.0
+
+  def __init__(self, session, fast=False):
+    self.fast = fast
+    self.origin = session[0][0] if len(session) > 0 else 0.0
+    self.connections = {}               # connection id -> [(time, kind, data)]
+    self.recorded = {}                  # (connection id, request_id) -> status
+    for (time, connection, kind, data) in session:
+      if connection == 0:
+        continue
+      self.connections.setdefault(connection, []).append((time, kind, data))
+      if kind == 'out' and SessionReplayer.is_response(data) and 'request_id' in data:
+        self.recorded[(connection, data['request_id'])] = data.get('status')
+    self.replayed = {}
+    self.sent = 0
+    self.responses = 0
+    self.timeouts = 0
+
+  @staticmethod
+  def is_response(packet):
+    return isinstance(packet, dict) and packet.get('type') == 'response'
+
+  async def replay(self, path=None, port=None):
+    """
+    Replay all connections and return the duration of the replay.
+    """
+    start = time.monotonic()
+    loop_start = asyncio.get_event_loop().time()
+    await asyncio.gather(*[self._replay_connection(connection, events, path, port, loop_start) for (connection, events) in self.connections.items()])
+    return time.monotonic() - start
+
+  async def _sleep_until(self, loop_start, event_time):
+    if not self.fast:
+      delay = loop_start + event_time - self.origin - asyncio.get_event_loop().time()
+      if delay > 0:
+        await asyncio.sleep(delay)
+
+  async def _replay_connection(self, connection, events, path, port, loop_start):
+    await self._sleep_until(loop_start, events[0][0])
+    (reader, writer) = await connect(path, port)
+    received = asyncio.Condition()
+    counter = [0]
+    async def read_responses():
+      while True:
+        line = await reader.readline()
+        if line == b'':
+          break
+        try:
+          packet = json.loads(line.decode('utf8'))
+        except (UnicodeDecodeError, json.decoder.JSONDecodeError):
+          continue
+        if SessionReplayer.is_response(packet):
+          self.responses = self.responses + 1
+          if 'request_id' in packet:
+            self.replayed[(connection, packet['request_id'])] = packet.get('status')
+          async with received:
+            counter[0] = counter[0] + 1
+            received.notify_all()
+    async def wait_responses(count):
+      async with received:
+        try:
+          await asyncio.wait_for(received.wait_for(lambda: counter[0] >= count), SessionReplayer.RESPONSE_TIMEOUT)
+        except asyncio.TimeoutError:
+          self.timeouts = self.timeouts + 1
+    reader_task = asyncio.ensure_future(read_responses())
+    expected = 0
+    try:
+      for (event_time, kind, data) in events:
+        if kind == 'out':
+          if SessionReplayer.is_response(data):
+            expected = expected + 1
+          continue
+        await self._sleep_until(loop_start, event_time)
+        if kind == 'in':
+          if self.fast:
+            await wait_responses(expected)
+          if isinstance(data, str):
+            line = data
+          else:
+            line = json.dumps(data)
+          writer.write((line + '\r\n').encode('utf8'))
+          self.sent = self.sent + 1
+        elif kind == 'close':
+          break
+      await wait_responses(expected)
+    finally:
+      writer.close()
+      await reader_task
+
+  def results(self, duration):
+    mismatches = []
+    for (key, status) in sorted(self.recorded.items()):
+      replayed = self.replayed.get(key)
+      if replayed != status:
+        mismatches.append({'connection': key[0], 'request_id': key[1], 'recorded': status, 'replayed': replayed})
+    return {
+      'connections': len(self.connections),
+      'sent': self.sent,
+      'responses': self.responses,
+      'timeouts': self.timeouts,
+      'duration': duration,
+      'mismatches': mismatches,
+    }
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Replay traffic recorded by nabd')
+  parser.add_argument('file', help='file written by nabd --record')
+  parser.add_argument('--session', type=int, default=-1, help='index of the session to replay (default = last)')
+  parser.add_argument('--fast', action='store_true', help='replay as fast as possible')
+  parser.add_argument('--port', type=int, help='replay to a running nabd on this port')
+  parser.add_argument('--nabio', choices=['sim', 'mock'], default='sim', help='rabbit of the in-process nabd')
+  parser.add_argument('--virtual-time', action='store_true', help='run the in-process nabd on virtual time')
+  parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+  args = parser.parse_args(argv)
+  sessions = SessionRecorder.load(args.file)
+  if len(sessions) == 0:
+    print('No session in {file}'.format(file=args.file))
+    exit(1)
+  replayer = SessionReplayer(sessions[args.session], args.fast)
+  if args.port != None:
+    loop = asyncio.new_event_loop()
+    try:
+      duration = loop.run_until_complete(replayer.replay(port=args.port))
+    finally:
+      loop.close()
+  else:
+    if args.nabio == 'mock':
+      from .tests.mock import NabIOMock
+      nabio = NabIOMock()
+    else:
+      from .nabio_sim import NabIOSim
+      nabio = NabIOSim()
+    tmpdir = tempfile.mkdtemp(prefix='nabreplay')
+    path = os.path.join(tmpdir, 'nabd.sock')
+    try:
+      duration = run_nabd(nabio, lambda nabd: replayer.replay(path=path), path=path, virtual_time=args.virtual_time)
+    finally:
+      shutil.rmtree(tmpdir, ignore_errors=True)
+  output = json.dumps(replayer.results(duration), indent=2, sort_keys=True)
+  if args.output != None:
+    with open(args.output, 'w') as f:
+      f.write(output + '\n')
+  else:
+    print(output)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -2,7 +2,7 @@ import json
 from snips_nlu import SnipsNLUEngine
 from pathlib import Path
 from nabweb import settings
-from concurrent.futures import ThreadPoolExecutor
+from .executors import registry, Lane
 import traceback
 
 class NLU:
@@ -17,7 +17,7 @@ class NLU:
   DEFAULT_LOCALE = 'fr_FR'
 
   def __init__(self, locale):
-    self.executor = ThreadPoolExecutor(max_workers=1)
+    self.executor = registry.lane('nlu', priority=Lane.PRIORITY_LOW)
     self._load_model(locale)
 
   def _load_model(self, locale):
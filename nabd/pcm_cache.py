@@ -0,0 +1,232 @@
+import os
+import json
+import mmap
+import wave
+import struct
+import audioop
+from pathlib import Path
+
+class PCMCache(object):
+  """
+  Raw PCM sound library, transcoded once to the native format of the sound
+  card and stored in a single file that can be memory-mapped.
+
+  Container layout:
+  - magic (8 bytes)
+  - length of the JSON header (4 bytes, little endian)
+  - JSON header with format and index
+  - padding to the next page boundary
+  - raw S16_LE samples, each entry starting at its index offset
+
+  The index is keyed by path relative to the base directory. Each entry
+  records the mtime and size of the source file so that stale entries are
+  ignored and the original file is played instead.
+  """
+  MAGIC = b'NABPCM01'
+  WIDTH = 2
+  ALIGNMENT = mmap.PAGESIZE
+  DEFAULT_FILENAME = 'sounds.pcm'
+  SOUND_SUFFIXES = ['.mp3', '.wav']
+
+  def __init__(self, path, base_dir, header, data):
+    self.path = path
+    self.base_dir = base_dir
+    self.rate = header['rate']
+    self.channels = header['channels']
+    self.index = header['index']
+    self.data = data
+
+  @staticmethod
+  def default_path():
+    from nabweb import settings
+    return os.path.join(settings.BASE_DIR, 'nabd', PCMCache.DEFAULT_FILENAME)
+
+  @staticmethod
+  def open(path, base_dir, rate=None, channels=None):
+    """
+    Open and map a container.
+    Return None if the file doesn't exist, is invalid or doesn't match the
+    requested format.
+    """
+    try:
+      with open(path, 'rb') as f:
+        if f.read(len(PCMCache.MAGIC)) != PCMCache.MAGIC:
+          print('Warning : invalid PCM cache {path}'.format(path=path))
+          return None
+        (header_len,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_len).decode('utf8'))
+        if (rate != None and header['rate'] != rate) or (channels != None and header['channels'] != channels):
+          return None
+        data_offset = header['data_offset']
+        f.seek(0, os.SEEK_END)
+        if f.tell() <= data_offset:
+          return PCMCache(path, base_dir, header, memoryview(b''))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(mapping)[data_offset:]
+        return PCMCache(path, base_dir, header, data)
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError, KeyError) as err:
+      print('Warning : could not open PCM cache {path} ({err})'.format(path=path, err=err))
+      return None
+
+  def lookup(self, filename):
+    """
+    Return a memoryview on the samples of a given sound file, or None if the
+    file is not in the cache or was modified since it was transcoded.
+    """
+    key = PCMCache._key(filename, self.base_dir)
+    if key not in self.index:
+      return None
+    entry = self.index[key]
+    try:
+      stat = os.stat(filename)
+    except OSError:
+      return None
+    if int(stat.st_mtime) != entry['mtime'] or stat.st_size != entry['size']:
+      return None
+    return self.data[entry['offset']:entry['offset'] + entry['length']]
+
+  def frame_size(self):
+    return self.channels * PCMCache.WIDTH
+
+  @staticmethod
+  def _key(filename, base_dir):
+    return Path(os.path.relpath(filename, base_dir)).as_posix()
+
+  @staticmethod
+  def sound_files(base_dir, apps):
+    """
+    Enumerate sound files of the library, i.e. files in sounds directories
+    of the given applications.
+    """
+    basepath = Path(base_dir)
+    for app in apps:
+      sounds_dir = basepath.joinpath(app, 'sounds')
+      if sounds_dir.is_dir():
+        for path in sorted(sounds_dir.rglob('*')):
+          if path.suffix in PCMCache.SOUND_SUFFIXES and path.is_file():
+            yield path.as_posix()
+
+  @staticmethod
+  def build(path, base_dir, filenames, rate, channels, progress_cb=None):
+    """
+    Transcode files and write a new container to path.
+    The container is written to a temporary file and renamed so that a
+    running nabd never sees a partial file.
+    Return the number of transcoded files.
+    """
+    index = {}
+    tmp_data_path = path + '.data.tmp'
+    offset = 0
+    with open(tmp_data_path, 'wb') as data_file:
+      for filename in filenames:
+        try:
+          stat = os.stat(filename)
+          length = 0
+          for chunk in PCMCache._transcode(filename, rate, channels):
+            data_file.write(chunk)
+            length = length + len(chunk)
+        except Exception as err:
+          print('Warning : could not transcode {f} ({err})'.format(f=filename, err=err))
+          data_file.seek(offset)
+          data_file.truncate()
+          continue
+        index[PCMCache._key(filename, base_dir)] = {
+          'offset': offset,
+          'length': length,
+          'mtime': int(stat.st_mtime),
+          'size': stat.st_size
+        }
+        offset = offset + length
+        if progress_cb:
+          progress_cb(filename)
+    header = {'rate': rate, 'channels': channels, 'index': index, 'data_offset': 0}
+    # data_offset depends on header length, which depends on data_offset:
+    # leave some room for its digits.
+    header_bytes = json.dumps(header).encode('utf8')
+    data_offset = PCMCache._align(len(PCMCache.MAGIC) + 4 + len(header_bytes) + 16)
+    header['data_offset'] = data_offset
+    header_bytes = json.dumps(header).encode('utf8')
+    tmp_path = path + '.tmp'
+    try:
+      with open(tmp_path, 'wb') as f:
+        f.write(PCMCache.MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(bytearray(data_offset - f.tell()))
+        with open(tmp_data_path, 'rb') as data_file:
+          while True:
+            buf = data_file.read(1024 * 1024)
+            if not buf:
+              break
+            f.write(buf)
+      os.replace(tmp_path, path)
+    finally:
+      os.remove(tmp_data_path)
+    return len(index)
+
+  @staticmethod
+  def _align(offset):
+    return ((offset + PCMCache.ALIGNMENT - 1) // PCMCache.ALIGNMENT) * PCMCache.ALIGNMENT
+
+  @staticmethod
+  def _transcode(filename, rate, channels):
+    """
+    Decode a file and convert it to S16_LE with given rate and channels.
+    Yield chunks of samples.
+    """
+    converter = _Converter(rate, channels)
+    if filename.endswith('.wav'):
+      with wave.open(filename, 'rb') as f:
+        converter.set_source_format(f.getframerate(), f.getnchannels(), f.getsampwidth())
+        while True:
+          data = f.readframes(4096)
+          if not data:
+            break
+          yield converter.convert(data)
+    elif filename.endswith('.mp3'):
+      from mpg123 import Mpg123
+      mp3 = Mpg123(filename)
+      src_rate, src_channels, encoding = mp3.get_format()
+      converter.set_source_format(src_rate, src_channels, mp3.get_width_by_encoding(encoding))
+      for frame in mp3.iter_frames():
+        yield converter.convert(frame)
+    else:
+      raise ValueError('Unsupported format')
+
+class _Converter(object):
+  """
+  Streaming sample format converter.
+  """
+  def __init__(self, rate, channels):
+    self.rate = rate
+    self.channels = channels
+    self.ratecv_state = None
+    self.remainder = b''
+
+  def set_source_format(self, rate, channels, width):
+    if channels not in [1, 2]:
+      raise ValueError('Unsupported number of channels {channels}'.format(channels=channels))
+    self.src_rate = rate
+    self.src_channels = channels
+    self.src_width = width
+    self.src_frame_size = channels * width
+
+  def convert(self, data):
+    data = self.remainder + bytes(data)
+    usable = len(data) - (len(data) % self.src_frame_size)
+    self.remainder = data[usable:]
+    data = data[:usable]
+    if self.src_width == 1:
+      # 8 bits samples are unsigned
+      data = audioop.bias(data, 1, -128)
+    if self.src_width != PCMCache.WIDTH:
+      data = audioop.lin2lin(data, self.src_width, PCMCache.WIDTH)
+    if self.src_rate != self.rate:
+      data, self.ratecv_state = audioop.ratecv(data, PCMCache.WIDTH, self.src_channels, self.src_rate, self.rate, self.ratecv_state)
+    if self.src_channels == 1 and self.channels == 2:
+      data = audioop.tostereo(data, PCMCache.WIDTH, 1, 1)
+    elif self.src_channels == 2 and self.channels == 1:
+      data = audioop.tomono(data, PCMCache.WIDTH, 0.5, 0.5)
+    return data
@@ -0,0 +1,88 @@
+import collections
+import threading
+import time
+
+class Preroll(object):
+  """
+  Hold recorded samples while the listen cue is playing.
+  Recording starts together with the cue so that the capture device is
+  ready when the cue ends and the start of an utterance is not lost.
+  When the end of the cue is known, held samples captured during the last
+  preroll_bytes before it, then after it, are forwarded to the stream
+  callback, so that an utterance started during the end of the cue is
+  recognized. Older samples are the cue itself, picked up by the
+  microphone, and are never forwarded. Samples are then forwarded as they
+  come.
+  At most hold_bytes are held, which bounds the samples captured before the
+  end of the cue is signaled that can be recovered.
+  """
+  def __init__(self, stream_cb, preroll_bytes, hold_bytes, sample_rate, sample_width, clock=time.monotonic):
+    self.stream_cb = stream_cb
+    self.preroll_bytes = preroll_bytes
+    self.hold_bytes = hold_bytes
+    self.sample_rate = sample_rate
+    self.sample_width = sample_width
+    self.clock = clock
+    self.lock = threading.Lock()
+    self.chunks = collections.deque()   # (data, capture end time)
+    self.size = 0
+    self.armed = True
+    self.forward_start = None
+
+  def feed(self, data, finalize):
+    """
+    Recording callback, invoked when a chunk was captured.
+    Thread: recording
+    """
+    captured = self.clock()
+    with self.lock:
+      if self.armed:
+        self._hold(bytes(data), captured)
+        if finalize:
+          # Recording stopped before the cue was over.
+          self.armed = False
+          self.chunks.clear()
+          self.size = 0
+          self.stream_cb(b'', True)
+      else:
+        self._forward(data, captured, finalize)
+
+  def release(self, cue_end):
+    """
+    Signal the cue ended at cue_end (on clock): forward held samples captured
+    after the start of the preroll and stop holding samples.
+    Thread: event loop
+    """
+    with self.lock:
+      if self.armed:
+        self.armed = False
+        self.forward_start = cue_end - self.preroll_bytes / (self.sample_rate * self.sample_width)
+        for (data, captured) in self.chunks:
+          self._forward(data, captured, False)
+        self.chunks.clear()
+        self.size = 0
+
+  def _hold(self, data, captured):
+    self.chunks.append((data, captured))
+    self.size = self.size + len(data)
+    while len(self.chunks) > 1 and self.size - len(self.chunks[0][0]) >= self.hold_bytes:
+      self.size = self.size - len(self.chunks.popleft()[0])
+
+  def _forward(self, data, captured, finalize):
+    skip = self._skipped_bytes(len(data), captured)
+    if skip < len(data) or finalize:
+      self.stream_cb(data[skip:], finalize)
+
+  def _skipped_bytes(self, length, captured):
+    """
+    Return the number of bytes at the start of a chunk captured before the
+    start of the preroll, rounded to whole samples.
+    """
+    if self.forward_start == None:
+      return 0
+    bytes_per_second = self.sample_rate * self.sample_width
+    start = captured - length / bytes_per_second
+    if start >= self.forward_start:
+      return 0
+    samples = -(-(self.forward_start - start) * self.sample_rate // 1)
+    return min(length, int(samples) * self.sample_width)
@@ -0,0 +1,69 @@
+import json
+from nabcommon.clock import Clock
+
+class SessionRecorder(object):
+  """
+  Append-only record of the traffic between nabd and services.
+  Each line is a JSON array [time, connection, kind, data] with time from
+  the monotonic clock, in seconds, and kind one of:
+  - 'session': nabd started, data is the wall clock date
+  - 'open': a service connected
+  - 'in': packet from the service (raw line if it was not valid JSON)
+  - 'out': packet to the service
+  - 'close': the service disconnected
+  Connection ids start at 1 for each session.
+  Lines are written as they happen, so that the record survives a crash.
+  """
+  def __init__(self, path, clock=Clock.REAL):
+    self.path = path
+    self.clock = clock
+    self.file = open(path, 'a', buffering=1)
+    self.connections = {}               # writer -> connection id
+    self.next_connection = 1
+    self._write(0, 'session', clock.now().isoformat())
+
+  def _write(self, connection, kind, data):
+    record = [round(self.clock.monotonic(), 6), connection, kind, data]
+    self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+  def open(self, writer):
+    connection = self.next_connection
+    self.next_connection = connection + 1
+    self.connections[writer] = connection
+    self._write(connection, 'open', None)
+
+  def inbound(self, writer, line):
+    try:
+      data = json.loads(line.decode('utf8'))
+    except (UnicodeDecodeError, json.decoder.JSONDecodeError):
+      data = line.decode('utf8', 'replace').rstrip('\r\n')
+    self._write(self.connections.get(writer, 0), 'in', data)
+
+  def outbound(self, writer, packet):
+    self._write(self.connections.get(writer, 0), 'out', packet)
+
+  def close(self, writer):
+    connection = self.connections.pop(writer, 0)
+    self._write(connection, 'close', None)
+
+  def stop(self):
+    self.file.close()
+
+  @staticmethod
+  def load(path):
+    """
+    Load a record, returning the list of sessions, each being a list of
+    (time, connection, kind, data) tuples.
+    A truncated last line (e.g. after a crash) is ignored.
+    """
+    sessions = []
+    with open(path) as f:
+      for line in f:
+        try:
+          (time, connection, kind, data) = json.loads(line)
+        except ValueError:
+          continue
+        if kind == 'session' or len(sessions) == 0:
+          sessions.append([])
+        sessions[-1].append((time, connection, kind, data))
+    return sessions
@@ -1,11 +1,39 @@
 import abc
 from .resources import Resources
+from .tts import TTS
+from .audio_stream import AudioStream
+from .tracing import tracer
 
 class Sound(object, metaclass=abc.ABCMeta):
   """ Interface for sound """
 
+  tts = None
+  pcm_cache = None
+  # time.monotonic() when the last sound was over, if known
+  playback_end = None
+
+  def get_tts(self):
+    """
+    Return the text-to-speech backend, if any is available.
+    """
+    if self.tts == None:
+      self.tts = TTS.default()
+    return self.tts
+
   async def preload(self, audio_resource):
-    # For now only consider local paths
+    with tracer.span('resolve', resource=audio_resource):
+      return await self._preload(audio_resource)
+
+  async def _preload(self, audio_resource):
+    if audio_resource.startswith(TTS.URN_PREFIX):
+      tts = self.get_tts()
+      if tts == None:
+        print('Warning : no text-to-speech backend for {r}'.format(r = audio_resource))
+        return None
+      return await tts.get(audio_resource)
+    if AudioStream.is_stream(audio_resource):
+      # Streams are opened when played.
+      return audio_resource
     file = Resources.find('sounds', audio_resource)
     if file != None:
       return file.as_posix()
@@ -52,7 +80,7 @@ class Sound(object, metaclass=abc.ABCMeta):
 
   async def start_recording(self, stream_cb):
     """
-    Start recording sound.
+    Start recording sound, possibly while a sound is playing.
     Invokes stream_cb repeatedly with recorded samples.
     """
     raise NotImplementedError( 'Should have implemented' )
@@ -2,22 +2,42 @@ import wave
 from mpg123 import Mpg123
 import alsaaudio
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import time
+from .executors import registry
 from .sound import Sound
 from .nabio import NabIO
+from .pcm_cache import PCMCache
+from .audio_stream import AudioStream
+from .tracing import tracer
+from .metrics import metrics
 import traceback
 
 class SoundAlsa(Sound):
   MODEL_2018_CARD_NAME = 'sndrpihifiberry'
   MODEL_2019_CARD_NAME = 'seeed2micvoicec'
 
+  # Native (rate, channels) of the cards, used for the transcoded PCM cache.
+  NATIVE_FORMATS = {
+    MODEL_2018_CARD_NAME: (44100, 2),
+    MODEL_2019_CARD_NAME: (48000, 2),
+  }
+
+  STREAM_BUFFER_DURATION = 4.0      # seconds of decoded audio buffered
+  STREAM_PREBUFFER_DURATION = 1.0   # seconds buffered before playback starts
+  STREAM_PREBUFFER_TIMEOUT = 10.0
+
+  stream_underruns_total = metrics.counter('nabd_stream_underruns_total', 'Underruns of the buffer of streamed audio')
+  stream_overruns_total = metrics.counter('nabd_stream_overruns_total', 'Overruns of the buffer of streamed audio')
+
   def __init__(self, hw_model):
     if hw_model == NabIO.MODEL_2018:
+      card_name = SoundAlsa.MODEL_2018_CARD_NAME
       self.playback_device = 'plughw:CARD=' + SoundAlsa.MODEL_2018_CARD_NAME
       self.playback_mixer = None
       self.record_device = 'null'
       self.record_mixer = None
     if hw_model == NabIO.MODEL_2019_TAG or hw_model == NabIO.MODEL_2019_TAGTAG:
+      card_name = SoundAlsa.MODEL_2019_CARD_NAME
       card_index = alsaaudio.cards().index(SoundAlsa.MODEL_2019_CARD_NAME)
       self.playback_device = 'plughw:CARD=' + SoundAlsa.MODEL_2019_CARD_NAME
       self.playback_mixer = alsaaudio.Mixer(control='Playback', cardindex=card_index)
@@ -27,10 +47,24 @@ class SoundAlsa(Sound):
       raise RuntimeError('Unable to configure sound card for playback')
     if self.record_device != 'null' and not SoundAlsa.test_device(self.record_device, True):
       raise RuntimeError('Unable to configure sound card for recording')
-    self.executor = ThreadPoolExecutor(max_workers=1)
+    self.executor = registry.lane('sound', dedicated=True, stuck_after=None)
     self.future = None
+    self.record_executor = registry.lane('record', dedicated=True, stuck_after=None)
+    self.record_future = None
     self.currently_playing = False
     self.currently_recording = False
+    self.pcm_cache = SoundAlsa.open_pcm_cache(card_name)
+    self.stream_stats = {'underruns': 0, 'overruns': 0}
+
+  @staticmethod
+  def open_pcm_cache(card_name):
+    """
+    Open the transcoded PCM cache if it exists and matches the card native
+    format (see manage.py transcodesounds).
+    """
+    from nabweb import settings
+    rate, channels = SoundAlsa.NATIVE_FORMATS[card_name]
+    return PCMCache.open(PCMCache.default_path(), settings.BASE_DIR, rate, channels)
 
   @staticmethod
   def sound_card():
@@ -86,8 +120,16 @@ class SoundAlsa(Sound):
 
   def _play(self, filename):
     try:
-      device = alsaaudio.PCM(device=self.playback_device)
-      if filename.endswith('.wav'):
+      with tracer.span('alsa_open', device=self.playback_device):
+        device = _TracedPCM(alsaaudio.PCM(device=self.playback_device), filename)
+      pcm = None
+      if self.pcm_cache:
+        pcm = self.pcm_cache.lookup(filename)
+      if pcm != None:
+        self._play_pcm(device, pcm)
+      elif AudioStream.is_stream(filename):
+        self._play_stream(device, filename)
+      elif filename.endswith('.wav'):
         with wave.open(filename, 'rb') as f:
           channels = f.getnchannels()
           width = f.getsampwidth()
@@ -133,7 +175,62 @@ class SoundAlsa(Sound):
           device.write(chunk)
     finally:
       self.currently_playing = False
+      # close drains the device, i.e. returns once the sound was played
       device.close()
+      self.playback_end = time.monotonic()
+
+  def _play_pcm(self, device, pcm):
+    """
+    Play samples from the PCM cache, in native format.
+    Thread: executor
+    """
+    rate = self.pcm_cache.rate
+    channels = self.pcm_cache.channels
+    self._setup_device(device, channels, rate, PCMCache.WIDTH)
+    periodsize = int(rate / 10) # 1/10th of second
+    device.setperiodsize(periodsize)
+    chunksize = periodsize * self.pcm_cache.frame_size()
+    for offset in range(0, len(pcm), chunksize):
+      if not self.currently_playing:
+        break
+      chunk = pcm[offset:offset + chunksize]
+      if len(chunk) < chunksize:
+        # ALSA device expects chunks of fixed period size
+        chunk = bytes(chunk) + bytearray(chunksize - len(chunk))
+      device.write(chunk)
+
+  def _play_stream(self, device, url):
+    """
+    Play a stream, decoded incrementally into a bounded buffer.
+    Thread: executor
+    """
+    stream = AudioStream(url, SoundAlsa.STREAM_BUFFER_DURATION, SoundAlsa.STREAM_PREBUFFER_DURATION)
+    stream.start()
+    try:
+      format = stream.wait_until_prebuffered(SoundAlsa.STREAM_PREBUFFER_TIMEOUT)
+      if format == None:
+        print('Warning : could not start stream {url}'.format(url=url))
+        return
+      (rate, channels, width) = format
+      self._setup_device(device, channels, rate, width)
+      periodsize = int(rate / 10) # 1/10th of second
+      device.setperiodsize(periodsize)
+      chunksize = periodsize * channels * width
+      while self.currently_playing:
+        chunk = stream.read(chunksize, 0.1)
+        if len(chunk) == 0:
+          break
+        if len(chunk) < chunksize:
+          # ALSA device expects chunks of fixed period size
+          chunk = chunk + bytearray(chunksize - len(chunk))
+        device.write(chunk)
+    finally:
+      stream.close()
+      stats = stream.stats()
+      self.stream_stats['underruns'] = self.stream_stats['underruns'] + stats['underruns']
+      self.stream_stats['overruns'] = self.stream_stats['overruns'] + stats['overruns']
+      SoundAlsa.stream_underruns_total.inc(stats['underruns'])
+      SoundAlsa.stream_overruns_total.inc(stats['overruns'])
 
   def _setup_device(self, device, channels, rate, width):
     # Set attributes
@@ -164,9 +261,9 @@ class SoundAlsa(Sound):
     self.future = None
 
   async def start_recording(self, stream_cb):
-    await self.stop_playing()
+    await self.stop_recording()
     self.currently_recording = True
-    self.future = asyncio.get_event_loop().run_in_executor(self.executor, lambda cb=stream_cb: self._record(cb))
+    self.record_future = asyncio.get_event_loop().run_in_executor(self.record_executor, lambda cb=stream_cb: self._record(cb))
 
   def _record(self, cb):
     inp = None
@@ -193,4 +290,25 @@ class SoundAlsa(Sound):
   async def stop_recording(self):
     if self.currently_recording:
       self.currently_recording = False
-    await self.wait_until_done()
+    if self.record_future:
+      await self.record_future
+    self.record_future = None
+
+class _TracedPCM(object):
+  """
+  PCM device proxy recording when the first sample of a sound is written.
+  Thread: sound
+  """
+  def __init__(self, device, filename):
+    self.device = device
+    self.filename = filename
+    self.written = False
+
+  def write(self, data):
+    if not self.written:
+      self.written = True
+      tracer.instant('first_sample', resource=self.filename)
+    return self.device.write(data)
+
+  def __getattr__(self, name):
+    return getattr(self.device, name)
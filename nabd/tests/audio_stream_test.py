@@ -0,0 +1,102 @@
+import unittest, threading, tempfile, os, io, wave, struct, http.server
+from nabd.audio_stream import RingBuffer, AudioStream
+
+class TestRingBuffer(unittest.TestCase):
+  def test_read_write(self):
+    ring = RingBuffer(8)
+    self.assertTrue(ring.write(b'abcdef'))
+    self.assertEqual(ring.read(4), b'abcd')
+    self.assertTrue(ring.write(b'ghijkl'))
+    self.assertEqual(ring.read(8), b'efghijkl')
+    self.assertEqual(ring.underruns, 0)
+    self.assertEqual(ring.overruns, 0)
+
+  def test_underrun(self):
+    ring = RingBuffer(8)
+    ring.write(b'ab')
+    self.assertEqual(ring.read(4, 0.01), b'ab\0\0')
+    self.assertEqual(ring.underruns, 1)
+
+  def test_overrun(self):
+    ring = RingBuffer(8)
+    ring.write(b'abcdef')
+    self.assertTrue(ring.write(b'ghij', 0.01))
+    self.assertEqual(ring.overruns, 1)
+    self.assertEqual(ring.read(8), b'cdefghij')
+
+  def test_end_of_stream(self):
+    ring = RingBuffer(8)
+    ring.write(b'abc')
+    ring.end_of_stream()
+    self.assertEqual(ring.read(4), b'abc')
+    self.assertEqual(ring.read(4), b'')
+    self.assertEqual(ring.underruns, 0)
+
+  def test_close_unblocks_producer(self):
+    ring = RingBuffer(4)
+    ring.write(b'abcd')
+    result = []
+    thread = threading.Thread(target = lambda: result.append(ring.write(b'efgh')))
+    thread.start()
+    ring.close()
+    thread.join(1)
+    self.assertEqual(result, [False])
+
+class WavHandler(http.server.BaseHTTPRequestHandler):
+  def do_GET(self):
+    self.send_response(200)
+    self.send_header('Content-Type', 'audio/wav')
+    self.end_headers()
+    self.wfile.write(self.server.wav_data)
+
+  def log_message(self, format, *args):
+    pass
+
+class TestAudioStream(unittest.TestCase):
+  def setUp(self):
+    samples = [(i * 37) % 32768 for i in range(16000)]
+    self.pcm = struct.pack('<%dh' % len(samples), *samples)
+    wav = io.BytesIO()
+    with wave.open(wav, 'wb') as f:
+      f.setnchannels(1)
+      f.setsampwidth(2)
+      f.setframerate(8000)
+      f.writeframes(self.pcm)
+    self.server = http.server.HTTPServer(('127.0.0.1', 0), WavHandler)
+    self.server.wav_data = wav.getvalue()
+    self.server_thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+    self.server_thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_is_stream(self):
+    self.assertTrue(AudioStream.is_stream('http://127.0.0.1/radio.mp3'))
+    self.assertTrue(AudioStream.is_stream('unix:/tmp/radio.sock'))
+    self.assertFalse(AudioStream.is_stream('nabclockd/0/1.mp3'))
+
+  def test_http_wav(self):
+    url = 'http://127.0.0.1:{port}/stream.wav'.format(port=self.server.server_address[1])
+    # Buffer is smaller than the stream (0.5 sec out of 2 secs)
+    stream = AudioStream(url, buffer_duration=0.5, prebuffer_duration=0.25)
+    stream.start()
+    self.assertEqual(stream.wait_until_prebuffered(5), (8000, 1, 2))
+    self.assertEqual(stream.ring.capacity, 8000)
+    data = b''
+    while True:
+      chunk = stream.read(1600, 1)
+      if len(chunk) == 0:
+        break
+      data = data + chunk
+    stream.close()
+    self.assertEqual(data, self.pcm)
+    self.assertEqual(stream.stats(), {'underruns': 0, 'overruns': 0})
+
+  def test_http_error(self):
+    url = 'http://127.0.0.1:{port}/stream.wav'.format(port=self.server.server_address[1])
+    self.server.wav_data = b''
+    stream = AudioStream(url)
+    stream.start()
+    self.assertEqual(stream.wait_until_prebuffered(5), None)
+    stream.close()
@@ -0,0 +1,46 @@
+import unittest, os, json, tempfile
+from nabd.benchmarks import suite, protocol_bench
+
+class TestBenchmarkSuite(unittest.TestCase):
+  def record(self, commit, date, results, lower_is_better=[], machine='armv7l', python='3.7.3'):
+    return {'commit': commit, 'date': date, 'machine': machine, 'python': python, 'results': results, 'lower_is_better': lower_is_better, 'skipped': {}}
+
+  def test_compare(self):
+    reference = self.record('a', '2026-01-01', {'leds': {'idle_cpu_percent': 1.0, 'idle_wakeups_per_s': 100.0}, 'protocol': {'dispatch_info_per_s': 1000.0}})
+    record = self.record('b', '2026-01-02', {'leds': {'idle_cpu_percent': 1.5, 'idle_wakeups_per_s': 95.0}, 'protocol': {'dispatch_info_per_s': 850.0, 'dispatch_ears_per_s': 10.0}}, ['leds.idle_cpu_percent', 'leds.idle_wakeups_per_s'])
+    changes = suite.compare(reference, record, 10.0)
+    self.assertEqual([(key, round(change, 1), regression) for (key, ref, value, change, regression) in changes], [
+      ('leds.idle_cpu_percent', -50.0, True),
+      ('leds.idle_wakeups_per_s', 5.0, False),
+      ('protocol.dispatch_info_per_s', -15.0, True),
+    ])
+
+  def test_find_reference(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      self.assertEqual(suite.find_reference(tmpdir, None, 'c'), None)
+      for (commit, date) in [('a1', '2026-01-02'), ('b2', '2026-01-01'), ('c3', '2026-01-03')]:
+        suite.save(self.record(commit, date, {}), tmpdir)
+      self.assertEqual(suite.find_reference(tmpdir, None, 'c3'), os.path.join(tmpdir, 'a1.json'))
+      self.assertEqual(suite.find_reference(tmpdir, 'b', 'c3'), os.path.join(tmpdir, 'b2.json'))
+      self.assertEqual(suite.find_reference(tmpdir, 'd', 'c3'), None)
+
+  def test_find_reference_same_environment(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      suite.save(self.record('a1', '2026-01-01', {}), tmpdir)
+      suite.save(self.record('b2', '2026-01-02', {}, machine='x86_64'), tmpdir)
+      suite.save(self.record('c3', '2026-01-03', {}, python='3.11.2'), tmpdir)
+      self.assertEqual(suite.environment(self.record('d4', '2026-01-04', {}, python='3.7.5')), ('armv7l', '3.7'))
+      self.assertEqual(suite.find_reference(tmpdir, None, 'd4', ('armv7l', '3.7')), os.path.join(tmpdir, 'a1.json'))
+      self.assertEqual(suite.find_reference(tmpdir, None, 'd4', ('aarch64', '3.7')), None)
+      # an explicit reference is used whatever its environment
+      self.assertEqual(suite.find_reference(tmpdir, 'b', 'd4', ('armv7l', '3.7')), os.path.join(tmpdir, 'b2.json'))
+
+  def test_run_protocol(self):
+    record = suite.run(['protocol'], quick=True)
+    self.assertEqual(sorted(record['results']['protocol']), sorted(
+      ['dispatch_{t}_per_s'.format(t=t) for t in protocol_bench.PACKETS] +
+      ['broadcast_{n}_writes_per_s'.format(n=n) for n in protocol_bench.FAN_OUTS]))
+    self.assertEqual(record['lower_is_better'], [])
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = suite.save(record, tmpdir)
+      self.assertEqual(suite.load(path)['results'], json.loads(json.dumps(record['results'])))
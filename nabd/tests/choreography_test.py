@@ -1,4 +1,5 @@
-import unittest, asyncio, base64, re, pytest
+import unittest, asyncio, base64, re, pytest, os, tempfile
+from pathlib import Path
 from mock import EarsMock, LedsMock, SoundMock
 from nabd.choreography import ChoreographyInterpreter
 
@@ -109,6 +110,130 @@ class TestChoreographyInterpreter(unittest.TestCase):
     self.assertEqual(self.ears.called_list, [])
     self.assertEqual(self.sound.called_list, [])
 
+class TestChoreographyCompiler(unittest.TestCase):
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.leds = LedsMock()
+    self.ears = EarsMock()
+    self.sound = SoundMock()
+    self.ci = ChoreographyInterpreter(self.leds, self.ears, self.sound)
+
+  def test_compile(self):
+    chor = base64.b16decode("0007020304050607000A02")
+    ops = ChoreographyInterpreter.compile(chor)
+    self.assertEqual(ops, [
+      (0, ChoreographyInterpreter.set_led_color, (2, 3, 4, 5, 6, 7)),
+      (0, ChoreographyInterpreter.set_led_off, (2,)),
+      (0, None, ())])
+
+  def test_compile_ifne(self):
+    # ifne 1, +3 ; set_led_off 2 ; set_led_off 3
+    chor = base64.b16decode("0012010003000A02000A03")
+    ops = ChoreographyInterpreter.compile(chor)
+    self.assertEqual(ops[0], (0, ChoreographyInterpreter.ifne, (1, 2)))
+    self.assertEqual(ops[2][1:], (ChoreographyInterpreter.set_led_off, (3,)))
+    self.ci.taichi_random = 1
+    self.loop.run_until_complete(self.ci.play_compiled(ops, 0))
+    self.assertEqual(self.leds.called_list, ['set1(2,0,0,0)', 'set1(3,0,0,0)'])
+    self.leds.called_list = []
+    self.ci.taichi_random = 0
+    self.loop.run_until_complete(self.ci.play_compiled(ops, 0))
+    self.assertEqual(self.leds.called_list, ['set1(3,0,0,0)'])
+
+  def test_compile_backward_jump(self):
+    # set_led_off 1 ; ifne 0, -8 ; set_led_off 2
+    chor = base64.b16decode("000A01001200FFF8000A02")
+    ops = ChoreographyInterpreter.compile(chor)
+    self.assertEqual(ops[1], (0, ChoreographyInterpreter.ifne, (0, 0)))
+    self.ci.taichi_random = 0
+    self.loop.run_until_complete(self.ci.play_compiled(ops, 0))
+    self.assertEqual(self.leds.called_list, ['set1(1,0,0,0)', 'set1(2,0,0,0)'])
+
+  def test_load_cache(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, 'test.chor')
+      with open(path, 'wb') as f:
+        f.write(base64.b16decode("000A02"))
+      ops1 = ChoreographyInterpreter.load(path)
+      ops2 = ChoreographyInterpreter.load(path)
+      self.assertIs(ops1, ops2)
+      with open(path, 'wb') as f:
+        f.write(base64.b16decode("000A03"))
+      os.utime(path, (0, 0))
+      ops3 = ChoreographyInterpreter.load(path)
+      self.assertEqual(ops3[0], (0, ChoreographyInterpreter.set_led_off, (3,)))
+
+  def test_compile_taichi(self):
+    file = Path(__file__).parents[2].joinpath('nabtaichid', 'choreographies', 'nabtaichid', 'taichi.chor')
+    ops = ChoreographyInterpreter.compile(file.read_bytes())
+    self.assertTrue(len(ops) > 0)
+    self.assertEqual(ops[-1][1], None)
+    for (wait, handler, args) in ops:
+      if handler is ChoreographyInterpreter.ifne or handler is ChoreographyInterpreter.jump:
+        self.assertTrue(0 <= args[-1] < len(ops))
+
+class FrameLedsMock(LedsMock):
+  def begin_frame(self):
+    self.called_list.append('begin_frame()')
+
+  def commit_frame(self):
+    self.called_list.append('commit_frame()')
+
+class TestChoreographyFrames(unittest.TestCase):
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.leds = FrameLedsMock()
+    self.ears = EarsMock()
+    self.sound = SoundMock()
+    self.ci = ChoreographyInterpreter(self.leds, self.ears, self.sound)
+
+  def test_frames(self):
+    # Two leds set in a first frame, one led set in a second frame.
+    chor = base64.b16decode("000A01000A02" + "010A03")
+    self.loop.run_until_complete(self.ci.play_binary(chor, timescale=1))
+    self.assertEqual(self.leds.called_list, [
+      'begin_frame()', 'set1(1,0,0,0)', 'set1(2,0,0,0)', 'commit_frame()',
+      'begin_frame()', 'set1(3,0,0,0)', 'commit_frame()'])
+
+class LateScheduler(object):
+  """
+  Scheduler reporting given lateness for successive frames.
+  """
+  def __init__(self, lateness):
+    self.lateness = lateness
+
+  def start(self):
+    pass
+
+  async def wait(self, delay):
+    return self.lateness.pop(0)
+
+class TestLateFrames(unittest.TestCase):
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.leds = LedsMock()
+    self.ears = EarsMock()
+    self.sound = SoundMock()
+    self.ci = ChoreographyInterpreter(self.leds, self.ears, self.sound)
+
+  def test_skip_late_led_frames(self):
+    # Four frames setting led 1 to 1, 2, 3 and 4, the second and third being late.
+    chor = base64.b16decode("0107010100000000" + "0107010200000000" + "0107010300000000" + "0107010400000000")
+    self.ci.scheduler = LateScheduler([0.0, 1.0, 1.0, 0.0])
+    self.loop.run_until_complete(self.ci.play_binary(chor, timescale=10))
+    self.assertEqual(self.leds.called_list, ['set1(1,1,0,0)', 'set1(1,3,0,0)', 'set1(1,4,0,0)'])
+    self.assertIs(self.ci.leds, self.leds)
+
+  def test_flush_at_end(self):
+    chor = base64.b16decode("0107010100000000" + "0107010200000000" + "0107010300000000")
+    self.ci.scheduler = LateScheduler([0.0, 1.0, 1.0])
+    self.loop.run_until_complete(self.ci.play_binary(chor, timescale=10))
+    self.assertEqual(self.leds.called_list, ['set1(1,1,0,0)', 'set1(1,3,0,0)'])
+    self.assertIs(self.ci.leds, self.leds)
+
 @pytest.mark.django_db
 class TestStreamingChoregraphy(unittest.TestCase):
   def setUp(self):
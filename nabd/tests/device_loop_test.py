@@ -0,0 +1,98 @@
+import unittest, asyncio, threading, time
+from nabd.device_loop import DeviceLoop, NabIODeviceLoop
+from nabd.tests.mock import NabIOMock
+
+class TestDeviceLoop(unittest.TestCase):
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.device = DeviceLoop()
+    self.device.start()
+
+  def tearDown(self):
+    self.device.stop()
+    self.loop.close()
+    asyncio.set_event_loop(None)
+
+  def test_run(self):
+    async def device_thread():
+      await asyncio.sleep(0)
+      return threading.current_thread().name
+    name = self.loop.run_until_complete(self.device.run(device_thread()))
+    self.assertEqual(name, DeviceLoop.THREAD_NAME)
+    self.assertFalse(self.device.in_thread())
+
+  def test_cancel(self):
+    cancelled = threading.Event()
+    async def long_operation():
+      try:
+        await asyncio.sleep(10)
+      except asyncio.CancelledError:
+        cancelled.set()
+        raise
+    async def cancel_after_start():
+      task = asyncio.ensure_future(self.device.run(long_operation()))
+      await asyncio.sleep(0.1)
+      task.cancel()
+      try:
+        await task
+      except asyncio.CancelledError:
+        pass
+    self.loop.run_until_complete(cancel_after_start())
+    self.assertTrue(cancelled.wait(1.0))
+
+  def test_call_sync(self):
+    self.assertEqual(self.device.call_sync(lambda: threading.current_thread().name), DeviceLoop.THREAD_NAME)
+
+class TestNabIODeviceLoop(unittest.TestCase):
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.mock = NabIOMock()
+    self.device = DeviceLoop()
+    self.device.start()
+    self.nabio = NabIODeviceLoop(self.device, self.mock)
+
+  def tearDown(self):
+    self.nabio.stop()
+    self.loop.close()
+    asyncio.set_event_loop(None)
+
+  def test_play_info_notified(self):
+    condvar = asyncio.Condition()
+    async def play():
+      async with condvar:
+        start = time.time()
+        await self.nabio.play_info(condvar, 10, [{'left': 'ff0000'}], 10.0)
+        self.assertTrue(condvar.locked())
+        return time.time() - start
+    async def notify():
+      await asyncio.sleep(0.1)
+      async with condvar:
+        condvar.notify()
+    (elapsed, _) = self.loop.run_until_complete(asyncio.gather(play(), notify()))
+    self.assertLess(elapsed, 1.0)
+    self.assertEqual(self.mock.played_infos, [{'tempo': 10, 'colors': [{'left': 'ff0000'}]}])
+
+  def test_play_info_duration(self):
+    condvar = asyncio.Condition()
+    async def play():
+      async with condvar:
+        await self.nabio.play_info(condvar, 10, [], 0.1)
+    self.loop.run_until_complete(asyncio.wait_for(play(), 1.0))
+
+  def test_events_forwarded(self):
+    events = []
+    def callback(event, event_time):
+      events.append((event, threading.current_thread().name))
+    self.nabio.bind_button_event(self.loop, callback)
+    self.assertEqual(self.mock.button_event_cb['loop'], self.device.loop)
+    self.device.call(self.mock.button_event_cb['callback'], 'click', 0)
+    self.loop.run_until_complete(asyncio.sleep(0.1))
+    self.assertEqual(events, [('click', threading.current_thread().name)])
+
+  def test_commands(self):
+    self.nabio.set_leds(None, None, (255, 0, 0), None, None)
+    self.loop.run_until_complete(self.nabio.move_ears(3, 4))
+    self.assertEqual(self.mock.called_list, ['move_ears(3, 4)'])
+    self.assertEqual(self.mock.center_led, (255, 0, 0))
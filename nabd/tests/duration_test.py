@@ -0,0 +1,66 @@
+import unittest, base64, os, tempfile, wave
+from pathlib import Path
+from nabd.duration import DurationEstimator
+from nabd.choreography import ChoreographyInterpreter
+
+class TestDurationEstimator(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def write_wav(self, name, seconds, rate=22050):
+    path = os.path.join(self.tmpdir.name, name)
+    with wave.open(path, 'wb') as f:
+      f.setnchannels(1)
+      f.setsampwidth(2)
+      f.setframerate(rate)
+      f.writeframes(bytes(int(seconds * rate) * 2))
+    return path
+
+  def test_wav(self):
+    path = self.write_wav('test.wav', 1.5)
+    self.assertAlmostEqual(DurationEstimator.wav_duration(path), 1.5)
+
+  def test_mp3(self):
+    # 10 MPEG1 layer III frames, 128 kbps, 44.1 kHz, after an ID3v2 tag
+    frame = b'\xFF\xFB\x90\x00' + bytes(417 - 4)
+    path = os.path.join(self.tmpdir.name, 'test.mp3')
+    with open(path, 'wb') as f:
+      f.write(b'ID3\x04\x00\x00\x00\x00\x00\x05' + bytes(5))
+      f.write(frame * 10)
+    self.assertAlmostEqual(DurationEstimator.mp3_duration(path), 10 * 1152 / 44100)
+
+  def test_mp3_sounds(self):
+    path = Path(__file__).parents[1].joinpath('sounds', 'asr', 'listen.mp3')
+    duration = DurationEstimator.mp3_duration(path.as_posix())
+    self.assertTrue(0.1 < duration < 10)
+
+  def test_ops_duration(self):
+    # frame_duration 10 ; set_led_off 1 after 5 ticks ; set_led_off 2 after 20 ticks
+    chor = base64.b16decode("00010A" + "050A01" + "140A02")
+    ops = ChoreographyInterpreter.compile(chor)
+    self.assertAlmostEqual(DurationEstimator.ops_duration(ops), 0.25)
+
+  def test_ops_duration_ifne(self):
+    # frame_duration 10 ; set_led_off 1 after 5 ticks ; ifne 0, back to set_led_off
+    chor = base64.b16decode("00010A" + "050A01" + "001200FFF8")
+    ops = ChoreographyInterpreter.compile(chor)
+    self.assertAlmostEqual(DurationEstimator.ops_duration(ops), 0.05)
+
+  def test_sequence_cache(self):
+    path = self.write_wav('test.wav', 2.0)
+    estimator = DurationEstimator()
+    self.assertAlmostEqual(estimator.sequence_duration([{'audio': [path, path]}]), 4.0)
+    self.assertEqual(len(estimator.cache), 1)
+    self.write_wav('test.wav', 1.0)
+    os.utime(path, (0, 0))
+    self.assertAlmostEqual(estimator.sequence_duration([{'audio': [path]}]), 1.0)
+
+  def test_unknown_durations(self):
+    estimator = DurationEstimator()
+    self.assertEqual(estimator.sequence_duration([{'audio': ['tts:fr_FR,bonjour']}]), None)
+    self.assertEqual(estimator.sequence_duration([{'audio': ['http://localhost/stream.mp3']}]), None)
+    self.assertEqual(estimator.sequence_duration([{'choreography': ChoreographyInterpreter.STREAMING_URN}]), None)
+    self.assertEqual(estimator.message_duration({}, [{'choreography': ChoreographyInterpreter.STREAMING_URN}]), 0.0)
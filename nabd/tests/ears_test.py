@@ -0,0 +1,28 @@
+import unittest, os, tempfile
+from nabd.ears import Ears
+
+class TestEars(unittest.TestCase):
+  def test_shortest_direction(self):
+    self.assertEqual(Ears.shortest_direction(0, 3), (3, Ears.FORWARD_DIRECTION))
+    self.assertEqual(Ears.shortest_direction(3, 0), (0, Ears.BACKWARD_DIRECTION))
+    self.assertEqual(Ears.shortest_direction(1, 16), (16, Ears.BACKWARD_DIRECTION))
+    self.assertEqual(Ears.shortest_direction(16, 1), (1, Ears.FORWARD_DIRECTION))
+    self.assertEqual(Ears.shortest_direction(5, 5), (5, Ears.FORWARD_DIRECTION))
+    self.assertEqual(Ears.shortest_direction(5, 5 + Ears.STEPS), (5, Ears.FORWARD_DIRECTION))
+    # 8 steps forward, 9 steps backward
+    self.assertEqual(Ears.shortest_direction(0, 8), (8, Ears.FORWARD_DIRECTION))
+    self.assertEqual(Ears.shortest_direction(0, 9), (9, Ears.BACKWARD_DIRECTION))
+
+  def test_positions_file(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, 'nabd', 'ears.json')
+      self.assertEqual(Ears.consume_positions_file(path), None)
+      self.assertTrue(Ears.write_positions_file(path, [3, 16]))
+      self.assertEqual(Ears.consume_positions_file(path), [3, 16])
+      # file is consumed
+      self.assertFalse(os.path.exists(path))
+      self.assertEqual(Ears.consume_positions_file(path), None)
+      with open(path, 'w') as f:
+        f.write('{"left": 3, "right": 17}')
+      self.assertEqual(Ears.consume_positions_file(path), None)
+      self.assertFalse(os.path.exists(path))
@@ -0,0 +1,56 @@
+import unittest
+from nabd.encoder_telemetry import EncoderTelemetry
+
+MS = 1000000
+
+class TestEncoderTelemetry(unittest.TestCase):
+  def record_turn(self, telemetry, ear, start, step=200 * MS, gap=450 * MS):
+    """
+    Record a complete forward turn: 16 steps and the missing hole.
+    """
+    telemetry.start_move(ear)
+    timestamp = start
+    for i in range(17):
+      telemetry.record(ear, 1, timestamp)
+      if i == 5:
+        timestamp = timestamp + gap
+      else:
+        timestamp = timestamp + step
+    return timestamp
+
+  def test_ring(self):
+    telemetry = EncoderTelemetry(4)
+    for i in range(6):
+      telemetry.record(i % 2, 1, i)
+    self.assertEqual(telemetry.events(), [(2, 0, 1), (3, 1, 1), (4, 0, 1), (5, 1, 1)])
+
+  def test_intervals_within_moves(self):
+    telemetry = EncoderTelemetry()
+    telemetry.start_move(0)
+    telemetry.record(0, 1, 0)
+    telemetry.record(1, 0, 50)       # user moved the other ear
+    telemetry.record(0, 1, 100)
+    telemetry.start_move(0)
+    telemetry.record(0, -1, 10000)
+    telemetry.record(0, -1, 10300)
+    telemetry.record(0, 0, 20000)     # user moved the ear
+    self.assertEqual(telemetry.intervals(0), [100, 300])
+    self.assertEqual(telemetry.intervals(1), [])
+
+  def test_stats(self):
+    telemetry = EncoderTelemetry()
+    self.record_turn(telemetry, 0, 0)
+    telemetry.move_timed_out(1)
+    stats = telemetry.stats(0.4)
+    self.assertEqual(stats[0]['steps'], 15)
+    self.assertEqual(stats[0]['gaps'], 1)
+    self.assertAlmostEqual(stats[0]['steps_per_second'], 5.0)
+    self.assertAlmostEqual(stats[0]['max_step_interval'], 0.2)
+    self.assertAlmostEqual(stats[0]['min_gap_interval'], 0.45)
+    # gap is closer to the threshold than steps
+    self.assertAlmostEqual(stats[0]['gap_confidence'], 0.125)
+    self.assertAlmostEqual(stats[0]['suggested_missing_hole_delay'], 0.325)
+    self.assertEqual(stats[0]['timed_out_moves'], 0)
+    self.assertEqual(stats[1]['steps_per_second'], None)
+    self.assertEqual(stats[1]['gap_confidence'], None)
+    self.assertEqual(stats[1]['timed_out_moves'], 1)
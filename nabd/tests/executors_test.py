@@ -0,0 +1,124 @@
+import unittest, unittest.mock, threading, time, asyncio
+from nabd.executors import ExecutorRegistry, Lane
+
+class TestExecutorRegistry(unittest.TestCase):
+  def test_lane_order_and_stats(self):
+    registry = ExecutorRegistry()
+    lane = registry.lane('test')
+    self.assertIs(registry.lane('test'), lane)
+    results = []
+    futures = [lane.submit(results.append, i) for i in range(10)]
+    for future in futures:
+      future.result(1.0)
+    self.assertEqual(results, list(range(10)))
+    stats = registry.stats()['test']
+    self.assertEqual(stats['submitted'], 10)
+    self.assertEqual(stats['completed'], 10)
+    self.assertEqual(stats['queue_depth'], 0)
+    self.assertEqual(stats['running'], 0)
+
+  def test_exception(self):
+    registry = ExecutorRegistry()
+    lane = registry.lane('test')
+    future = lane.submit(lambda: 1 / 0)
+    with self.assertRaises(ZeroDivisionError):
+      future.result(1.0)
+    self.assertEqual(lane.stats()['failed'], 1)
+
+  def test_bounded_lane(self):
+    registry = ExecutorRegistry(shared_workers=4)
+    lane = registry.lane('test', max_workers=2)
+    lock = threading.Lock()
+    state = {'running': 0, 'max': 0}
+    def task():
+      with lock:
+        state['running'] = state['running'] + 1
+        state['max'] = max(state['max'], state['running'])
+      time.sleep(0.02)
+      with lock:
+        state['running'] = state['running'] - 1
+    futures = [lane.submit(task) for i in range(8)]
+    for future in futures:
+      future.result(2.0)
+    self.assertEqual(state['max'], 2)
+    self.assertTrue(lane.stats()['max_wait_time'] > 0)
+
+  def test_priority(self):
+    registry = ExecutorRegistry(shared_workers=1)
+    low = registry.lane('low', priority=Lane.PRIORITY_LOW)
+    high = registry.lane('high', priority=Lane.PRIORITY_HIGH)
+    order = []
+    blocker = threading.Event()
+    first = low.submit(blocker.wait)
+    time.sleep(0.05)
+    # both queued while the single shared worker is busy
+    low_future = registry.lane('low2', priority=Lane.PRIORITY_LOW).submit(order.append, 'low')
+    high_future = high.submit(order.append, 'high')
+    blocker.set()
+    for future in [first, low_future, high_future]:
+      future.result(1.0)
+    self.assertEqual(order, ['high', 'low'])
+    self.assertEqual(len(registry.shared_threads), 1)
+
+  def test_dedicated_lane(self):
+    registry = ExecutorRegistry(stack_size=256 * 1024)
+    lane = registry.lane('sound', dedicated=True)
+    name = lane.submit(lambda: threading.current_thread().name).result(1.0)
+    self.assertEqual(name, 'sound-0')
+    lane.shutdown()
+    with self.assertRaises(RuntimeError):
+      lane.submit(print)
+
+  def test_invalid_stack_size(self):
+    registry = ExecutorRegistry()
+    with self.assertRaises(ValueError):
+      registry.set_stack_size(16 * 1024)
+    self.assertEqual(registry.stack_size, None)
+    registry.set_stack_size(256 * 1024)
+    self.assertEqual(registry.stack_size, 256 * 1024)
+    self.assertEqual(threading.stack_size(), 0)
+
+  def test_report_stuck_tasks(self):
+    registry = ExecutorRegistry()
+    lane = registry.lane('test', stuck_after=0.05)
+    for attempt in range(2):
+      blocker = threading.Event()
+      future = lane.submit(blocker.wait)
+      time.sleep(0.1)
+      with unittest.mock.patch('builtins.print') as mock_print:
+        registry.report_stuck_tasks()
+        registry.report_stuck_tasks()
+      # each stuck task is reported once, including later stalls of the same function
+      self.assertEqual(mock_print.call_count, 1)
+      blocker.set()
+      future.result(1.0)
+      registry.report_stuck_tasks()
+      self.assertEqual(registry.reported, set())
+
+  def test_run_in_executor(self):
+    registry = ExecutorRegistry()
+    lane = registry.lane('test')
+    loop = asyncio.new_event_loop()
+    try:
+      self.assertEqual(loop.run_until_complete(loop.run_in_executor(lane, sum, [1, 2])), 3)
+    finally:
+      loop.close()
+
+  def test_stuck_tasks(self):
+    registry = ExecutorRegistry()
+    lane = registry.lane('test', stuck_after=0.05)
+    never = registry.lane('stream', stuck_after=None)
+    blocker = threading.Event()
+    future = lane.submit(blocker.wait)
+    never_future = never.submit(blocker.wait)
+    time.sleep(0.1)
+    stuck = registry.stuck_tasks()
+    self.assertEqual(len(stuck), 1)
+    (lane_name, description, age) = stuck[0]
+    self.assertEqual(lane_name, 'test')
+    self.assertTrue(description.endswith('wait'))
+    self.assertEqual(registry.diagnostics()['stuck'][0]['lane'], 'test')
+    blocker.set()
+    future.result(1.0)
+    never_future.result(1.0)
+    self.assertEqual(registry.stuck_tasks(), [])
@@ -0,0 +1,55 @@
+import unittest, asyncio
+from nabd.frame_scheduler import FrameScheduler, LatenessHistogram
+
+class FakeClock(object):
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+class TestLatenessHistogram(unittest.TestCase):
+  def test_record(self):
+    histogram = LatenessHistogram()
+    histogram.record(0.0)
+    histogram.record(0.003)
+    histogram.record(0.003)
+    histogram.record(2.0)
+    stats = histogram.stats()
+    self.assertEqual(stats['frames'], 4)
+    self.assertEqual(stats['lateness_ms']['1'], 1)
+    self.assertEqual(stats['lateness_ms']['5'], 2)
+    self.assertEqual(stats['lateness_ms']['+Inf'], 1)
+    self.assertEqual(stats['max_lateness_ms'], 2000.0)
+
+class TestFrameScheduler(unittest.TestCase):
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+
+  def tearDown(self):
+    self.loop.close()
+
+  def test_no_drift(self):
+    clock = FakeClock()
+    histogram = LatenessHistogram()
+    scheduler = FrameScheduler(histogram, clock)
+    scheduler.start()
+    # Frame is 30ms late
+    clock.now = clock.now + 0.130
+    lateness = self.loop.run_until_complete(scheduler.wait(0.1))
+    self.assertAlmostEqual(lateness, 0.030)
+    # Next frame is still scheduled 100ms after the first one, not after
+    # the late frame.
+    clock.now = clock.now + 0.070
+    lateness = self.loop.run_until_complete(scheduler.wait(0.1))
+    self.assertAlmostEqual(lateness, 0.0)
+    self.assertEqual(histogram.count, 2)
+
+  def test_sleep(self):
+    scheduler = FrameScheduler()
+    scheduler.start()
+    start = self.loop.time()
+    lateness = self.loop.run_until_complete(scheduler.wait(0.05))
+    self.assertTrue(self.loop.time() - start >= 0.04)
+    self.assertTrue(lateness < 0.05)
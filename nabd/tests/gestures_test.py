@@ -0,0 +1,151 @@
+import unittest, asyncio, time
+from nabd.gestures import GestureRecognizer
+
+class EdgeReplayer(object):
+  """
+  Replay edges to a recognizer in real time and record emitted events with
+  their latency, i.e. the delay between when the event should have been
+  emitted and when it was.
+  """
+  def __init__(self, loop, timeouts=GestureRecognizer.TIMEOUTS, processing_delay=0.0):
+    self.loop = loop
+    self.timeouts = timeouts
+    self.processing_delay = processing_delay
+    self.events = []
+    self.recognizer = GestureRecognizer(loop, self._callback, timeouts=timeouts)
+
+  def _callback(self, event, event_time):
+    self.events.append((event, time.monotonic()))
+
+  def replay(self, edges, settle=0.3):
+    """
+    edges is a list of (offset, 'down' or 'up'), offsets in seconds.
+    Edges are delivered processing_delay after they occurred.
+    Return the list of (event, latency) tuples, latency being None for
+    unexpected events.
+    """
+    start = time.monotonic()
+    for (offset, edge) in edges:
+      self.loop.call_later(offset + self.processing_delay, self.recognizer.edge, edge == 'down', start + offset)
+    duration = edges[-1][0] + self.processing_delay + settle
+    self.loop.run_until_complete(asyncio.sleep(duration))
+    expected = EdgeReplayer.expected_events(edges, self.recognizer.gestures, self.timeouts)
+    result = []
+    for index, (event, emitted) in enumerate(self.events):
+      latency = None
+      if index < len(expected) and expected[index][0] == event:
+        latency = emitted - (start + expected[index][1])
+      result.append((event, latency))
+    return result
+
+  @staticmethod
+  def expected_events(edges, gestures, timeouts):
+    """
+    Reference model of the recognizer: compute the events and when they
+    should be emitted, as (event, offset) tuples.
+    """
+    events = []
+    state = GestureRecognizer.INITIAL_STATE
+    button_state = 'up'
+    deadline = None
+    for (offset, edge) in edges + [(float('inf'), None)]:
+      if deadline != None and deadline[0] <= offset:
+        events.append((deadline[1], deadline[0]))
+        state = GestureRecognizer.INITIAL_STATE
+        deadline = None
+      if edge == None or edge == button_state:
+        continue
+      button_state = edge
+      deadline = None
+      events.append((edge, offset))
+      transition = gestures[state].get(edge)
+      if transition == None:
+        continue
+      (state, gesture, timeout, timeout_gesture) = transition
+      if gesture != None:
+        events.append((gesture, offset))
+      if timeout != None:
+        deadline = (offset + timeouts[timeout], timeout_gesture)
+    return events
+
+class TestGestureRecognizer(unittest.TestCase):
+  MAX_LATENCY = 0.05
+
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+
+  def tearDown(self):
+    self.loop.close()
+    asyncio.set_event_loop(None)
+
+  def assertEvents(self, result, events):
+    self.assertEqual([event for (event, latency) in result], events)
+    for (event, latency) in result:
+      self.assertNotEqual(latency, None, event)
+      self.assertLess(abs(latency), TestGestureRecognizer.MAX_LATENCY, event)
+
+  def test_click(self):
+    replayer = EdgeReplayer(self.loop)
+    result = replayer.replay([(0, 'down'), (0.05, 'up')])
+    self.assertEvents(result, ['down', 'up', 'click'])
+
+  def test_double_click(self):
+    replayer = EdgeReplayer(self.loop)
+    result = replayer.replay([(0, 'down'), (0.05, 'up'), (0.1, 'down'), (0.15, 'up')])
+    self.assertEvents(result, ['down', 'up', 'down', 'up', 'double_click'])
+
+  def test_triple_click(self):
+    replayer = EdgeReplayer(self.loop)
+    result = replayer.replay([(0, 'down'), (0.05, 'up'), (0.1, 'down'), (0.15, 'up'), (0.2, 'down'), (0.25, 'up')])
+    self.assertEvents(result, ['down', 'up', 'down', 'up', 'down', 'up', 'triple_click'])
+
+  def test_click_and_hold(self):
+    timeouts = dict(GestureRecognizer.TIMEOUTS, click_and_hold=0.3)
+    replayer = EdgeReplayer(self.loop, timeouts)
+    result = replayer.replay([(0, 'down'), (0.05, 'up'), (0.1, 'down'), (0.6, 'up')])
+    self.assertEvents(result, ['down', 'up', 'down', 'click_and_hold', 'up'])
+    replayer = EdgeReplayer(self.loop)
+    result = replayer.replay([(0, 'down'), (0.05, 'up'), (0.1, 'down'), (0.15, 'up'), (0.2, 'down'), (0.5, 'up')])
+    self.assertEvents(result, ['down', 'up', 'down', 'up', 'down', 'click_and_hold', 'up'])
+
+  def test_hold_configured_timeout(self):
+    timeouts = dict(GestureRecognizer.TIMEOUTS, hold=0.2)
+    replayer = EdgeReplayer(self.loop, timeouts)
+    result = replayer.replay([(0, 'down'), (0.4, 'up')])
+    self.assertEvents(result, ['down', 'hold', 'up'])
+
+  def test_repeated_edges_ignored(self):
+    replayer = EdgeReplayer(self.loop)
+    result = replayer.replay([(0, 'down'), (0.01, 'down'), (0.05, 'up'), (0.06, 'up')])
+    self.assertEvents(result, ['down', 'up', 'click'])
+
+  def test_timeout_from_edge_time(self):
+    # Timeouts run from when the edge occurred: an edge processed late does
+    # not delay the gesture.
+    timeouts = dict(GestureRecognizer.TIMEOUTS, hold=0.2)
+    replayer = EdgeReplayer(self.loop, timeouts, processing_delay=0.1)
+    result = replayer.replay([(0, 'down'), (0.4, 'up')])
+    self.assertEqual([event for (event, latency) in result], ['down', 'hold', 'up'])
+    (event, hold_latency) = result[1]
+    self.assertLess(abs(hold_latency), TestGestureRecognizer.MAX_LATENCY)
+
+  def test_custom_gestures(self):
+    # single state machine: any press is a click
+    gestures = {'idle': {'down': ('idle', 'click', None, None)}}
+    events = []
+    recognizer = GestureRecognizer(self.loop, lambda event, t: events.append(event), gestures=gestures)
+    now = time.monotonic()
+    recognizer.edge(True, now)
+    recognizer.edge(False, now)
+    self.assertEqual(events, ['down', 'click', 'up'])
+
+  def test_model_timeouts(self):
+    GestureRecognizer.MODEL_TIMEOUTS[42] = {'hold': 1.0}
+    try:
+      timeouts = GestureRecognizer.model_timeouts(42)
+      self.assertEqual(timeouts['hold'], 1.0)
+      self.assertEqual(timeouts['double_click'], GestureRecognizer.TIMEOUTS['double_click'])
+    finally:
+      del GestureRecognizer.MODEL_TIMEOUTS[42]
+    self.assertEqual(GestureRecognizer.model_timeouts(42), GestureRecognizer.TIMEOUTS)
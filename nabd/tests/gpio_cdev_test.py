@@ -0,0 +1,193 @@
+import unittest, asyncio, os, tempfile, time
+from nabd.gpio_cdev import LineEvents
+from nabd.ears import Ears
+from nabd.ears_cdev import EarsCdev
+from nabd.button_cdev import ButtonCdev
+from nabd.nabio import NabIO
+from nabd.tests.mock import GPIOChipMock, LineEventsMock
+
+MS = 1000000
+
+class GPIOCdevTestCase(unittest.TestCase):
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.positions_file = Ears.POSITIONS_FILE
+    Ears.POSITIONS_FILE = os.path.join(self.tmpdir.name, 'ears.json')
+    self.chip = GPIOChipMock()
+
+  def tearDown(self):
+    Ears.POSITIONS_FILE = self.positions_file
+    for line in self.chip.events.values():
+      line.close()
+    self.tmpdir.cleanup()
+    self.loop.close()
+    asyncio.set_event_loop(None)
+
+class TestLineEvents(GPIOCdevTestCase):
+  def test_partial_reads(self):
+    line = LineEventsMock()
+    self.chip.events[0] = line
+    events = []
+    line.watch(self.loop, lambda timestamp_ns, edge: events.append((timestamp_ns, edge)))
+    data = LineEvents.pack_event(1000, LineEvents.RISING_EDGE) + LineEvents.pack_event(2000, LineEvents.FALLING_EDGE)
+    os.write(line.write_fd, data[:20])
+    self.loop.run_until_complete(asyncio.sleep(0.01))
+    self.assertEqual(events, [(1000, LineEvents.RISING_EDGE)])
+    os.write(line.write_fd, data[20:])
+    self.loop.run_until_complete(asyncio.sleep(0.01))
+    self.assertEqual(events, [(1000, LineEvents.RISING_EDGE), (2000, LineEvents.FALLING_EDGE)])
+    line.unwatch()
+
+  def test_realtime_timestamps(self):
+    # kernels before 5.7 stamp events with CLOCK_REALTIME
+    line = LineEventsMock()
+    self.chip.events[0] = line
+    events = []
+    line.watch(self.loop, lambda timestamp_ns, edge: events.append(timestamp_ns))
+    line.emit(time.time_ns() - 100 * MS, LineEvents.RISING_EDGE)
+    line.emit(time.monotonic_ns() - 100 * MS, LineEvents.RISING_EDGE)
+    self.loop.run_until_complete(asyncio.sleep(0.01))
+    now = time.monotonic_ns()
+    for timestamp_ns in events:
+      self.assertTrue(now - 200 * MS < timestamp_ns < now - 100 * MS)
+    line.unwatch()
+
+  def test_to_monotonic_ns(self):
+    self.assertEqual(LineEvents.to_monotonic_ns(1000, 5000, 1600000000 * 10**9), 1000)
+    self.assertEqual(LineEvents.to_monotonic_ns(1600000000 * 10**9 - 1000, 5000, 1600000000 * 10**9), 4000)
+
+class TestEarsCdev(GPIOCdevTestCase):
+  def emit_risings(self, ear, timestamps):
+    line = self.chip.events[EarsCdev.ENCODERS_LINES[ear]]
+    for timestamp_ns in timestamps:
+      line.emit(timestamp_ns, LineEvents.RISING_EDGE)
+
+  def test_go(self):
+    Ears.write_positions_file(Ears.POSITIONS_FILE, [0, 0])
+    ears = EarsCdev(self.chip)
+    ears.on_move(self.loop, lambda ear: None)
+    outputs = self.chip.outputs[0]
+    async def go():
+      await ears.go(Ears.LEFT_EAR, 3, Ears.FORWARD_DIRECTION)
+      self.assertEqual(outputs.values, [1, 0, 0, 0, 1, 1])
+      start = time.monotonic_ns()
+      self.emit_risings(Ears.LEFT_EAR, [start + i * 100 * MS for i in range(3)])
+      await asyncio.wait_for(ears.wait_while_running(), 1.0)
+    self.loop.run_until_complete(go())
+    self.assertEqual(outputs.values, [0, 0, 0, 0, 1, 1])
+    self.assertEqual(ears.positions, [3, 0])
+    self.assertEqual(ears.position_errors, 0)
+
+  def test_positions_file_invalidated_by_move(self):
+    Ears.write_positions_file(Ears.POSITIONS_FILE, [0, 0])
+    ears = EarsCdev(self.chip)
+    ears.on_move(self.loop, lambda ear: None)
+    ears.save_positions()
+    self.assertTrue(os.path.exists(Ears.POSITIONS_FILE))
+    async def go():
+      await ears.go(Ears.LEFT_EAR, 1, Ears.FORWARD_DIRECTION)
+      self.assertFalse(os.path.exists(Ears.POSITIONS_FILE))
+      self.emit_risings(Ears.LEFT_EAR, [time.monotonic_ns()])
+      await asyncio.wait_for(ears.wait_while_running(), 1.0)
+    self.loop.run_until_complete(go())
+    self.assertEqual(ears.positions, [1, 0])
+    self.assertFalse(os.path.exists(Ears.POSITIONS_FILE))
+
+  def test_positions_file_invalidated_by_hand(self):
+    Ears.write_positions_file(Ears.POSITIONS_FILE, [0, 0])
+    ears = EarsCdev(self.chip)
+    moved = []
+    ears.on_move(self.loop, moved.append)
+    ears.directions = [0, 0]
+    ears.save_positions()
+    self.assertTrue(os.path.exists(Ears.POSITIONS_FILE))
+    self.emit_risings(Ears.RIGHT_EAR, [time.monotonic_ns()])
+    self.loop.run_until_complete(asyncio.sleep(0.01))
+    self.assertEqual(moved, [Ears.RIGHT_EAR])
+    self.assertFalse(os.path.exists(Ears.POSITIONS_FILE))
+
+  def test_detection_from_timestamps(self):
+    ears = EarsCdev(self.chip)
+    ears.on_move(self.loop, lambda ear: None)
+    async def detect():
+      task = asyncio.ensure_future(ears.detect_positions())
+      await asyncio.sleep(0.01)
+      start = time.monotonic_ns()
+      # left ear passes the missing hole at its 6th step and goes back to
+      # its initial position, 12
+      left = [start + i * 100 * MS for i in range(5)] + [start + 1000 * MS + i * 100 * MS for i in range(12)]
+      self.emit_risings(Ears.LEFT_EAR, left)
+      # right ear passes the missing hole at its first step and goes back to
+      # its initial position, 0
+      right = [start + 500 * MS + i * 100 * MS for i in range(17)]
+      self.emit_risings(Ears.RIGHT_EAR, right)
+      return await asyncio.wait_for(task, 1.0)
+    positions = self.loop.run_until_complete(detect())
+    self.assertEqual(list(positions), [12, 0])
+    self.assertEqual(ears.running, [False, False])
+
+  def test_stalled_move_realtime_timestamps(self):
+    Ears.write_positions_file(Ears.POSITIONS_FILE, [0, 0])
+    ears = EarsCdev(self.chip)
+    ears.STALL_TIMEOUT = 0.1
+    ears.on_move(self.loop, lambda ear: None)
+    async def go():
+      await ears.go(Ears.RIGHT_EAR, 3, Ears.FORWARD_DIRECTION)
+      self.emit_risings(Ears.RIGHT_EAR, [time.time_ns()])
+      await asyncio.wait_for(ears.wait_while_running(), 1.0)
+    self.loop.run_until_complete(go())
+    self.assertEqual(ears.running, [False, False])
+    self.assertEqual(ears.positions, [0, None])
+
+  def test_stalled_move(self):
+    Ears.write_positions_file(Ears.POSITIONS_FILE, [0, 0])
+    ears = EarsCdev(self.chip)
+    ears.STALL_TIMEOUT = 0.1
+    ears.on_move(self.loop, lambda ear: None)
+    async def go():
+      await ears.go(Ears.RIGHT_EAR, 3, Ears.FORWARD_DIRECTION)
+      self.emit_risings(Ears.RIGHT_EAR, [time.monotonic_ns()])
+      await asyncio.wait_for(ears.wait_while_running(), 1.0)
+    self.loop.run_until_complete(go())
+    self.assertEqual(ears.running, [False, False])
+    self.assertEqual(ears.positions, [0, None])
+    diagnostics = ears.diagnostics()
+    self.assertEqual(diagnostics['encoders'][Ears.RIGHT_EAR]['timed_out_moves'], 1)
+    self.assertEqual(ears.telemetry.events()[0][1:], (Ears.RIGHT_EAR, 1))
+
+class TestButtonCdev(GPIOCdevTestCase):
+  def setUp(self):
+    super().setUp()
+    self.button = ButtonCdev(NabIO.MODEL_2019_TAGTAG, self.chip)
+    self.line = self.chip.events[ButtonCdev.BUTTON_LINE_2019]
+    self.events = []
+    self.button.on_event(self.loop, lambda event, time: self.events.append(event))
+
+  def test_click(self):
+    now = time.monotonic_ns()
+    self.line.emit(now, LineEvents.FALLING_EDGE)
+    self.line.emit(now + 50 * MS, LineEvents.RISING_EDGE)
+    self.loop.run_until_complete(asyncio.sleep(0.3))
+    self.assertEqual(self.events, ['down', 'up', 'click'])
+
+  def test_double_click(self):
+    now = time.monotonic_ns()
+    self.line.emit(now, LineEvents.FALLING_EDGE)
+    self.line.emit(now + 50 * MS, LineEvents.RISING_EDGE)
+    self.line.emit(now + 100 * MS, LineEvents.FALLING_EDGE)
+    self.line.emit(now + 150 * MS, LineEvents.RISING_EDGE)
+    self.loop.run_until_complete(asyncio.sleep(0.3))
+    self.assertEqual(self.events, ['down', 'up', 'down', 'up', 'double_click'])
+
+  def test_hold_from_realtime_edge_timestamp(self):
+    self.line.emit(time.time_ns() - 1900 * MS, LineEvents.FALLING_EDGE)
+    self.loop.run_until_complete(asyncio.sleep(0.3))
+    self.assertEqual(self.events, ['down', 'hold'])
+
+  def test_hold_from_edge_timestamp(self):
+    # hold timeout runs from the kernel timestamp of the edge
+    self.line.emit(time.monotonic_ns() - 1900 * MS, LineEvents.FALLING_EDGE)
+    self.loop.run_until_complete(asyncio.sleep(0.3))
+    self.assertEqual(self.events, ['down', 'hold'])
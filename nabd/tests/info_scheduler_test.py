@@ -0,0 +1,62 @@
+import unittest
+from nabd.info_scheduler import InfoScheduler
+
+WEATHER = {'tempo': 25, 'colors': [{'left': 'ffff00', 'center': 'ffff00', 'right': 'ffff00'}, {'left': '000000', 'center': '000000', 'right': '000000'}]}
+MAIL = {'tempo': 25, 'colors': [{'left': 'ff0000'}]}
+AIR = {'tempo': 30, 'colors': [{'right': '00ff00'}, {'right': '000000'}, {}]}
+CLOCK = {'tempo': 25, 'colors': [{'center': '0000ff'}, {}, {}]}
+
+class TestInfoScheduler(unittest.TestCase):
+  def setUp(self):
+    self.scheduler = InfoScheduler()
+
+  def test_dedup(self):
+    self.assertTrue(self.scheduler.update('weather', WEATHER))
+    self.assertFalse(self.scheduler.update('weather', dict(WEATHER)))
+    self.assertTrue(self.scheduler.update('weather', WEATHER, 1))
+    self.assertTrue(self.scheduler.remove('weather'))
+    self.assertFalse(self.scheduler.remove('weather'))
+    self.assertEqual(self.scheduler.next_slot(), None)
+
+  def test_single(self):
+    self.scheduler.update('weather', WEATHER)
+    self.assertEqual(self.scheduler.next_slot(), (25, WEATHER['colors'], InfoScheduler.DEFAULT_DWELL))
+
+  def test_composite(self):
+    self.scheduler.update('mail', MAIL, dwell=5.0)
+    self.scheduler.update('clock', CLOCK)
+    self.assertEqual(self.scheduler.slots(), [['mail', 'clock']])
+    (tempo, colors, dwell) = self.scheduler.next_slot()
+    self.assertEqual(tempo, 25)
+    self.assertEqual(dwell, InfoScheduler.DEFAULT_DWELL)
+    self.assertEqual(colors, [
+      {'left': 'ff0000', 'center': '0000ff'},
+      {'left': 'ff0000', 'center': None},
+      {'left': 'ff0000', 'center': None}])
+
+  def test_no_composite(self):
+    self.scheduler.update('weather', WEATHER)
+    self.scheduler.update('mail', MAIL)
+    self.scheduler.update('air', AIR)
+    # weather uses all leds, air has another tempo
+    self.assertEqual(self.scheduler.slots(), [['weather'], ['mail'], ['air']])
+
+  def test_priority(self):
+    self.scheduler.update('weather', WEATHER)
+    self.scheduler.update('air', AIR, priority=1)
+    self.assertEqual(self.scheduler.slots(), [['air'], ['weather']])
+
+  def test_rotation(self):
+    self.scheduler.update('weather', WEATHER)
+    self.scheduler.update('mail', MAIL)
+    self.scheduler.update('air', AIR)
+    # last changed info first, then rotation
+    self.assertEqual(self.scheduler.next_slot()[0], 30)
+    self.assertEqual(self.scheduler.last_slot, ['air'])
+    self.scheduler.next_slot()
+    self.assertEqual(self.scheduler.last_slot, ['weather'])
+    self.scheduler.next_slot()
+    self.assertEqual(self.scheduler.last_slot, ['mail'])
+    self.scheduler.update('weather', {'tempo': 25, 'colors': [{}]})
+    self.scheduler.next_slot()
+    self.assertEqual(self.scheduler.last_slot, ['weather', 'mail'])
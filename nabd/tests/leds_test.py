@@ -1,5 +1,5 @@
 import unittest, time
-from nabd.leds import Leds, LedsSoft
+from nabd.leds import Leds, LedsSoft, LedTimeline
 
 class LedsInterface(LedsSoft):
   def __init__(self):
@@ -29,6 +29,58 @@ class TestLeds(unittest.TestCase):
     time.sleep(0.1)
     self.assertEqual(self.leds.calls, [('do_set', 0, 10, 20, 30), ('do_set', 1, 10, 20, 30), ('do_set', 2, 10, 20, 30), ('do_set', 3, 10, 20, 30), ('do_set', 4, 10, 20, 30), 'do_show'])
 
+  def test_frame(self):
+    self.leds.begin_frame()
+    self.leds.set1(0, 10, 20, 30)
+    time.sleep(0.1)
+    self.assertEqual(self.leds.calls, [])
+    self.leds.begin_frame()
+    self.leds.set1(1, 10, 20, 30)
+    self.leds.commit_frame()
+    self.leds.setall(1, 2, 3)
+    time.sleep(0.1)
+    self.assertEqual(self.leds.calls, [])
+    self.leds.commit_frame()
+    time.sleep(0.1)
+    self.assertEqual(self.leds.calls, [('do_set', 0, 1, 2, 3), ('do_set', 1, 1, 2, 3), ('do_set', 2, 1, 2, 3), ('do_set', 3, 1, 2, 3), ('do_set', 4, 1, 2, 3), 'do_show'])
+
+  def test_unchanged(self):
+    self.leds.set1(0, 10, 20, 30)
+    time.sleep(0.1)
+    self.leds.set1(0, 10, 20, 30)
+    time.sleep(0.1)
+    self.assertEqual(self.leds.calls, [('do_set', 0, 10, 20, 30), 'do_show'])
+
+  def test_pulse_waveform(self):
+    self.assertEqual(self.leds.pulse_waveform(10, 20, 30)[:3], [(0, 0, 0), (1, 2, 3), (2, 4, 6)])
+    self.assertEqual(LedsSoft.waveform_runs([(0, 0, 0), (0, 0, 0), (1, 0, 0), (0, 0, 0)]), [2, 1, 1, 3])
+
+  def test_timeline_period(self):
+    with self.assertRaises(ValueError):
+      LedTimeline([(0, [])])
+    with self.assertRaises(ValueError):
+      LedTimeline([])
+
+  def test_timeline_frame_at(self):
+    timeline = LedTimeline([(0.1, []), (0.2, []), (0.1, [])])
+    self.assertEqual(timeline.frame_at(0.0)[0], 0)
+    self.assertEqual(timeline.frame_at(0.15)[0], 1)
+    self.assertEqual(timeline.frame_at(0.35)[0], 2)
+    (index, delay) = timeline.frame_at(0.45)
+    self.assertEqual(index, 0)
+    self.assertAlmostEqual(delay, 0.05)
+
+  def test_timeline(self):
+    timeline = LedTimeline([(0.2, [(1, (10, 0, 0)), (2, (0, 10, 0))]), (0.2, [(1, (0, 0, 10)), (2, (0, 10, 0))])])
+    self.leds.play_timeline(timeline)
+    time.sleep(0.5)
+    self.leds.stop_timeline()
+    time.sleep(0.5)
+    self.assertEqual(self.leds.calls, [
+      ('do_set', 1, 10, 0, 0), ('do_set', 2, 0, 10, 0), 'do_show',
+      ('do_set', 1, 0, 0, 10), 'do_show',
+      ('do_set', 1, 10, 0, 0), 'do_show'])
+
   def test_pulse(self):
     self.leds.pulse(0, 10, 20, 30)
     time.sleep(8)
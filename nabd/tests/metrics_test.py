@@ -0,0 +1,110 @@
+import unittest, asyncio, json, os, tempfile
+from nabd import nabbench
+from nabd.nabio_sim import NabIOSim
+from nabd.metrics import MetricsRegistry, Histogram, metrics
+
+class TestMetrics(unittest.TestCase):
+  def setUp(self):
+    self.registry = MetricsRegistry()
+
+  def test_counter(self):
+    counter = self.registry.counter('packets_total', 'Packets', ['type'])
+    counter.inc(type='info')
+    counter.inc(type='info')
+    counter.inc(3, type='command')
+    self.assertIs(self.registry.counter('packets_total', 'Packets', ['type']), counter)
+    self.assertEqual(self.registry.snapshot()['packets_total'], {'type': 'counter', 'help': 'Packets', 'values': [
+      {'labels': {'type': 'command'}, 'value': 3},
+      {'labels': {'type': 'info'}, 'value': 2},
+    ]})
+
+  def test_gauge_function(self):
+    depth = [4]
+    self.registry.gauge('depth', 'Depth', function=lambda: {(): depth[0]})
+    depth[0] = 5
+    self.assertEqual(self.registry.snapshot()['depth']['values'], [{'labels': {}, 'value': 5}])
+    self.registry.gauge('depth', 'Depth', function=lambda: {(): 7})
+    self.assertEqual(self.registry.snapshot()['depth']['values'], [{'labels': {}, 'value': 7}])
+
+  def test_histogram(self):
+    histogram = self.registry.histogram('latency_seconds', 'Latency', bounds=[0.01, 0.1, 1.0])
+    for value in [0.005, 0.05, 0.05, 0.5, 2.0]:
+      histogram.observe(value)
+    [value] = self.registry.snapshot()['latency_seconds']['values']
+    self.assertEqual(value['count'], 5)
+    self.assertAlmostEqual(value['sum'], 2.605)
+    self.assertEqual(value['buckets'], {'0.01': 1, '0.1': 2, '1.0': 1, '+Inf': 1})
+    self.assertEqual(value['p50'], 0.1)
+    self.assertEqual(value['p95'], None)
+    self.assertEqual(Histogram('empty', 'Empty').snapshot()['values'], [])
+
+  def test_prometheus(self):
+    self.registry.counter('packets_total', 'Packets', ['type']).inc(type='in"fo')
+    histogram = self.registry.histogram('latency_seconds', 'Latency', bounds=[0.1, 1.0])
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    self.assertEqual(self.registry.prometheus(), '\n'.join([
+      '# HELP latency_seconds Latency',
+      '# TYPE latency_seconds histogram',
+      'latency_seconds_bucket{le="0.1"} 1',
+      'latency_seconds_bucket{le="1.0"} 2',
+      'latency_seconds_bucket{le="+Inf"} 2',
+      'latency_seconds_sum 0.55',
+      'latency_seconds_count 2',
+      '# HELP packets_total Packets',
+      '# TYPE packets_total counter',
+      'packets_total{type="in\\"fo"} 1',
+    ]) + '\n')
+
+  def test_serve_prometheus(self):
+    self.registry.counter('packets_total', 'Packets').inc()
+    loop = asyncio.new_event_loop()
+    async def scrape():
+      server = await self.registry.serve_prometheus(0)
+      port = server.sockets[0].getsockname()[1]
+      (reader, writer) = await asyncio.open_connection('localhost', port)
+      writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+      response = await reader.read()
+      writer.close()
+      server.close()
+      await server.wait_closed()
+      return response.decode('utf8')
+    try:
+      response = loop.run_until_complete(scrape())
+    finally:
+      loop.close()
+    self.assertTrue(response.startswith('HTTP/1.0 200 OK\r\n'))
+    self.assertTrue(response.endswith('\r\n\r\n# HELP packets_total Packets\n# TYPE packets_total counter\npackets_total 1\n'))
+
+class TestNabdStats(unittest.TestCase):
+  def setUp(self):
+    metrics.reset()
+
+  def test_stats_packet(self):
+    responses = {}
+    async def client(path):
+      (reader, writer) = await nabbench.connect(path)
+      async def request(packet):
+        writer.write((json.dumps(packet) + '\r\n').encode('utf8'))
+        while True:
+          response = json.loads((await reader.readline()).decode('utf8'))
+          if response['type'] == 'response' and response.get('request_id') == packet['request_id']:
+            return response
+      await request({'type':'command', 'request_id':'cmd', 'sequence':[{'audio':[nabbench.SOUND]}]})
+      await request({'type':'info', 'request_id':'info', 'info_id':'test', 'animation':{'tempo':25, 'colors':[{'left':'ff0000'}]}})
+      await request({'type':'unknown', 'request_id':'unknown'})
+      responses['stats'] = await request({'type':'stats', 'request_id':'stats'})
+      writer.close()
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, 'nabd.sock')
+      nabbench.run_nabd(NabIOSim(), lambda nabd: client(path), path=path, virtual_time=True)
+    stats = responses['stats']['stats']
+    packets = {value['labels']['type']: value['value'] for value in stats['nabd_packets_total']['values']}
+    self.assertEqual(packets, {'command': 1, 'info': 1, 'unknown': 1, 'stats': 1})
+    latency = {value['labels']['type']: value for value in stats['nabd_response_latency_seconds']['values']}
+    self.assertEqual(sorted(latency), ['command', 'info', 'unknown'])
+    self.assertAlmostEqual(latency['command']['sum'], 0.552, 3)
+    self.assertEqual(stats['nabd_queue_age_seconds']['values'][0]['count'], 1)
+    self.assertEqual(stats['nabd_queue_depth']['values'], [{'labels': {}, 'value': 0}])
+    self.assertEqual(stats['nabd_services']['values'], [{'labels': {}, 'value': 1}])
+    self.assertIn('nabd_choreography_lateness_seconds', stats)
@@ -1,8 +1,10 @@
 import asyncio
+import os
 from nabd.nabio import NabIO
 from nabd.ears import Ears
 from nabd.leds import Leds
 from nabd.sound import Sound
+from nabd.gpio_cdev import LineEvents
 
 class NabIOMock(NabIO):
   def __init__(self):
@@ -54,10 +56,10 @@ class NabIOMock(NabIO):
   def bind_ears_event(self, loop, callback):
     self.ears_event_cb = {'callback': callback, 'loop': loop}
 
-  async def play_info(self, condvar, tempo, colors):
+  async def play_info(self, condvar, tempo, colors, duration=NabIO.INFO_LOOP_LENGTH):
     self.played_infos.append({'tempo':tempo, 'colors': colors})
     try:
-      await asyncio.wait_for(condvar.wait(), NabIO.INFO_LOOP_LENGTH)
+      await asyncio.wait_for(condvar.wait(), duration)
     except asyncio.TimeoutError:
       pass
 
@@ -136,3 +138,46 @@ class SoundMock(Sound):
 
   async def stop_playing(self):
     self.called_list.append('stop()')
+
+class GPIOChipMock(object):
+  """
+  GPIO character device double: event lines are pipes fed by the test.
+  """
+  def __init__(self):
+    self.events = {}
+    self.outputs = []
+
+  def request_events(self, offset, edges, label):
+    line = LineEventsMock()
+    self.events[offset] = line
+    return line
+
+  def request_outputs(self, offsets, default_values, label):
+    handle = LineHandleMock(offsets, default_values)
+    self.outputs.append(handle)
+    return handle
+
+class LineEventsMock(LineEvents):
+  def __init__(self):
+    (read_fd, self.write_fd) = os.pipe()
+    super().__init__(read_fd)
+
+  def emit(self, timestamp_ns, edge):
+    os.write(self.write_fd, LineEvents.pack_event(timestamp_ns, edge))
+
+  def close(self):
+    super().close()
+    os.close(self.write_fd)
+
+class LineHandleMock(object):
+  def __init__(self, offsets, default_values):
+    self.offsets = list(offsets)
+    self.values = list(default_values)
+    self.history = [list(default_values)]
+
+  def set_values(self, values):
+    self.values = list(values)
+    self.history.append(list(values))
+
+  def value(self, offset):
+    return self.values[self.offsets.index(offset)]
@@ -0,0 +1,34 @@
+import unittest, os, tempfile
+from nabd import nabbench
+from nabd.nabbench import NabBench
+from nabd.nabio_sim import NabIOSim
+
+class TestNabBench(unittest.TestCase):
+  def test_parse_mix(self):
+    self.assertEqual(nabbench.parse_mix('info:4,command'), [('info', 4), ('command', 1)])
+    with self.assertRaises(ValueError):
+      nabbench.parse_mix('unknown:1')
+
+  def test_percentiles(self):
+    stats = nabbench.percentiles([i / 1000.0 for i in range(1, 101)])
+    self.assertEqual(stats['count'], 100)
+    self.assertAlmostEqual(stats['p50'], 50.0)
+    self.assertAlmostEqual(stats['p95'], 95.0)
+    self.assertAlmostEqual(stats['p99'], 99.0)
+    self.assertAlmostEqual(stats['max'], 100.0)
+    self.assertEqual(nabbench.percentiles([]), None)
+
+  def check_results(self, results, packets):
+    self.assertEqual(results['packets'], packets)
+    self.assertEqual(results['errors'], 0)
+    self.assertEqual(results['response_latency_ms']['all']['count'], packets)
+    self.assertEqual(results['start_latency_ms']['command']['count'], results['response_latency_ms']['command']['count'])
+
+  def test_tcp(self):
+    bench = NabBench(2, 10, nabbench.parse_mix(nabbench.DEFAULT_MIX), port=nabbench.free_port())
+    self.check_results(bench.run(NabIOSim(), virtual_time=True), 20)
+
+  def test_unix(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      bench = NabBench(3, 5, nabbench.parse_mix('command:1,message:1'), path=os.path.join(tmpdir, 'nabd.sock'))
+      self.check_results(bench.run(NabIOSim(), virtual_time=True), 15)
@@ -1,5 +1,6 @@
 import unittest, threading, time, asyncio, socket, json, io, pytest
 from nabd import nabd
+from nabcommon.clock import VirtualTimeEventLoop
 from mock import NabIOMock
 
 class SocketIO(io.RawIOBase):
@@ -19,9 +20,13 @@ class SocketIO(io.RawIOBase):
     return self.sock.settimeout(timeout)
 
 class TestNabd(unittest.TestCase):
+  """
+  Nabd runs on a virtual time loop: time only moves when tests call advance.
+  """
   def nabd_thread_loop(self, kwargs):
-    nabd_loop = asyncio.new_event_loop()
+    nabd_loop = VirtualTimeEventLoop(auto_advance=False)
     asyncio.set_event_loop(nabd_loop)
+    self.nabd_loop = nabd_loop
     self.nabd = nabd.Nabd(self.nabio)
     with self.nabd_cv:
       self.nabd_cv.notify()
@@ -35,12 +40,20 @@ class TestNabd(unittest.TestCase):
       self.nabd_thread = threading.Thread(target = self.nabd_thread_loop, args = [self])
       self.nabd_thread.start()
       self.nabd_cv.wait()
-    time.sleep(1) # make sure Nabd was started
+    self.advance(1) # make sure Nabd was started
 
   def tearDown(self):
+    # let remaining tasks complete without waiting
+    self.nabd_loop.release()
     self.nabd.stop()
     self.nabd_thread.join(5)
 
+  def advance(self, delay):
+    """
+    Advance virtual time of Nabd and wait until it is idle.
+    """
+    self.nabd_loop.advance(delay)
+
   def test_init(self):
     self.assertEqual(self.nabio.left_ear, 0)
     self.assertEqual(self.nabio.right_ear, 0)
@@ -140,13 +153,13 @@ class TestNabd(unittest.TestCase):
       packet_j = json.loads(packet.decode('utf8'))
       self.assertEqual(packet_j['type'], 'state')
       self.assertEqual(packet_j['state'], 'playing')
-      time.sleep(3) # give time to play sequence
+      self.advance(3) # play sequence
       packet = s2.readline() # response packet
       packet_j = json.loads(packet.decode('utf8'))
       self.assertEqual(packet_j['type'], 'response')
       self.assertEqual(packet_j['request_id'], 'command_request_1')
       self.assertEqual(packet_j['status'], 'ok')
-      time.sleep(3) # give time to play sequence
+      self.advance(3) # play sequence
       packet = s2.readline() # response packet
       packet_j = json.loads(packet.decode('utf8'))
       self.assertEqual(packet_j['type'], 'response')
@@ -178,6 +191,42 @@ class TestNabd(unittest.TestCase):
     finally:
       s1.close()
 
+  def test_info_tempo_colors_checked(self):
+    s1 = self.service_socket()
+    try:
+      packet = s1.readline() # state packet
+      for animation in ['{"tempo":0,"colors":[{"left":"ffff00"}]}', '{"tempo":-5,"colors":[{"left":"ffff00"}]}', '{"tempo":"25","colors":[{"left":"ffff00"}]}', '{"tempo":25,"colors":[]}']:
+        s1.write(('{"type":"info","info_id":"weather","request_id":"test_id","animation":' + animation + '}\r\n').encode('utf8'))
+        packet = s1.readline() # response packet
+        packet_j = json.loads(packet.decode('utf8'))
+        self.assertEqual(packet_j['status'], 'error')
+        self.assertEqual(packet_j['class'], 'MalformedPacket')
+      self.advance(10)
+      self.assertEqual(self.nabio.played_infos, [])
+    finally:
+      s1.close()
+
+  def test_info_priority_dwell_checked(self):
+    s1 = self.service_socket()
+    try:
+      packet = s1.readline() # state packet
+      for slots in ['"priority":"high"', '"dwell":"10"', '"dwell":0', '"dwell":-1', '"priority":true']:
+        s1.write(('{"type":"info","info_id":"weather","request_id":"test_id","animation":{"tempo":25,"colors":[{"left":"ffff00"}]},' + slots + '}\r\n').encode('utf8'))
+        packet = s1.readline() # response packet
+        packet_j = json.loads(packet.decode('utf8'))
+        self.assertEqual(packet_j['request_id'], 'test_id')
+        self.assertEqual(packet_j['status'], 'error')
+        self.assertEqual(packet_j['class'], 'MalformedPacket')
+      s1.write(b'{"type":"info","info_id":"weather","request_id":"ok_id","priority":2,"dwell":1.5,"animation":{"tempo":25,"colors":[{"left":"ffff00"}]}}\r\n')
+      packet = s1.readline() # response packet
+      packet_j = json.loads(packet.decode('utf8'))
+      self.assertEqual(packet_j['request_id'], 'ok_id')
+      self.assertEqual(packet_j['status'], 'ok')
+      self.advance(10)
+      self.assertEqual(self.nabio.played_infos[-1], {'tempo':25,'colors':[{'left':'ffff00'}]})
+    finally:
+      s1.close()
+
   def test_info(self):
     s1 = self.service_socket()
     self.assertEqual(self.nabio.played_infos, [])
@@ -190,7 +239,7 @@ class TestNabd(unittest.TestCase):
       self.assertEqual(packet_j['type'], 'response')
       self.assertEqual(packet_j['request_id'], 'test_id')
       self.assertEqual(packet_j['status'], 'ok')
-      time.sleep(10) # give time to play info once
+      self.advance(10) # play info once
       last_info = self.nabio.played_infos.pop()
       self.assertEqual(last_info, {'tempo':25,'colors':[{'left':'ffff00','center':'ffff00','right':'ffff00'},{'left':'ffff00','center':'ffff00','right':'ffff00'},{'left':'ffff00','center':'ffff00','right':'ffff00'},{'left':'ffff00','center':'ffff00','right':'ffff00'},{'left':'ffff00','center':'ffff00','right':'ffff00'},{'left':'000000','center':'000000','right':'000000'},{'left':'000000','center':'000000','right':'000000'},{'left':'000000','center':'000000','right':'000000'}]})
       # [25 {3 3 3 3 3 3 3 3 3 3 3 3 3 3 3 0 0 0 0 0 0 0 0 0}] // soleil
@@ -200,7 +249,7 @@ class TestNabd(unittest.TestCase):
       self.assertEqual(packet_j['type'], 'response')
       self.assertEqual(packet_j['request_id'], 'clear_id')
       self.assertEqual(packet_j['status'], 'ok')
-      time.sleep(20) # make sure info is not played
+      self.advance(20) # make sure info is not played
       self.assertEqual(self.nabio.played_infos, [])
     finally:
       s1.close()
@@ -214,9 +263,8 @@ class TestNabd(unittest.TestCase):
       packet_j = json.loads(packet.decode('utf8'))
       self.assertEqual(packet_j['type'], 'state')
       self.assertEqual(packet_j['state'], 'playing')
-      s1.settimeout(15.0)
+      self.advance(3) # play sequence
       packet = s1.readline() # response packet
-      s1.settimeout(5.0)
       packet_j = json.loads(packet.decode('utf8'))
       self.assertEqual(packet_j['type'], 'response')
       self.assertEqual(packet_j['request_id'], 'test_id')
@@ -229,3 +277,100 @@ class TestNabd(unittest.TestCase):
       self.assertEqual(packet_j['state'], 'idle')
     finally:
       s1.close()
+
+  def test_command_expired(self):
+    s1 = self.service_socket()
+    try:
+      packet = s1.readline() # state packet
+      s1.write(b'{"type":"command","request_id":"test_id","sequence":[],"expiration":"2000-01-01T00:00:00+00:00"}\r\n')
+      packet = s1.readline() # response packet
+      packet_j = json.loads(packet.decode('utf8'))
+      self.assertEqual(packet_j['type'], 'response')
+      self.assertEqual(packet_j['request_id'], 'test_id')
+      self.assertEqual(packet_j['status'], 'expired')
+      self.assertTrue('expected_start' in packet_j)
+      self.assertEqual(self.nabio.played_sequences, [])
+    finally:
+      s1.close()
+
+  def test_command_null_expiration(self):
+    s1 = self.service_socket()
+    try:
+      packet = s1.readline() # state packet
+      s1.write(b'{"type":"command","request_id":"test_id","sequence":[],"expiration":null}\r\n')
+      packet = s1.readline() # state packet (playing)
+      self.advance(3) # play sequence
+      packet = s1.readline() # response packet
+      packet_j = json.loads(packet.decode('utf8'))
+      self.assertEqual(packet_j['type'], 'response')
+      self.assertEqual(packet_j['request_id'], 'test_id')
+      self.assertEqual(packet_j['status'], 'ok')
+      self.assertEqual(len(self.nabio.played_sequences), 1)
+    finally:
+      s1.close()
+
+  def test_invalid_expiration(self):
+    s1 = self.service_socket()
+    try:
+      packet = s1.readline() # state packet
+      # while playing, other items are queued
+      s1.write(b'{"type":"command","request_id":"first_id","sequence":[]}\r\n')
+      packet = s1.readline() # state packet (playing)
+      for (packet_type, slot, expiration) in [('command', 'sequence', '"tomorrow"'), ('command', 'sequence', '"2020-13-45T00:00:00"'), ('message', 'body', '12')]:
+        s1.write(('{"type":"' + packet_type + '","request_id":"test_id","' + slot + '":[],"expiration":' + expiration + '}\r\n').encode('utf8'))
+        packet = s1.readline() # response packet
+        packet_j = json.loads(packet.decode('utf8'))
+        self.assertEqual(packet_j['type'], 'response')
+        self.assertEqual(packet_j['request_id'], 'test_id')
+        self.assertEqual(packet_j['status'], 'error')
+        self.assertEqual(packet_j['class'], 'MalformedPacket')
+      self.advance(3) # play sequence
+      packet = s1.readline() # response packet
+      packet_j = json.loads(packet.decode('utf8'))
+      self.assertEqual(packet_j['request_id'], 'first_id')
+      self.assertEqual(packet_j['status'], 'ok')
+      packet = s1.readline() # state packet (idle)
+      packet_j = json.loads(packet.decode('utf8'))
+      self.assertEqual(packet_j['state'], 'idle')
+      self.assertEqual(len(self.nabio.played_sequences), 1)
+    finally:
+      s1.close()
+
+  def test_ears_move_cancelled_leaving_idle(self):
+    moves = []
+    async def move_ears(left_ear, right_ear):
+      moves.append(('start', left_ear, right_ear))
+      await asyncio.sleep(1)
+      moves.append(('end', left_ear, right_ear))
+    self.nabio.move_ears = move_ears
+    s1 = self.service_socket()
+    try:
+      packet = s1.readline() # state packet
+      s1.write(b'{"type":"ears","request_id":"ears_id","left":5,"right":7}\r\n')
+      packet = s1.readline() # response packet
+      s1.write(b'{"type":"sleep","request_id":"sleep_id"}\r\n')
+      packet = s1.readline() # response packet
+      self.advance(3)
+      packet = s1.readline() # new state packet
+      packet_j = json.loads(packet.decode('utf8'))
+      self.assertEqual(packet_j['state'], 'asleep')
+      sleep = nabd.Nabd.SLEEP_EAR_POSITION
+      self.assertEqual(moves, [('start', 5, 7), ('start', sleep, sleep), ('end', sleep, sleep)])
+    finally:
+      s1.close()
+
+  def test_diagnostics(self):
+    s1 = self.service_socket()
+    try:
+      packet = s1.readline() # state packet
+      s1.write(b'{"type":"diagnostics","request_id":"test_id"}\r\n')
+      packet = s1.readline() # response packet
+      packet_j = json.loads(packet.decode('utf8'))
+      self.assertEqual(packet_j['type'], 'response')
+      self.assertEqual(packet_j['request_id'], 'test_id')
+      self.assertEqual(packet_j['status'], 'ok')
+      self.assertEqual(packet_j['diagnostics']['ears'], None)
+      self.assertTrue('lanes' in packet_j['diagnostics']['executors'])
+      self.assertTrue(len(packet_j['diagnostics']['executors']['threads']) > 0)
+    finally:
+      s1.close()
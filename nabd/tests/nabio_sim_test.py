@@ -0,0 +1,92 @@
+import unittest, asyncio, os, tempfile
+from nabcommon.clock import VirtualTimeEventLoop
+from nabd.nabio_sim import NabIOSim, SimTimeline, EarsSim
+from nabd.ears import Ears
+from nabd.nabio import NabIO
+from nabd.leds import Leds
+
+class TestNabIOSim(unittest.TestCase):
+  def setUp(self):
+    self.loop = VirtualTimeEventLoop()
+    asyncio.set_event_loop(self.loop)
+    self.nabio = NabIOSim()
+    self.timeline = self.nabio.timeline
+
+  def tearDown(self):
+    self.loop.close()
+    asyncio.set_event_loop(None)
+
+  def test_ears_speed(self):
+    self.loop.run_until_complete(self.nabio.move_ears(3, 0))
+    self.assertEqual(self.timeline.filter('ear'), [(0.125, [0, 1]), (0.25, [0, 2]), (0.375, [0, 3])])
+    self.assertEqual(self.timeline.filter('motor'), [(0.0, [0, 1]), (0.375, [0, 0])])
+
+  def test_missing_hole(self):
+    self.nabio.ears.positions = [16, 0]
+    self.loop.run_until_complete(self.nabio.move_ears(1, 0))
+    self.assertEqual(self.timeline.filter('ear'), [(EarsSim.STEP_DURATION * 2, [0, 0]), (EarsSim.STEP_DURATION * 3, [0, 1])])
+
+  def test_retarget(self):
+    async def retarget():
+      await self.nabio.ears.go(Ears.RIGHT_EAR, 10, Ears.FORWARD_DIRECTION)
+      await asyncio.sleep(0.3)
+      await self.nabio.ears.go(Ears.RIGHT_EAR, 1, Ears.BACKWARD_DIRECTION)
+      await self.nabio.ears.wait_while_running()
+    self.loop.run_until_complete(retarget())
+    self.assertEqual([data for (time, data) in self.timeline.filter('ear')], [[1, 1], [1, 2], [1, 1]])
+    self.assertEqual(self.nabio.ears.positions, [0, 1])
+
+  def test_info(self):
+    condvar = asyncio.Condition()
+    async def play():
+      async with condvar:
+        await self.nabio.play_info(condvar, 10, [{'left': 'ff0000'}, {'right': '00ff00'}], 0.45)
+    self.loop.run_until_complete(play())
+    leds = self.timeline.filter('leds')
+    self.assertEqual(len(leds), 5)
+    self.assertEqual(leds[0], (0.0, ['000000', 'ff0000', '000000', '000000', '000000']))
+    self.assertEqual(leds[1], (0.1, ['000000', '000000', '000000', '00ff00', '000000']))
+    self.assertEqual(self.nabio.leds.playing, None)
+
+  def test_info_timelines_bounded(self):
+    condvar = asyncio.Condition()
+    async def play(color):
+      async with condvar:
+        await self.nabio.play_info(condvar, 10, [{'left': color}], 0.1)
+    for index in range(NabIO.INFO_TIMELINES_SIZE + 4):
+      self.loop.run_until_complete(play('{c:06x}'.format(c=index)))
+      # most recently used animation is kept
+      self.loop.run_until_complete(play('000000'))
+    self.assertEqual(len(self.nabio.info_timelines), NabIO.INFO_TIMELINES_SIZE)
+    self.assertIn('"000000"', list(self.nabio.info_timelines.keys())[-1])
+
+  def test_sequence(self):
+    listen = os.path.join(os.path.dirname(__file__), '..', 'sounds', 'asr', 'listen.mp3')
+    self.loop.run_until_complete(self.nabio.sound.play_list([listen], True))
+    audio = self.timeline.filter('audio')
+    self.assertEqual(len(audio), 1)
+    (start, [resource, duration]) = audio[0]
+    self.assertEqual(resource, listen)
+    self.assertAlmostEqual(duration, 0.552, 3)
+    self.assertEqual(self.timeline.filter('audio_end'), [(round(start + duration, 6), resource)])
+
+  def test_stream_stopped(self):
+    async def play():
+      await self.nabio.sound.start_playing_preloaded('http://example.com/stream')
+      await asyncio.sleep(60)
+      await self.nabio.sound.stop_playing()
+    self.loop.run_until_complete(play())
+    self.assertEqual(self.timeline.filter('audio_stop'), [(60.0, 'http://example.com/stream')])
+
+  def test_export(self):
+    self.nabio.set_leds(None, (255, 0, 0), None, None, None)
+    self.nabio.pulse(Leds.LED_BOTTOM, (255, 0, 255))
+    self.loop.run_until_complete(self.nabio.move_ears(1, 0))
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, 'timeline.jsonl')
+      self.timeline.export(path)
+      with open(path) as f:
+        lines = f.read().splitlines()
+      self.assertEqual(lines[0], '[0,"leds",["000000","ff0000","000000","000000","000000"]]')
+      self.assertEqual(lines[1], '[0,"pulse",[4,"ff00ff"]]')
+      self.assertEqual(SimTimeline.load(path), [(time, kind, data) for (time, kind, data) in self.timeline.events])
@@ -0,0 +1,67 @@
+import unittest, tempfile, os, wave, struct
+from nabd.pcm_cache import PCMCache
+
+class TestPCMCache(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.base_dir = self.tmpdir.name
+    self.sounds_dir = os.path.join(self.base_dir, 'nabtest', 'sounds', 'nabtest')
+    os.makedirs(self.sounds_dir)
+    self.container = os.path.join(self.base_dir, 'sounds.pcm')
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def write_wav(self, name, rate, channels, frames):
+    filename = os.path.join(self.sounds_dir, name)
+    with wave.open(filename, 'wb') as f:
+      f.setnchannels(channels)
+      f.setsampwidth(2)
+      f.setframerate(rate)
+      samples = [1000 * (i % 7) for i in range(frames * channels)]
+      f.writeframes(struct.pack('<%dh' % len(samples), *samples))
+    return filename
+
+  def test_sound_files(self):
+    a = self.write_wav('a.wav', 22050, 1, 100)
+    b = self.write_wav('b.wav', 44100, 2, 100)
+    with open(os.path.join(self.sounds_dir, 'readme.txt'), 'w') as f:
+      f.write('not a sound')
+    files = list(PCMCache.sound_files(self.base_dir, ['nabtest', 'nabmissing']))
+    self.assertEqual(files, [a, b])
+
+  def test_build_and_lookup(self):
+    a = self.write_wav('a.wav', 48000, 1, 4800)
+    b = self.write_wav('b.wav', 48000, 2, 2400)
+    count = PCMCache.build(self.container, self.base_dir, [a, b], 48000, 2)
+    self.assertEqual(count, 2)
+    cache = PCMCache.open(self.container, self.base_dir, 48000, 2)
+    self.assertNotEqual(cache, None)
+    pcm_a = cache.lookup(a)
+    pcm_b = cache.lookup(b)
+    # mono is converted to stereo
+    self.assertEqual(len(pcm_a), 4800 * 4)
+    self.assertEqual(len(pcm_b), 2400 * 4)
+    self.assertEqual(struct.unpack_from('<4h', pcm_a), (0, 0, 1000, 1000))
+    self.assertEqual(struct.unpack_from('<4h', pcm_b), (0, 1000, 2000, 3000))
+    self.assertEqual(cache.lookup(os.path.join(self.sounds_dir, 'c.wav')), None)
+
+  def test_resample(self):
+    a = self.write_wav('a.wav', 22050, 2, 22050)
+    PCMCache.build(self.container, self.base_dir, [a], 44100, 2)
+    cache = PCMCache.open(self.container, self.base_dir, 44100, 2)
+    frames = len(cache.lookup(a)) / cache.frame_size()
+    self.assertTrue(abs(frames - 44100) < 10)
+
+  def test_format_mismatch(self):
+    a = self.write_wav('a.wav', 44100, 2, 100)
+    PCMCache.build(self.container, self.base_dir, [a], 44100, 2)
+    self.assertEqual(PCMCache.open(self.container, self.base_dir, 48000, 2), None)
+    self.assertEqual(PCMCache.open(os.path.join(self.base_dir, 'missing.pcm'), self.base_dir), None)
+
+  def test_stale_entry(self):
+    a = self.write_wav('a.wav', 44100, 2, 100)
+    PCMCache.build(self.container, self.base_dir, [a], 44100, 2)
+    self.write_wav('a.wav', 44100, 2, 200)
+    cache = PCMCache.open(self.container, self.base_dir, 44100, 2)
+    self.assertEqual(cache.lookup(a), None)
@@ -0,0 +1,74 @@
+import unittest
+from nabd.preroll import Preroll
+
+class TestPreroll(unittest.TestCase):
+  """
+  Samples are one byte at 1 Hz, so that byte offsets are seconds.
+  """
+  def setUp(self):
+    self.received = []
+    self.now = 0
+
+  def stream_cb(self, data, finalize):
+    self.received.append((data, finalize))
+
+  def preroll(self, preroll_bytes, hold_bytes):
+    return Preroll(self.stream_cb, preroll_bytes, hold_bytes, 1, 1, clock=lambda: self.now)
+
+  def feed(self, preroll, data, finalize=False):
+    self.now = self.now + len(data)
+    preroll.feed(data, finalize)
+
+  def test_preroll(self):
+    preroll = self.preroll(2, 6)
+    self.feed(preroll, b'aaaa')
+    self.feed(preroll, b'bbbb')
+    self.feed(preroll, b'cccc')
+    self.assertEqual(self.received, [])
+    # cue ended at 9, signaled at 12, preroll starts at 7
+    preroll.release(9)
+    self.assertEqual(self.received, [(b'b', False), (b'cccc', False)])
+    self.feed(preroll, b'dddd')
+    self.feed(preroll, b'', True)
+    self.assertEqual(self.received[2:], [(b'dddd', False), (b'', True)])
+
+  def test_cue_samples_never_forwarded(self):
+    preroll = self.preroll(1, 16)
+    self.feed(preroll, b'aaaa')
+    # cue ended at 6, signaled before the chunk including it was captured
+    preroll.release(6)
+    self.assertEqual(self.received, [])
+    self.feed(preroll, b'bbbb')
+    self.feed(preroll, b'cccc')
+    self.assertEqual(self.received, [(b'bbb', False), (b'cccc', False)])
+
+  def test_no_preroll(self):
+    preroll = self.preroll(0, 16)
+    self.feed(preroll, b'aaaa')
+    self.feed(preroll, b'bbbb')
+    preroll.release(6)
+    self.assertEqual(self.received, [(b'bb', False)])
+
+  def test_short_hold(self):
+    preroll = self.preroll(4, 2)
+    self.feed(preroll, b'aaaa')
+    self.feed(preroll, b'bbbb')
+    preroll.release(6)
+    # older samples are not held
+    self.assertEqual(self.received, [(b'bbbb', False)])
+
+  def test_multibyte_samples(self):
+    preroll = Preroll(self.stream_cb, 2, 16, 1, 2, clock=lambda: self.now)
+    self.now = 4
+    preroll.feed(b'aabbccdd', False)
+    preroll.release(2.5)
+    # sample captured from 1 to 2 includes the start of the preroll
+    self.assertEqual(self.received, [(b'ccdd', False)])
+
+  def test_finalize_before_release(self):
+    preroll = self.preroll(2, 4)
+    self.feed(preroll, b'aaaa')
+    self.feed(preroll, b'bb', True)
+    self.assertEqual(self.received, [(b'', True)])
+    preroll.release(6)
+    self.assertEqual(len(self.received), 1)
@@ -0,0 +1,68 @@
+import unittest, os, tempfile, json
+from nabd import nabbench
+from nabd.nabbench import NabBench
+from nabd.nabio_sim import NabIOSim
+from nabd.session_recorder import SessionRecorder
+from nabd.nabreplay import SessionReplayer
+
+class TestSessionRecorder(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmpdir.name, 'session.log')
+    self.socket_path = os.path.join(self.tmpdir.name, 'nabd.sock')
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def record(self, clients, packets):
+    recorders = []
+    def setup(nabd):
+      nabd.recorder = SessionRecorder(self.path)
+      recorders.append(nabd.recorder)
+    bench = NabBench(clients, packets, nabbench.parse_mix('info,command,ears'), path=self.socket_path)
+    nabbench.run_nabd(NabIOSim(), lambda nabd: bench.run_clients(), path=self.socket_path, virtual_time=True, setup=setup)
+    recorders[0].stop()
+
+  def test_record(self):
+    self.record(2, 5)
+    self.record(1, 1)
+    sessions = SessionRecorder.load(self.path)
+    self.assertEqual(len(sessions), 2)
+    session = sessions[0]
+    self.assertEqual(session[0][2], 'session')
+    kinds = [kind for (time, connection, kind, data) in session]
+    self.assertEqual(kinds.count('open'), 2)
+    self.assertEqual(kinds.count('close'), 2)
+    self.assertEqual(kinds.count('in'), 10)
+    inbound = [data for (time, connection, kind, data) in session if kind == 'in' and connection == 1]
+    self.assertEqual([packet['request_id'] for packet in inbound], ['0-{n}'.format(n=n) for n in range(5)])
+    times = [time for (time, connection, kind, data) in session]
+    self.assertEqual(times, sorted(times))
+
+  def test_truncated_record(self):
+    self.record(1, 2)
+    with open(self.path, 'a') as f:
+      f.write('[12.5,1,"in",{"type":')
+    self.assertEqual(len(SessionRecorder.load(self.path)[0]), 3 + 2 * 2 + 1)
+
+  def replay(self, fast):
+    session = SessionRecorder.load(self.path)[-1]
+    replayer = SessionReplayer(session, fast)
+    replay_path = os.path.join(self.tmpdir.name, 'replay.sock')
+    duration = nabbench.run_nabd(NabIOSim(), lambda nabd: replayer.replay(path=replay_path), path=replay_path, virtual_time=True)
+    return replayer.results(duration)
+
+  def test_replay_fast(self):
+    self.record(3, 4)
+    results = self.replay(True)
+    self.assertEqual(results['connections'], 3)
+    self.assertEqual(results['sent'], 12)
+    self.assertEqual(results['responses'], 12)
+    self.assertEqual(results['timeouts'], 0)
+    self.assertEqual(results['mismatches'], [])
+
+  def test_replay_timed(self):
+    self.record(2, 3)
+    results = self.replay(False)
+    self.assertEqual(results['sent'], 6)
+    self.assertEqual(results['mismatches'], [])
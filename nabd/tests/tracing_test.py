@@ -0,0 +1,103 @@
+import unittest, asyncio, json, os, tempfile, threading
+from nabd import nabbench
+from nabd.nabio_sim import NabIOSim
+from nabd.tracing import Tracer, tracer
+from nabd.executors import ExecutorRegistry
+
+CHOR = os.path.join(os.path.dirname(__file__), '..', 'choreographies', 'nabd', 'streaming', '1.chor')
+
+class TestTracer(unittest.TestCase):
+  def test_spans(self):
+    t = Tracer()
+    with t.span('outside'):
+      pass
+    token = t.activate('req1')
+    with t.span('outer', a=1):
+      t.instant('mark', b=2)
+    wait = t.span('wait')
+    t.deactivate(token)
+    wait.end(c=3)
+    wait.end()
+    t.instant('other', 'req2')
+    self.assertEqual([(kind, name, trace_id) for (kind, name, trace_id, start, end, tid, thread, args) in t.events], [
+      ('instant', 'mark', 'req1'),
+      ('span', 'outer', 'req1'),
+      ('span', 'wait', 'req1'),
+      ('instant', 'other', 'req2'),
+    ])
+    self.assertEqual(t.events[2][7], {'c': 3})
+
+  def test_error(self):
+    t = Tracer()
+    with self.assertRaises(ValueError):
+      with t.span('failing', 'req1'):
+        raise ValueError()
+    self.assertEqual(t.events[0][7], {'error': 'ValueError'})
+
+  def test_ring_buffer(self):
+    t = Tracer(capacity=3)
+    for i in range(5):
+      t.instant('event{i}'.format(i=i), 'req')
+    self.assertEqual([event[1] for event in t.events], ['event2', 'event3', 'event4'])
+
+  def test_trace_id(self):
+    t = Tracer()
+    self.assertEqual(t.trace_id({'request_id': 12}), '12')
+    self.assertEqual(t.trace_id({'type': 'info'}), '#1')
+    self.assertEqual(t.trace_id(['request_id']), '#2')
+
+  def test_export(self):
+    t = Tracer()
+    with t.span('outer', 'req1'):
+      t.instant('mark', 'req1')
+    t.instant('other', 'req2')
+    trace = t.export('req1')
+    events = trace['traceEvents']
+    self.assertEqual([(event['ph'], event['name']) for event in events], [('b', 'outer'), ('n', 'mark'), ('e', 'outer'), ('M', 'thread_name')])
+    self.assertEqual(set([event['id'] for event in events if event['ph'] != 'M']), set(['req1']))
+    self.assertEqual(events[-1]['args'], {'name': threading.current_thread().name})
+    self.assertTrue(events[0]['ts'] <= events[1]['ts'] <= events[2]['ts'])
+    self.assertEqual(len(t.export()['traceEvents']), 5)
+    json.dumps(trace)
+
+  def test_executor_context(self):
+    t = Tracer()
+    registry = ExecutorRegistry()
+    lane = registry.lane('trace', dedicated=True)
+    token = t.activate('req1')
+    future = lane.submit(lambda: t.instant('in_thread'))
+    t.deactivate(token)
+    future.result()
+    lane.shutdown()
+    self.assertEqual(t.events[0][2], 'req1')
+    self.assertEqual(t.events[0][6], 'trace-0')
+
+class TestNabdTracing(unittest.TestCase):
+  def setUp(self):
+    tracer.clear()
+
+  def test_message_trace(self):
+    responses = {}
+    async def client(path):
+      (reader, writer) = await nabbench.connect(path)
+      async def request(packet):
+        writer.write((json.dumps(packet) + '\r\n').encode('utf8'))
+        while True:
+          response = json.loads((await reader.readline()).decode('utf8'))
+          if response['type'] == 'response' and response.get('request_id') == packet['request_id']:
+            return response
+      message = {'type':'message', 'request_id':'msg1', 'signature':{'choreography':None}, 'body':[{'audio':[nabbench.SOUND], 'choreography':os.path.abspath(CHOR)}]}
+      responses['message'] = await request(message)
+      responses['diagnostics'] = await request({'type':'diagnostics', 'request_id':'diag', 'trace':'msg1'})
+      writer.close()
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, 'nabd.sock')
+      nabbench.run_nabd(NabIOSim(), lambda nabd: client(path), path=path, virtual_time=True)
+    self.assertEqual(responses['message']['status'], 'ok')
+    events = responses['diagnostics']['diagnostics']['trace']['traceEvents']
+    names = [event['name'] for event in events if event['ph'] in ['b', 'n']]
+    for name in ['process_packet', 'enqueue', 'queue_wait', 'play', 'play_message', 'preload', 'resolve', 'choreography', 'first_sample', 'response']:
+      self.assertIn(name, names)
+    self.assertEqual(set([event['id'] for event in events if event['ph'] != 'M']), set(['msg1']))
+    begin = {event['name']: event['ts'] for event in events if event['ph'] == 'b'}
+    self.assertTrue(begin['queue_wait'] <= begin['play'] <= begin['play_message'] <= begin['preload'])
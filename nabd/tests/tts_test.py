@@ -0,0 +1,96 @@
+import unittest, asyncio, tempfile, os
+from nabd.tts import TTS, TTSPico, TTSEspeak
+
+class TTSFake(TTS):
+  def __init__(self, cache_dir, max_concurrent=1, max_cache_bytes=TTS.MAX_CACHE_BYTES):
+    super().__init__(cache_dir, max_concurrent, max_cache_bytes)
+    self.syntheses = []
+    self.running = 0
+    self.max_running = 0
+
+  def voice(self, locale):
+    return locale.lower()
+
+  async def synthesize(self, voice, text, output):
+    self.syntheses.append((voice, text))
+    self.running = self.running + 1
+    self.max_running = max(self.running, self.max_running)
+    await asyncio.sleep(0.05)
+    self.running = self.running - 1
+    if text == 'fail':
+      raise RuntimeError('synthesis failed')
+    with open(output, 'wb') as f:
+      f.write(b'RIFF')
+
+class TestTTS(unittest.TestCase):
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.tmpdir = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+    self.loop.close()
+
+  def test_parse(self):
+    self.assertEqual(TTS.parse('tts:fr_FR,Bonjour'), ('fr_FR', 'Bonjour'))
+    self.assertEqual(TTS.parse('tts:en-US,Hello, world'), ('en_US', 'Hello, world'))
+    self.assertEqual(TTS.parse('tts:Bonjour'), ('fr_FR', 'Bonjour'))
+
+  def test_voices(self):
+    self.assertEqual(TTSPico(self.tmpdir.name).voice('fr_FR'), 'fr-FR')
+    self.assertEqual(TTSPico(self.tmpdir.name).voice('en_AU'), 'en-GB')
+    self.assertEqual(TTSEspeak(self.tmpdir.name).voice('en_US'), 'en-us')
+    self.assertEqual(TTSEspeak(self.tmpdir.name).voice('fr_FR'), 'fr')
+
+  def test_command_args(self):
+    # text is never parsed as an option
+    self.assertEqual(TTSPico(self.tmpdir.name).command_args('fr-FR', '-5 degrés', 'out.wav')[-2:], ['--', '-5 degrés'])
+    self.assertEqual(TTSEspeak(self.tmpdir.name).command_args('fr', '-5 degrés', 'out.wav')[-2:], ['--', '-5 degrés'])
+
+  def test_cache(self):
+    tts = TTSFake(self.tmpdir.name)
+    path1 = self.loop.run_until_complete(tts.get('tts:fr_FR,Il fait beau'))
+    path2 = self.loop.run_until_complete(tts.get('tts:fr_FR,Il fait beau'))
+    self.assertEqual(path1, path2)
+    self.assertTrue(os.path.isfile(path1))
+    self.assertEqual(tts.syntheses, [('fr_fr', 'Il fait beau')])
+    self.loop.run_until_complete(tts.get('tts:en_US,Il fait beau'))
+    self.assertEqual(len(tts.syntheses), 2)
+
+  def test_cache_eviction(self):
+    # each phrase is 4 bytes, the cache can hold 2 of them
+    tts = TTSFake(self.tmpdir.name, max_cache_bytes=10)
+    path_a = self.loop.run_until_complete(tts.get('tts:fr_FR,a'))
+    os.utime(path_a, (1, 1))
+    path_b = self.loop.run_until_complete(tts.get('tts:fr_FR,b'))
+    os.utime(path_b, (2, 2))
+    # a is used again and b becomes the least recently used phrase
+    self.assertEqual(self.loop.run_until_complete(tts.get('tts:fr_FR,a')), path_a)
+    path_c = self.loop.run_until_complete(tts.get('tts:fr_FR,c'))
+    self.assertTrue(os.path.isfile(path_a))
+    self.assertFalse(os.path.isfile(path_b))
+    self.assertTrue(os.path.isfile(path_c))
+    self.loop.run_until_complete(tts.get('tts:fr_FR,b'))
+    self.assertEqual(len(tts.syntheses), 4)
+
+  def test_concurrent_same_phrase(self):
+    tts = TTSFake(self.tmpdir.name)
+    paths = self.loop.run_until_complete(asyncio.gather(*[tts.get('tts:fr_FR,Il pleut') for i in range(3)]))
+    self.assertEqual(len(set(paths)), 1)
+    self.assertEqual(len(tts.syntheses), 1)
+
+  def test_concurrency_limit(self):
+    tts = TTSFake(self.tmpdir.name, 2)
+    texts = ['tts:fr_FR,phrase {i}'.format(i=i) for i in range(6)]
+    paths = self.loop.run_until_complete(asyncio.gather(*[tts.get(t) for t in texts]))
+    self.assertEqual(len(set(paths)), 6)
+    self.assertEqual(tts.max_running, 2)
+
+  def test_failure(self):
+    tts = TTSFake(self.tmpdir.name)
+    path = self.loop.run_until_complete(tts.get('tts:fr_FR,fail'))
+    self.assertEqual(path, None)
+    path = self.loop.run_until_complete(tts.get('tts:fr_FR,fail'))
+    self.assertEqual(path, None)
+    self.assertEqual(len(tts.syntheses), 2)
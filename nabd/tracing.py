@@ -0,0 +1,122 @@
+import collections, contextvars, itertools, os, threading
+from nabcommon.clock import Clock
+
+class Span(object):
+  """
+  Timed operation of a trace, recorded when it ends.
+  Spans can be used as context managers, or ended explicitly when they
+  cross tasks or threads (e.g. the wait of an item in the idle queue).
+  """
+  def __init__(self, tracer, name, trace_id, args):
+    self.tracer = tracer
+    self.name = name
+    self.trace_id = trace_id
+    self.args = args
+    self.start = tracer.clock.monotonic()
+    self.ended = False
+
+  def end(self, **args):
+    if self.ended:
+      return
+    self.ended = True
+    self.args.update(args)
+    self.tracer._record('span', self.name, self.trace_id, self.start, self.tracer.clock.monotonic(), self.args)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type != None:
+      self.args['error'] = exc_type.__name__
+    self.end()
+    return False
+
+class Tracer(object):
+  """
+  Ring buffer of spans and instant events of requests, keyed by trace id:
+  the request_id of the packet, or an internal id.
+  The current trace id is a context variable, which asyncio tasks inherit
+  and executor lanes propagate to their threads. Events outside of a trace
+  are not recorded.
+  Thread: any
+  """
+  CAPACITY = 4096
+
+  def __init__(self, capacity=CAPACITY, clock=Clock.REAL):
+    self.events = collections.deque(maxlen=capacity)
+    self.clock = clock
+    self.enabled = True
+    self.current = contextvars.ContextVar('trace_id', default=None)
+    self.ids = itertools.count(1)
+
+  def trace_id(self, packet):
+    """
+    Return the trace id of a packet.
+    """
+    if isinstance(packet, dict) and 'request_id' in packet:
+      return str(packet['request_id'])
+    return '#{n}'.format(n=next(self.ids))
+
+  def activate(self, trace_id):
+    """
+    Make trace_id the current trace id, return a token for deactivate.
+    """
+    return self.current.set(trace_id)
+
+  def deactivate(self, token):
+    self.current.reset(token)
+
+  def span(self, name, trace_id=None, **args):
+    """
+    Start a span of the given trace, or of the current trace.
+    """
+    if trace_id == None:
+      trace_id = self.current.get()
+    return Span(self, name, trace_id, args)
+
+  def instant(self, name, trace_id=None, **args):
+    """
+    Record an instant event of the given trace, or of the current trace.
+    """
+    if trace_id == None:
+      trace_id = self.current.get()
+    now = self.clock.monotonic()
+    self._record('instant', name, trace_id, now, now, args)
+
+  def _record(self, kind, name, trace_id, start, end, args):
+    if self.enabled and trace_id != None:
+      thread = threading.current_thread()
+      self.events.append((kind, name, trace_id, start, end, thread.ident, thread.name, args))
+
+  def clear(self):
+    self.events.clear()
+
+  def export(self, trace_id=None):
+    """
+    Export events, of all traces or of a given trace, in Chrome trace event
+    format, which Perfetto and chrome://tracing open. Each trace is an
+    async track, times are in microseconds of the monotonic clock.
+    """
+    pid = os.getpid()
+    trace_events = []
+    threads = {}
+    for (kind, name, event_trace_id, start, end, tid, thread_name, args) in list(self.events):
+      if trace_id != None and event_trace_id != trace_id:
+        continue
+      threads[tid] = thread_name
+      event = {'name': name, 'cat': 'nabd', 'id': event_trace_id, 'pid': pid, 'tid': tid, 'ts': round(start * 1000000)}
+      if kind == 'instant':
+        event['ph'] = 'n'
+        event['args'] = args
+        trace_events.append(event)
+      else:
+        event['ph'] = 'b'
+        event['args'] = args
+        trace_events.append(event)
+        trace_events.append({'name': name, 'cat': 'nabd', 'id': event_trace_id, 'pid': pid, 'tid': tid, 'ts': round(end * 1000000), 'ph': 'e'})
+    trace_events.sort(key=lambda event: event['ts'])
+    for (tid, thread_name) in threads.items():
+      trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+tracer = Tracer()
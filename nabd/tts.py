@@ -0,0 +1,208 @@
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+
+class TTS(object, metaclass=abc.ABCMeta):
+  """
+  Interface for offline text-to-speech backends.
+  Synthesized audio is stored in a content-addressed cache keyed by backend,
+  locale, voice and text, so that a given phrase is only synthesized once.
+  The cache is bounded by max_cache_bytes: least recently used files are
+  evicted when a new phrase is synthesized. Use is tracked with the
+  modification time of files, as access times may not be maintained.
+  """
+  URN_PREFIX = 'tts:'
+  DEFAULT_CACHE_DIR = '/var/cache/nabd/tts'
+  DEFAULT_LOCALE = 'fr_FR'
+  MAX_CONCURRENT_SYNTHESES = 1
+  MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+  def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_concurrent=MAX_CONCURRENT_SYNTHESES, max_cache_bytes=MAX_CACHE_BYTES):
+    self.cache_dir = cache_dir
+    self.max_concurrent = max_concurrent
+    self.max_cache_bytes = max_cache_bytes
+    self.semaphore = None
+    self.pending = {}
+
+  @abc.abstractmethod
+  def voice(self, locale):
+    """
+    Return the backend voice for a given locale (e.g. fr_FR).
+    """
+    raise NotImplementedError( 'Should have implemented' )
+
+  @abc.abstractmethod
+  async def synthesize(self, voice, text, output):
+    """
+    Synthesize text with voice into output wav file.
+    Raise an exception on failure.
+    """
+    raise NotImplementedError( 'Should have implemented' )
+
+  @staticmethod
+  def parse(resource):
+    """
+    Parse a tts:<locale>,<text> resource into a (locale, text) tuple.
+    """
+    spec = resource[len(TTS.URN_PREFIX):]
+    if ',' in spec:
+      locale, text = spec.split(',', 1)
+    else:
+      locale, text = '', spec
+    locale = locale.strip().replace('-', '_')
+    if locale == '':
+      locale = TTS.DEFAULT_LOCALE
+    return (locale, text.strip())
+
+  def cache_key(self, locale, voice, text):
+    key_str = json.dumps([type(self).__name__, locale, voice, text])
+    return hashlib.sha256(key_str.encode('utf8')).hexdigest()
+
+  def cache_path(self, key):
+    return os.path.join(self.cache_dir, key[:2], key + '.wav')
+
+  async def get(self, resource):
+    """
+    Return the path of the wav file for a tts: resource, synthesizing it if
+    it is not in the cache yet. Return None if synthesis failed.
+    Concurrent requests for the same phrase share a single synthesis.
+    """
+    locale, text = TTS.parse(resource)
+    if text == '':
+      return None
+    voice = self.voice(locale)
+    key = self.cache_key(locale, voice, text)
+    path = self.cache_path(key)
+    if os.path.isfile(path):
+      try:
+        os.utime(path)
+      except OSError:
+        pass
+      return path
+    future = self.pending.get(key)
+    if future == None or future.done():
+      future = asyncio.ensure_future(self._synthesize_to_cache(voice, text, path))
+      self.pending[key] = future
+    try:
+      return await asyncio.shield(future)
+    finally:
+      if future.done() and self.pending.get(key) is future:
+        del self.pending[key]
+
+  async def _synthesize_to_cache(self, voice, text, path):
+    if self.semaphore == None:
+      self.semaphore = asyncio.Semaphore(self.max_concurrent)
+    async with self.semaphore:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      tmp_path = path + '.{pid}.tmp.wav'.format(pid=os.getpid())
+      try:
+        await self.synthesize(voice, text, tmp_path)
+        os.replace(tmp_path, path)
+      except Exception as err:
+        print('Warning : text-to-speech synthesis failed for {text} ({err})'.format(text=text, err=err))
+        if os.path.exists(tmp_path):
+          os.remove(tmp_path)
+        return None
+      self._evict(path)
+      return path
+
+  def _evict(self, keep):
+    """
+    Remove least recently used files until the cache fits in
+    max_cache_bytes. keep, the file just synthesized, is never removed.
+    """
+    entries = []
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(self.cache_dir):
+      for filename in filenames:
+        if not filename.endswith('.wav') or '.tmp.' in filename:
+          continue
+        path = os.path.join(dirpath, filename)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        total = total + stat.st_size
+        if path != keep:
+          entries.append((stat.st_mtime, path, stat.st_size))
+    entries.sort()
+    for (mtime, path, size) in entries:
+      if total <= self.max_cache_bytes:
+        break
+      try:
+        os.remove(path)
+        total = total - size
+      except OSError as err:
+        print('Warning : could not evict {path} from text-to-speech cache ({err})'.format(path=path, err=err))
+
+  @staticmethod
+  def default(cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Return an instance of the first available backend, or None.
+    """
+    for backend in [TTSPico, TTSEspeak]:
+      if backend.is_available():
+        return backend(cache_dir)
+    return None
+
+class TTSCommand(TTS, metaclass=abc.ABCMeta):
+  """
+  Backend invoking a local command line synthesizer.
+  """
+  COMMAND = None
+
+  @classmethod
+  def is_available(cls):
+    return shutil.which(cls.COMMAND) != None
+
+  @abc.abstractmethod
+  def command_args(self, voice, text, output):
+    raise NotImplementedError( 'Should have implemented' )
+
+  async def synthesize(self, voice, text, output):
+    process = await asyncio.create_subprocess_exec(
+      self.COMMAND, *self.command_args(voice, text, output),
+      stdout=asyncio.subprocess.DEVNULL,
+      stderr=asyncio.subprocess.PIPE)
+    (_, stderr) = await process.communicate()
+    if process.returncode != 0:
+      raise RuntimeError('{cmd} exited with {code}: {stderr}'.format(cmd=self.COMMAND, code=process.returncode, stderr=stderr.decode('utf8', 'replace').strip()))
+
+class TTSPico(TTSCommand):
+  """
+  SVOX Pico backend (pico2wave, package libttspico-utils).
+  """
+  COMMAND = 'pico2wave'
+  VOICES = ['de-DE', 'en-GB', 'en-US', 'es-ES', 'fr-FR', 'it-IT']
+
+  def voice(self, locale):
+    voice = locale.replace('_', '-')
+    if voice in TTSPico.VOICES:
+      return voice
+    for candidate in TTSPico.VOICES:
+      if candidate.startswith(voice[:2]):
+        return candidate
+    return TTS.DEFAULT_LOCALE.replace('_', '-')
+
+  def command_args(self, voice, text, output):
+    # text may start with '-'
+    return ['-l', voice, '-w', output, '--', text]
+
+class TTSEspeak(TTSCommand):
+  """
+  eSpeak NG backend.
+  """
+  COMMAND = 'espeak-ng'
+
+  def voice(self, locale):
+    (language, _, country) = locale.lower().partition('_')
+    if language == 'en' and country in ['us', 'gb']:
+      return language + '-' + country
+    return language
+
+  def command_args(self, voice, text, output):
+    # text may start with '-'
+    return ['-v', voice, '-w', output, '--', text]
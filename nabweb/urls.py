@@ -15,7 +15,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from .views import NabWebView, NabWebUpgradeView
+from .views import NabWebView, NabWebUpgradeView, NabWebTraceView, NabWebStatsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -27,4 +27,6 @@ urlpatterns = [
     path('nabweatherd/', include('nabweatherd.urls')),
     path('', NabWebView.as_view()),
     path('upgrade', NabWebUpgradeView.as_view(), name='nabweb.upgrade'),
+    path('trace', NabWebTraceView.as_view(), name='nabweb.trace'),
+    path('stats', NabWebStatsView.as_view(), name='nabweb.stats'),
 ]
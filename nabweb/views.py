@@ -5,7 +5,23 @@ from django.conf import settings
 from django.http import JsonResponse
 from nabd.i18n import Config
 from django.utils.translation import to_locale, to_language
-import os
+from nabcommon.nabservice import NabService
+import json, os, socket
+
+NABD_TIMEOUT = 5.0
+
+def nabd_request(packet, timeout=NABD_TIMEOUT):
+  """
+  Send a packet with a request_id to nabd and return its response.
+  """
+  with socket.create_connection(('127.0.0.1', NabService.PORT_NUMBER), timeout) as sock:
+    sock.sendall((json.dumps(packet) + '\r\n').encode('utf8'))
+    with sock.makefile('rb') as f:
+      for line in f:
+        response = json.loads(line.decode('utf8'))
+        if response.get('type') == 'response' and response.get('request_id') == packet['request_id']:
+          return response
+  raise ConnectionError('nabd closed the connection')
 
 class NabWebView(View):
   template_name = 'nabweb/index.html'
@@ -53,3 +69,26 @@ class NabWebUpgradeView(View):
       os.system('nohup bash {root_dir}/upgrade.sh &'.format(root_dir=root_dir))
       exit()
     return JsonResponse({'status': 'ok', 'root_dir': root_dir, 'old': head_sha1})
+
+class NabWebTraceView(View):
+  def get(self, request, *args, **kwargs):
+    trace = request.GET.get('request_id', True)
+    try:
+      response = nabd_request({'type': 'diagnostics', 'request_id': 'nabweb-trace', 'trace': trace})
+    except (OSError, ValueError) as err:
+      return JsonResponse({'status': 'error', 'message': 'Cannot get traces from nabd: {err}'.format(err=err)}, status=503)
+    trace_response = JsonResponse(response['diagnostics']['trace'])
+    trace_response['Content-Disposition'] = 'attachment; filename="nabd-trace.json"'
+    return trace_response
+
+class NabWebStatsView(View):
+  template_name = 'nabweb/stats.html'
+
+  def get(self, request, *args, **kwargs):
+    if request.GET.get('format') != 'json':
+      return render(request, NabWebStatsView.template_name)
+    try:
+      response = nabd_request({'type': 'stats', 'request_id': 'nabweb-stats'})
+    except (OSError, ValueError) as err:
+      return JsonResponse({'status': 'error', 'message': 'Cannot get statistics from nabd: {err}'.format(err=err)}, status=503)
+    return JsonResponse({'status': 'ok', 'stats': response['stats']})